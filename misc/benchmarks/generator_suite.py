@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from cProfile import Profile
+from json import dumps
+from multiprocessing import get_context
+from pathlib import Path
+from resource import RUSAGE_CHILDREN, RUSAGE_SELF, getrusage
+from sys import exit as sys_exit
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Dict, Iterator, Optional
+
+from utils import generate_variables, get_configurator, get_templator_args, write_variables
+
+from Templator import Templator  # type: ignore
+
+SCENARIOS = {"single-site": 0, "multisite-10": 10, "multisite-100": 100, "multisite-1k": 1000, "multisite-5k": 5000}
+
+
+@contextmanager
+def profile(profiler: Optional[str], path: Path) -> Iterator[None]:
+    """Profile the block with cProfile or pyinstrument and dump the result to the path (.prof or .html)."""
+    if not profiler:
+        yield
+        return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if profiler == "cprofile":
+        cprofiler = Profile()
+        cprofiler.enable()
+        try:
+            yield
+        finally:
+            cprofiler.disable()
+            cprofiler.dump_stats(path.with_suffix(".prof"))
+        return
+
+    from pyinstrument import Profiler  # type: ignore
+
+    pyinstrumenter = Profiler()
+    pyinstrumenter.start()
+    try:
+        yield
+    finally:
+        pyinstrumenter.stop()
+        path.with_suffix(".html").write_text(pyinstrumenter.output_html())
+
+
+def run_scenario(name: str, services: int, workers: int, profiler: Optional[str], profiles: Path) -> Dict[str, Any]:
+    """Run the generator on a synthetic variables.env in a fresh process and return its measurements."""
+    with TemporaryDirectory() as tmp_dir, profile(profiler, profiles.joinpath(f"generator-{name}")):
+        variables_path = write_variables(generate_variables(services), Path(tmp_dir, "variables.env"))
+
+        start = perf_counter()
+        config = get_configurator(variables_path.as_posix()).get_config()
+        config_time = perf_counter() - start
+
+        output = Path(tmp_dir, "output")
+        start = perf_counter()
+        Templator(*get_templator_args(output), config, workers=workers).render()
+        render_time = perf_counter() - start
+
+        files = [file.stat().st_size for file in output.rglob("*") if file.is_file()]
+
+    return {
+        "scenario": name,
+        "services": services,
+        "settings": len(config),
+        "config_time": config_time,
+        "render_time": render_time,
+        # ru_maxrss is in KiB on Linux, the children are the rendering workers
+        "peak_rss": max(getrusage(RUSAGE_SELF).ru_maxrss, getrusage(RUSAGE_CHILDREN).ru_maxrss) * 1024,
+        "files": len(files),
+        "bytes": sum(files),
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmark the config generator (Configurator.get_config() and Templator.render()) on synthetic configs")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS), help="scenarios to run")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes used to render the services")
+    parser.add_argument("--profile", choices=("cprofile", "pyinstrument"), help="profile each scenario and dump the result to the profiles directory")
+    parser.add_argument("--profiles", type=Path, default=Path("profiles"), help="directory where the profiles are dumped")
+    parser.add_argument("--json", type=Path, help="also write the results to this JSON file, to compare runs")
+    args = parser.parse_args()
+
+    if args.profile == "pyinstrument":
+        try:
+            import pyinstrument  # type: ignore # noqa: F401
+        except ImportError:
+            sys_exit("pyinstrument is not installed (pip install pyinstrument)")
+
+    print(f"{'scenario':>14} {'settings':>9} {'config (s)':>11} {'render (s)':>11} {'peak RSS (MiB)':>15} {'files':>7} {'bytes':>12}")
+    results = []
+    for name in args.scenarios:
+        # Each scenario runs in its own process so that its peak RSS is not hidden by the previous ones
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(run_scenario, name, SCENARIOS[name], args.workers, args.profile, args.profiles.resolve()).result()
+        results.append(result)
+        print(
+            f"{name:>14} {result['settings']:>9} {result['config_time']:>11.2f} {result['render_time']:>11.2f} "
+            f"{result['peak_rss'] / 1024 ** 2:>15.1f} {result['files']:>7} {result['bytes']:>12}"
+        )
+
+    if args.json:
+        args.json.write_text(dumps(results, indent=2))
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from resource import RUSAGE_SELF, getrusage
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Dict, Tuple
+
+from utils import generate_variables, get_configurator, get_templator_args
+
+from Templator import Templator  # type: ignore
+
+
+def measure_render(output: Path, config: Dict[str, Any]) -> Tuple[float, int, int]:
+    """Render the config serially in a fresh process and return the duration, the RSS before rendering and the peak RSS (KiB)."""
+    rss = getrusage(RUSAGE_SELF).ru_maxrss
+    start = perf_counter()
+    Templator(*get_templator_args(output), config, workers=1).render()
+    return perf_counter() - start, rss, getrusage(RUSAGE_SELF).ru_maxrss
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measure the time and the memory used by a serial rendering of the config generator")
+    parser.add_argument("--services", type=int, nargs="+", default=[10, 100, 1000], help="number of services to render")
+    parser.add_argument("--settings", type=int, default=0, help="number of extra global settings added to the config to emulate plugins")
+    args = parser.parse_args()
+
+    print(f"{'services':>10} {'settings':>10} {'time (s)':>10} {'peak RSS increase (MiB)':>24}")
+    for services in args.services:
+        config = get_configurator(generate_variables(services)).get_config()
+        config.update({f"EXTRA_SETTING_{i}": "no" for i in range(args.settings)})
+
+        with TemporaryDirectory() as tmp_dir, ProcessPoolExecutor(max_workers=1, mp_context=get_context("fork")) as executor:
+            duration, rss, peak_rss = executor.submit(measure_render, Path(tmp_dir, "output"), config).result()
+
+        print(f"{services:>10} {len(config):>10} {duration:>10.2f} {(peak_rss - rss) / 1024:>24.1f}")
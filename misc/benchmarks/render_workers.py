@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from hashlib import sha256
+from os import cpu_count
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Dict
+
+from utils import generate_variables, get_configurator, get_templator_args
+
+from Templator import Templator  # type: ignore
+
+
+def hash_tree(path: Path) -> Dict[str, str]:
+    return {file.relative_to(path).as_posix(): sha256(file.read_bytes()).hexdigest() for file in path.rglob("*") if file.is_file()}
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Compare serial and parallel rendering of the config generator")
+    parser.add_argument("--services", type=int, nargs="+", default=[100, 1000, 5000], help="number of services to render")
+    parser.add_argument("--workers", type=int, default=cpu_count() or 1, help="number of workers used for the parallel rendering")
+    args = parser.parse_args()
+
+    print(f"{'services':>10} {'serial (s)':>12} {f'{args.workers} workers (s)':>16} {'speedup':>8} {'identical':>10}")
+    for services in args.services:
+        config = get_configurator(generate_variables(services)).get_config()
+        timings = {}
+        trees = {}
+        with TemporaryDirectory() as tmp_dir:
+            for workers in (1, args.workers):
+                output = Path(tmp_dir, f"workers-{workers}")
+                start = perf_counter()
+                Templator(*get_templator_args(output), config, workers=workers).render()
+                timings[workers] = perf_counter() - start
+                trees[workers] = hash_tree(output)
+
+        identical = trees[1] == trees[args.workers]
+        print(f"{services:>10} {timings[1]:>12.2f} {timings[args.workers]:>16.2f} {timings[1] / timings[args.workers]:>8.2f} {str(identical):>10}")
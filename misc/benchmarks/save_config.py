@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from logging import ERROR, getLogger
+from pathlib import Path
+from sys import path as sys_path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Dict
+
+from utils import COMMON_PATH, generate_variables, get_configurator
+
+if COMMON_PATH.joinpath("db").as_posix() not in sys_path:
+    sys_path.append(COMMON_PATH.joinpath("db").as_posix())
+
+from Database import Database  # type: ignore # noqa: E402
+
+
+def change_config(config: Dict[str, Any], services: int) -> Dict[str, Any]:
+    """Return the config with a tenth of the services changed and a tenth of them removed, like autoconf does when Ingresses are edited."""
+    config = config.copy()
+    server_names = config["SERVER_NAME"].split(" ")
+    removed = set(server_names[: services // 10])
+    for server_name in server_names[services // 10 : services // 5]:  # noqa: E203
+        config[f"{server_name}_USE_GZIP"] = "no"
+        config[f"{server_name}_REVERSE_PROXY_HOST"] = f"http://{server_name}:8081"
+    config["SERVER_NAME"] = " ".join(server_name for server_name in server_names if server_name not in removed)
+    return {key: value for key, value in config.items() if not any(key.startswith(f"{server_name}_") for server_name in removed)}
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measure the time taken by Database.save_config to save a multisite config")
+    parser.add_argument("--services", type=int, nargs="+", default=[100, 1000, 5000], help="number of services to save")
+    parser.add_argument("--database-uri", default="", help="database to use instead of a temporary SQLite one, its settings tables are overwritten")
+    parser.add_argument("--method", default="autoconf", help="method used to save the config")
+    args = parser.parse_args()
+
+    logger = getLogger("save_config")
+    logger.setLevel(ERROR)
+    print(f"{'services':>10} {'values':>10} {'first save (s)':>15} {'same save (s)':>15} {'changed save (s)':>17}")
+    for services in args.services:
+        configurator = get_configurator(generate_variables(services))
+        config = configurator.get_config()
+
+        with TemporaryDirectory() as tmp_dir:
+            db = Database(logger, args.database_uri or f"sqlite:///{Path(tmp_dir, 'db.sqlite3').as_posix()}")
+            db.init_tables([configurator.get_settings(), configurator.get_plugins("core"), [], []], "1.5.12")
+            db.initialize_db(version="1.5.12")
+
+            durations = []
+            for new_config in (config, config, change_config(config, services)):
+                start = perf_counter()
+                ret = db.save_config(new_config.copy(), args.method)
+                durations.append(perf_counter() - start)
+                if isinstance(ret, str):
+                    raise RuntimeError(ret)
+            db.sql_engine.dispose()
+
+        print(f"{services:>10} {len(config):>10} {durations[0]:>15.2f} {durations[1]:>15.2f} {durations[2]:>17.2f}")
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from json import dumps, loads
+from multiprocessing import get_context
+from os import urandom
+from pathlib import Path
+from resource import RUSAGE_SELF, getrusage
+from sys import path as sys_path
+from tarfile import open as tar_open
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter
+from typing import List, Tuple
+
+from utils import COMMON_PATH
+
+if COMMON_PATH.joinpath("api").as_posix() not in sys_path:
+    sys_path.append(COMMON_PATH.joinpath("api").as_posix())
+
+from API import API  # type: ignore # noqa: E402
+from ApiCaller import ApiCaller  # type: ignore # noqa: E402
+
+
+class InstanceHandler(BaseHTTPRequestHandler):
+    """Fake instance API reading and discarding the uploads, it needs all the files of a manifest or answers 404 on it if legacy."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        remaining = int(self.headers.get("Content-Length", 0))
+        body = b""
+        while remaining:
+            chunk = self.rfile.read(min(remaining, 65536))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            if self.path.endswith("/manifest"):
+                body += chunk
+
+        status, resp = 200, {"status": "success", "msg": "success"}
+        if self.path.endswith("/manifest"):
+            if self.server.legacy:
+                status, resp = 404, {"status": "error", "msg": "not found"}
+            else:
+                resp["data"] = sorted({file["hash"] for file in loads(body)["files"].values()})
+
+        data = dumps(resp).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def generate_cache(path: Path, size: int):
+    """Generate a cache directory of incompressible files with a few big databases and many small files, size is in MiB."""
+    big_files = max(1, size // 100)
+    for i in range(big_files):
+        with path.joinpath(f"db{i}.mmdb").open("wb") as f:
+            for _ in range(size * 4 // 5 // big_files):
+                f.write(urandom(1024 * 1024))
+
+    small_path = path.joinpath("crs")
+    small_path.mkdir()
+    for i in range(size // 5 * 16):
+        small_path.joinpath(f"rule{i}.conf").write_bytes(urandom(64 * 1024))
+
+
+def send_in_memory(apis: List[API], path: Path):
+    """Previous behavior : the whole archive is built in memory and encoded again by each request."""
+    with BytesIO() as tgz:
+        with tar_open(mode="w:gz", fileobj=tgz, dereference=True, compresslevel=3) as tf:
+            tf.add(path, arcname=".")
+        for api in apis:
+            tgz.seek(0, 0)
+            api.request("POST", "/cache", files={"archive.tar.gz": tgz})
+
+
+def measure_send(endpoints: List[str], path: Path, mode: str) -> Tuple[float, int, int]:
+    """Send the directory in a fresh process and return the duration, the RSS before sending and the peak RSS (KiB)."""
+    apis = [API(endpoint) for endpoint in endpoints]
+    api_caller = ApiCaller(apis)
+    rss = getrusage(RUSAGE_SELF).ru_maxrss
+    start = perf_counter()
+    if mode == "in-memory":
+        send_in_memory(apis, path)
+    else:
+        api_caller.send_files(path.as_posix(), "/cache")
+    return perf_counter() - start, rss, getrusage(RUSAGE_SELF).ru_maxrss
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measure the time and the memory used by the scheduler to send a cache directory to the instances")
+    parser.add_argument("--size", type=int, default=500, help="size of the cache directory (MiB)")
+    parser.add_argument("--instances", type=int, default=3, help="number of fake instances")
+    parser.add_argument("--legacy", action="store_true", help="fake instances without the delta sync, they get the whole archive")
+    args = parser.parse_args()
+
+    servers = []
+    for _ in range(args.instances):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), InstanceHandler)
+        server.legacy = args.legacy
+        Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    endpoints = [f"http://127.0.0.1:{server.server_port}" for server in servers]
+
+    with TemporaryDirectory() as tmp_dir:
+        generate_cache(Path(tmp_dir), args.size)
+
+        print(f"{'mode':>10} {'size (MiB)':>10} {'instances':>10} {'time (s)':>10} {'peak RSS increase (MiB)':>24}")
+        for mode in ("in-memory", "streaming"):
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("fork")) as executor:
+                duration, rss, peak_rss = executor.submit(measure_send, endpoints, Path(tmp_dir), mode).result()
+            print(f"{mode:>10} {args.size:>10} {args.instances:>10} {duration:>10.2f} {(peak_rss - rss) / 1024:>24.1f}")
+
+    for server in servers:
+        server.shutdown()
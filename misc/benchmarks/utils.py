@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+from logging import Logger, getLogger
+from pathlib import Path
+from sys import path as sys_path
+from typing import Any, Dict, List, Union
+
+ROOT_PATH = Path(__file__).resolve().parents[2]
+COMMON_PATH = ROOT_PATH.joinpath("src", "common")
+
+for deps_path in (COMMON_PATH.joinpath("gen"), COMMON_PATH.joinpath("utils")):
+    if deps_path.as_posix() not in sys_path:
+        sys_path.append(deps_path.as_posix())
+
+from Configurator import Configurator  # type: ignore # noqa: E402
+
+
+def generate_variables(services: int) -> Dict[str, str]:
+    """Generate a synthetic config with the given number of services (0 means single-site) and realistic per-service overrides."""
+    if not services:
+        return {"SERVER_NAME": "www.example.com", "USE_REVERSE_PROXY": "yes", "REVERSE_PROXY_HOST": "http://app:8080", "REVERSE_PROXY_URL": "/"}
+
+    server_names = [f"app{i}.example.com" for i in range(services)]
+    variables = {"MULTISITE": "yes", "SERVER_NAME": " ".join(server_names), "USE_BAD_BEHAVIOR": "yes", "USE_GZIP": "yes"}
+    for i, server_name in enumerate(server_names):
+        if i % 2 == 0:
+            variables[f"{server_name}_USE_REVERSE_PROXY"] = "yes"
+            variables[f"{server_name}_REVERSE_PROXY_HOST"] = f"http://app{i}:8080"
+            variables[f"{server_name}_REVERSE_PROXY_URL"] = "/"
+        if i % 3 == 0:
+            variables[f"{server_name}_SERVER_NAME"] = f"{server_name} www.{server_name}"
+            variables[f"{server_name}_AUTO_LETS_ENCRYPT"] = "yes"
+        if i % 5 == 0:
+            variables[f"{server_name}_USE_ANTIBOT"] = "captcha"
+            variables[f"{server_name}_USE_LIMIT_REQ"] = "no"
+        if i % 7 == 0:
+            variables[f"{server_name}_USE_MODSECURITY"] = "no"
+            variables[f"{server_name}_ALLOWED_METHODS"] = "GET|POST|HEAD|PUT|DELETE"
+    return variables
+
+
+def write_variables(variables: Dict[str, str], path: Path) -> Path:
+    """Write the variables to a variables.env file as the generator reads it."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("".join(f"{variable}={value}\n" for variable, value in variables.items()))
+    return path
+
+
+def get_configurator(variables: Union[str, Dict[str, Any]], logger: Logger = getLogger("Benchmark")) -> Configurator:
+    """Get a Configurator using the core plugins of the repository and no external or pro plugins."""
+    return Configurator(COMMON_PATH.joinpath("settings.json").as_posix(), COMMON_PATH.joinpath("core").as_posix(), [], [], variables, logger)
+
+
+def get_templator_args(output: Path) -> List[str]:
+    """Get the positional arguments of the Templator using the templates of the repository."""
+    empty_path = output.parent.joinpath("empty")
+    empty_path.mkdir(parents=True, exist_ok=True)
+    return [
+        COMMON_PATH.joinpath("confs").as_posix(),
+        COMMON_PATH.joinpath("core").as_posix(),
+        empty_path.as_posix(),
+        empty_path.as_posix(),
+        output.as_posix(),
+        "/etc/nginx",
+    ]
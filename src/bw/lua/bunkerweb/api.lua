@@ -5,6 +5,7 @@ local cjson = require "cjson"
 local class = require "middleclass"
 local clogger = require "bunkerweb.logger"
 local helpers = require "bunkerweb.helpers"
+local ngx_pipe = require "ngx.pipe"
 local process = require "ngx.process"
 local rsignal = require "resty.signal"
 local upload = require "resty.upload"
@@ -25,21 +26,44 @@ local HTTP_INTERNAL_SERVER_ERROR = ngx.HTTP_INTERNAL_SERVER_ERROR
 local HTTP_BAD_REQUEST = ngx.HTTP_BAD_REQUEST
 local HTTP_NOT_FOUND = ngx.HTTP_NOT_FOUND
 local kill = rsignal.kill
+local spawn = ngx_pipe.spawn
+local timer_at = ngx.timer.at
+local now = ngx.now
+local sleep = ngx.sleep
+local worker_pid = ngx.worker.pid
+local get_uri_args = ngx_req.get_uri_args
 local get_master_pid = process.get_master_pid
 local execute = os.execute
 local open = io.open
+local rename = os.rename
+local remove = os.remove
 local read_body = ngx_req.read_body
 local get_body_data = ngx_req.get_body_data
 local get_body_file = ngx_req.get_body_file
 local decode = cjson.decode
 local encode = cjson.encode
 local match = string.match
+local concat = table.concat
+local floor = math.floor
+local min = math.min
 local require_plugin = helpers.require_plugin
 local new_plugin = helpers.new_plugin
 local call_plugin = helpers.call_plugin
 
 api.global = { GET = {}, POST = {}, PUT = {}, DELETE = {} }
 
+-- Destinations of the directories pushed by the scheduler
+local sync_destinations = {
+	confs = "/etc/nginx",
+	data = "/data",
+	cache = "/var/cache/bunkerweb",
+	custom_configs = "/etc/bunkerweb/configs",
+	plugins = "/etc/bunkerweb/plugins",
+	pro_plugins = "/etc/bunkerweb/pro/plugins",
+}
+-- Staging directory of the syncs, created inside the destination so that the files are moved atomically
+local sync_staging = ".bw_sync"
+
 function api:initialize(ctx)
 	self.ctx = ctx
 	local data, err = get_variable("API_WHITELIST_IP", false)
@@ -92,20 +116,82 @@ api.global.GET["^/ping$"] = function(self)
 	return self:response(HTTP_OK, "success", "pong")
 end
 
-api.global.POST["^/reload$"] = function(self)
-	-- Check config
+-- Test the config in a child process so that the event loop of the worker is not blocked, then reload Nginx
+local function reload()
 	logger:log(NOTICE, "Checking Nginx configuration")
-	local status = execute("nginx -t")
-	if status ~= 0 then
-		return self:response(HTTP_INTERNAL_SERVER_ERROR, "error", "config check failed")
+	local proc, err = spawn("nginx -t", { merge_stderr = true })
+	if not proc then
+		return false, "can't run config check : " .. err
+	end
+	proc:set_timeouts(nil, 300000, nil, 300000)
+	local output = proc:stdout_read_all()
+	local ok, reason, status = proc:wait()
+	if not ok then
+		logger:log(ERR, "Nginx configuration is not valid (" .. tostring(reason) .. " " .. tostring(status) .. ") : " .. tostring(output))
+		return false, "config check failed"
 	end
 	logger:log(NOTICE, "Nginx configuration is valid, reloading Nginx")
 	-- Send HUP signal to master process
-	local ok, err = kill(get_master_pid(), "HUP")
+	ok, err = kill(get_master_pid(), "HUP")
 	if not ok then
-		return self:response(HTTP_INTERNAL_SERVER_ERROR, "error", "err = " .. err)
+		return false, "err = " .. err
+	end
+	return true, "reload successful"
+end
+
+-- State of the last asynchronous reload, shared by the workers
+local function set_reload_status(state, exptime)
+	return datastore:set("api_reload_status", encode(state), exptime)
+end
+
+local function reload_callback(premature, state)
+	if premature then
+		state.status = "error"
+		state.msg = "reload cancelled"
+	else
+		local ok, msg = reload()
+		state.status = ok and "success" or "error"
+		state.msg = msg
+	end
+	state.finished = now()
+	set_reload_status(state)
+end
+
+api.global.POST["^/reload$"] = function(self)
+	-- Synchronous mode, kept for the schedulers that don't poll the status
+	if get_uri_args()["async"] ~= "yes" then
+		local ok, msg = reload()
+		if not ok then
+			return self:response(HTTP_INTERNAL_SERVER_ERROR, "error", msg)
+		end
+		return self:response(HTTP_OK, "success", msg)
+	end
+	local data = datastore:get("api_reload_status")
+	if data then
+		local state = decode(data)
+		if state.status == "running" then
+			return self:response(HTTP_OK, "success", state)
+		end
 	end
-	return self:response(HTTP_OK, "success", "reload successful")
+	local state = { id = tostring(now()) .. "-" .. tostring(worker_pid()), status = "running", started = now() }
+	-- The running state expires in case the worker dies before the end of the reload
+	set_reload_status(state, 600)
+	local ok, err = timer_at(0, reload_callback, state)
+	if not ok then
+		state.status = "error"
+		state.msg = "can't create reload timer : " .. err
+		set_reload_status(state)
+		return self:response(HTTP_INTERNAL_SERVER_ERROR, "error", state.msg)
+	end
+	return self:response(HTTP_OK, "success", state)
+end
+
+api.global.GET["^/reload/status$"] = function(self)
+	local data = datastore:get("api_reload_status")
+	if not data then
+		return self:response(HTTP_NOT_FOUND, "error", "no reload")
+	end
+	return self:response(HTTP_OK, "success", decode(data))
 end
 
 api.global.POST["^/stop$"] = function(self)
@@ -117,37 +203,27 @@ api.global.POST["^/stop$"] = function(self)
 	return self:response(HTTP_OK, "success", "stop successful")
 end
 
-api.global.POST["^/confs$"] = function(self)
-	local tmp = "/var/tmp/bunkerweb/api_" .. self.ctx.bw.uri:sub(2) .. ".tar.gz"
-	local destination = "/usr/share/bunkerweb/" .. self.ctx.bw.uri:sub(2)
-	if self.ctx.bw.uri == "/confs" then
-		destination = "/etc/nginx"
-	elseif self.ctx.bw.uri == "/data" then
-		destination = "/data"
-	elseif self.ctx.bw.uri == "/cache" then
-		destination = "/var/cache/bunkerweb"
-	elseif self.ctx.bw.uri == "/custom_configs" then
-		destination = "/etc/bunkerweb/configs"
-	elseif self.ctx.bw.uri == "/plugins" then
-		destination = "/etc/bunkerweb/plugins"
-	elseif self.ctx.bw.uri == "/pro_plugins" then
-		destination = "/etc/bunkerweb/pro/plugins"
-	end
+local function shell_quote(value)
+	return "'" .. value:gsub("'", "'\\''") .. "'"
+end
+
+local function save_upload(path)
 	local form, err = upload:new(4096)
 	if not form then
-		return self:response(HTTP_BAD_REQUEST, "error", err)
+		return false, err
 	end
 	form:set_timeout(1000)
-	local file, err = open(tmp, "w+")
+	local file
+	file, err = open(path, "w+")
 	if not file then
-		return self:response(HTTP_INTERNAL_SERVER_ERROR, "error", err)
+		return false, err
 	end
 	while true do
 		-- luacheck: ignore 421
 		local typ, res, err = form:read()
 		if not typ then
 			file:close()
-			return self:response(HTTP_BAD_REQUEST, "error", err)
+			return false, err
 		end
 		if typ == "eof" then
 			break
@@ -158,6 +234,186 @@ api.global.POST["^/confs$"] = function(self)
 	end
 	file:flush()
 	file:close()
+	return true
+end
+
+local function read_file(path)
+	local file, err = open(path, "rb")
+	if not file then
+		return nil, err
+	end
+	local data = file:read("*a")
+	file:close()
+	return data
+end
+
+local function write_file(path, data)
+	local file, err = open(path, "wb")
+	if not file then
+		return false, err
+	end
+	file:write(data)
+	file:close()
+	return true
+end
+
+local function copy_file(source, destination)
+	local input, err = open(source, "rb")
+	if not input then
+		return false, err
+	end
+	local output
+	output, err = open(destination, "wb")
+	if not output then
+		input:close()
+		return false, err
+	end
+	while true do
+		local chunk = input:read(65536)
+		if not chunk then
+			break
+		end
+		output:write(chunk)
+	end
+	input:close()
+	output:close()
+	return true
+end
+
+local function is_safe_path(path)
+	return type(path) == "string"
+		and path ~= ""
+		and not path:find("^/")
+		and not ("/" .. path .. "/"):find("/%.%.?/")
+		and path:sub(1, #sync_staging) ~= sync_staging
+end
+
+local function is_sha256(hash)
+	return type(hash) == "string" and #hash == 64 and not hash:find("[^%x]")
+end
+
+-- Run the command in a child process so that the event loop of the worker is not blocked
+local function run_command(cmd)
+	local proc, err = spawn(cmd, { merge_stderr = true })
+	if not proc then
+		return false, err
+	end
+	proc:set_timeouts(nil, 300000, nil, 300000)
+	local output = proc:stdout_read_all()
+	local ok, reason, status = proc:wait()
+	if not ok then
+		return false, tostring(reason) .. " " .. tostring(status) .. " : " .. tostring(output)
+	end
+	return true
+end
+
+-- Call the callback with each line of the output of the command, read from a child process like run_command
+local function read_command_lines(cmd, callback)
+	local proc, err = spawn(cmd)
+	if not proc then
+		return false, err
+	end
+	proc:set_timeouts(nil, 300000, nil, 300000)
+	local line
+	while true do
+		line, err = proc:stdout_read_line()
+		if not line then
+			break
+		end
+		callback(line)
+	end
+	proc:wait()
+	if err ~= "closed" then
+		return false, err
+	end
+	return true
+end
+
+-- List the files of the destination with their sha256, computed by child processes, in the state of the sync.
+-- The hashes of the files which size, mtime and inode didn't change are reused from the last listing, except for the files
+-- modified during the second of the last listing as a change in the same second doesn't change their mtime
+local function get_sync_files(name, destination)
+	local state_path = "/var/tmp/bunkerweb/api_sync_" .. name .. ".json"
+	local last_state = { listed = 0, files = {} }
+	local data = read_file(state_path)
+	if data then
+		local ok, decoded = pcall(decode, data)
+		if ok and type(decoded) == "table" and tonumber(decoded.listed) and type(decoded.files) == "table" then
+			last_state = decoded
+		end
+	end
+	local state = { listed = floor(now()), files = {} }
+	local to_hash = {}
+	local to_hash_paths = {}
+	local ok, err = read_command_lines(
+		"find "
+			.. shell_quote(destination)
+			.. " -path "
+			.. shell_quote(destination .. "/" .. sync_staging)
+			.. " -prune -o -type f -exec stat -c '%s %Y %i %n' {} + 2> /dev/null",
+		function(line)
+			local size, mtime, inode, path = line:match("^(%d+) (%d+) (%d+) (.+)$")
+			if not path then
+				return
+			end
+			local relative = path:sub(#destination + 2)
+			local file = { size = tonumber(size), mtime = tonumber(mtime), inode = tonumber(inode) }
+			local cached = last_state.files[relative]
+			if
+				type(cached) == "table"
+				and cached.size == file.size
+				and cached.mtime == file.mtime
+				and cached.inode == file.inode
+				and file.mtime < last_state.listed
+			then
+				file.hash = cached.hash
+				state.files[relative] = file
+			else
+				to_hash[path] = file
+				table.insert(to_hash_paths, path)
+			end
+		end
+	)
+	if not ok then
+		return nil, "can't list the files of " .. destination .. " : " .. tostring(err)
+	end
+	for i = 1, #to_hash_paths, 100 do
+		local paths = {}
+		for j = i, min(i + 99, #to_hash_paths) do
+			table.insert(paths, shell_quote(to_hash_paths[j]))
+		end
+		-- The files that can't be read are left out
+		ok, err = read_command_lines("sha256sum " .. concat(paths, " ") .. " 2> /dev/null", function(line)
+			local hash, path = line:match("^(%x+)  (.+)$")
+			local file = path and to_hash[path]
+			if file then
+				file.hash = hash
+				state.files[path:sub(#destination + 2)] = file
+			end
+		end)
+		if not ok then
+			return nil, "can't hash the files of " .. destination .. " : " .. tostring(err)
+		end
+	end
+	write_file(state_path, encode(state))
+	return state
+end
+
+local function get_sync_target(self, suffix)
+	local name = self.ctx.bw.uri:match("^/([%w_]+)" .. suffix .. "$")
+	return name, sync_destinations[name]
+end
+
+api.global.POST["^/confs$"] = function(self)
+	local name, destination = get_sync_target(self, "")
+	local tmp = "/var/tmp/bunkerweb/api_" .. name .. ".tar.gz"
+	if not destination then
+		destination = "/usr/share/bunkerweb/" .. name
+	end
+	local ok, err = save_upload(tmp)
+	if not ok then
+		return self:response(HTTP_BAD_REQUEST, "error", err)
+	end
 	local cmds = {
 		"rm -rf " .. destination .. "/*",
 		"tar xzf " .. tmp .. " -C " .. destination,
@@ -171,6 +427,179 @@ api.global.POST["^/confs$"] = function(self)
 	return self:response(HTTP_OK, "success", "saved data at " .. destination)
 end
 
+-- First step of a sync : the scheduler sends the manifest of the directory (path -> sha256 and mode, directories)
+-- and the instance replies with the hashes of the files it doesn't have
+api.global.POST["^/confs/manifest$"] = function(self)
+	local name, destination = get_sync_target(self, "/manifest")
+	read_body()
+	local data = get_body_data()
+	if not data then
+		local data_file = get_body_file()
+		if data_file then
+			data = read_file(data_file)
+		end
+	end
+	local ok, manifest = pcall(decode, data)
+	if not ok or type(manifest) ~= "table" or type(manifest.files) ~= "table" or type(manifest.dirs) ~= "table" then
+		return self:response(HTTP_BAD_REQUEST, "error", "invalid manifest")
+	end
+	for path, entry in pairs(manifest.files) do
+		if not is_safe_path(path) or type(entry) ~= "table" or not is_sha256(entry.hash) then
+			return self:response(HTTP_BAD_REQUEST, "error", "invalid manifest entry " .. tostring(path))
+		end
+	end
+	for _, path in ipairs(manifest.dirs) do
+		if not is_safe_path(path) then
+			return self:response(HTTP_BAD_REQUEST, "error", "invalid manifest directory " .. tostring(path))
+		end
+	end
+	local state, err = get_sync_files(name, destination)
+	if not state then
+		return self:response(HTTP_INTERNAL_SERVER_ERROR, "error", err)
+	end
+	local available = {}
+	for _, file in pairs(state.files) do
+		available[file.hash] = true
+	end
+	local missing = {}
+	for _, entry in pairs(manifest.files) do
+		if not available[entry.hash] then
+			available[entry.hash] = true
+			table.insert(missing, entry.hash)
+		end
+	end
+	ok, err = write_file("/var/tmp/bunkerweb/api_sync_" .. name .. ".pending.json", data)
+	if not ok then
+		return self:response(HTTP_INTERNAL_SERVER_ERROR, "error", err)
+	end
+	return self:response(HTTP_OK, "success", missing)
+end
+
+-- Second step of a sync : the scheduler sends an archive of the missing files named by their hash,
+-- each changed file is written next to the destination and renamed over it then the files and directories
+-- that are not in the manifest anymore are removed
+api.global.POST["^/confs/apply$"] = function(self)
+	local name, destination = get_sync_target(self, "/apply")
+	local pending_path = "/var/tmp/bunkerweb/api_sync_" .. name .. ".pending.json"
+	local data = read_file(pending_path)
+	if not data then
+		return self:response(HTTP_BAD_REQUEST, "error", "no pending manifest for " .. name)
+	end
+	local _, manifest = pcall(decode, data)
+	if type(manifest) ~= "table" then
+		return self:response(HTTP_BAD_REQUEST, "error", "invalid pending manifest for " .. name)
+	end
+	local staging = destination .. "/" .. sync_staging
+	local tmp = "/var/tmp/bunkerweb/api_" .. name .. "_sync.tar.gz"
+	local ok, err = save_upload(tmp)
+	if not ok then
+		return self:response(HTTP_BAD_REQUEST, "error", err)
+	end
+	ok, err = run_command(
+		"rm -rf "
+			.. shell_quote(staging)
+			.. " && mkdir -p "
+			.. shell_quote(staging .. "/blobs")
+			.. " && tar xzf "
+			.. shell_quote(tmp)
+			.. " -C "
+			.. shell_quote(staging .. "/blobs")
+	)
+	if not ok then
+		return self:response(HTTP_INTERNAL_SERVER_ERROR, "error", "can't extract the files : " .. tostring(err))
+	end
+	local state
+	state, err = get_sync_files(name, destination)
+	if not state then
+		return self:response(HTTP_INTERNAL_SERVER_ERROR, "error", err)
+	end
+	local files = state.files
+	local by_hash = {}
+	for path, file in pairs(files) do
+		by_hash[file.hash] = destination .. "/" .. path
+	end
+	local dirs = {}
+	local mkdir = {}
+	for _, path in ipairs(manifest.dirs) do
+		dirs[path] = true
+		table.insert(mkdir, shell_quote(destination .. "/" .. path))
+	end
+	for i = 1, #mkdir, 100 do
+		run_command("mkdir -p " .. concat(mkdir, " ", i, min(i + 99, #mkdir)))
+	end
+	local changed = 0
+	local modes = {}
+	for path, entry in pairs(manifest.files) do
+		local file = files[path]
+		if not file or file.hash ~= entry.hash then
+			local source = staging .. "/blobs/" .. entry.hash
+			local blob = open(source, "rb")
+			if blob then
+				blob:close()
+			else
+				source = by_hash[entry.hash]
+			end
+			changed = changed + 1
+			local staged = staging .. "/" .. changed
+			if not source then
+				ok, err = false, "missing file " .. entry.hash
+			else
+				ok, err = copy_file(source, staged)
+			end
+			if ok then
+				ok, err = rename(staged, destination .. "/" .. path)
+			end
+			if not ok then
+				run_command("rm -rf " .. shell_quote(staging))
+				return self:response(HTTP_INTERNAL_SERVER_ERROR, "error", "can't write " .. path .. " : " .. tostring(err))
+			end
+			files[path] = nil
+			local mode = string.format("%o", tonumber(entry.mode) or 420)
+			modes[mode] = modes[mode] or {}
+			table.insert(modes[mode], shell_quote(destination .. "/" .. path))
+			-- Let the other requests of the worker run between the copies
+			sleep(0)
+		end
+	end
+	for mode, paths in pairs(modes) do
+		for i = 1, #paths, 100 do
+			run_command("chmod " .. mode .. " " .. concat(paths, " ", i, min(i + 99, #paths)))
+		end
+	end
+	for path, _ in pairs(files) do
+		if not manifest.files[path] then
+			remove(destination .. "/" .. path)
+			files[path] = nil
+		end
+	end
+	local existing_dirs = {}
+	ok = read_command_lines(
+		"find "
+			.. shell_quote(destination)
+			.. " -mindepth 1 -path "
+			.. shell_quote(staging)
+			.. " -prune -o -type d -print 2> /dev/null",
+		function(path)
+			if not dirs[path:sub(#destination + 2)] then
+				table.insert(existing_dirs, path)
+			end
+		end
+	)
+	if ok then
+		-- The deepest directories are removed first
+		table.sort(existing_dirs, function(a, b)
+			return #a > #b
+		end)
+		for _, path in ipairs(existing_dirs) do
+			remove(path)
+		end
+	end
+	run_command("rm -rf " .. shell_quote(staging) .. " " .. shell_quote(tmp) .. " " .. shell_quote(pending_path))
+	-- The changed files are hashed again on the next sync
+	write_file("/var/tmp/bunkerweb/api_sync_" .. name .. ".json", encode(state))
+	return self:response(HTTP_OK, "success", "synced " .. tostring(changed) .. " files at " .. destination)
+end
+
 api.global.POST["^/data$"] = api.global.POST["^/confs$"]
 
 api.global.POST["^/cache$"] = api.global.POST["^/confs$"]
@@ -181,6 +610,13 @@ api.global.POST["^/plugins$"] = api.global.POST["^/confs$"]
 
 api.global.POST["^/pro_plugins$"] = api.global.POST["^/confs$"]
 
+for name, _ in pairs(sync_destinations) do
+	if name ~= "confs" then
+		api.global.POST["^/" .. name .. "/manifest$"] = api.global.POST["^/confs/manifest$"]
+		api.global.POST["^/" .. name .. "/apply$"] = api.global.POST["^/confs/apply$"]
+	end
+end
+
 api.global.POST["^/unban$"] = function(self)
 	read_body()
 	local data = get_body_data()
@@ -302,11 +738,12 @@ function api:do_api_call()
 				if status ~= HTTP_OK then
 					ret = false
 				end
-				if #resp["msg"] == 0 then
-					resp["msg"] = ""
-				elseif type(resp["msg"]) == "table" then
+				-- The tables (lists and objects like the reload state) are returned in data, # is 0 for the objects
+				if type(resp["msg"]) == "table" and next(resp["msg"]) ~= nil then
 					resp["data"] = resp["msg"]
 					resp["msg"] = resp["status"]
+				elseif #resp["msg"] == 0 then
+					resp["msg"] = ""
 				end
 				return ret, resp["msg"], status, encode(resp)
 			end
@@ -1,8 +1,53 @@
 #!/usr/bin/env python3
 
-from os import environ
-from typing import Literal, Optional, Union
-from requests import request
+from os import environ, getpid
+from os.path import getsize
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Literal, Optional, Tuple, Union
+from uuid import uuid4
+from requests import Session
+
+# Keep-alive sessions shared by the API objects of the same endpoint, per process as the connections can't be shared with forked processes
+SESSIONS: Dict[Tuple[int, str], Session] = {}
+SESSIONS_LOCK = Lock()
+
+
+class MultipartFile:
+    """Multipart body made of a single file read from disk in chunks while it is sent.
+
+    Its size is known so it is sent with a Content-Length, the upload handler of the instances doesn't support chunked bodies.
+    """
+
+    def __init__(self, name: str, path: Union[str, Path]):
+        self.boundary = uuid4().hex
+        self.__head = (
+            f"--{self.boundary}\r\n"
+            + f'Content-Disposition: form-data; name="{name}"; filename="{name}"\r\n'
+            + "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        self.__tail = f"\r\n--{self.boundary}--\r\n".encode()
+        self.__size = len(self.__head) + getsize(path) + len(self.__tail)
+        self.__file = open(path, "rb")
+
+    def __len__(self) -> int:
+        return self.__size
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.__size
+        chunk = b""
+        if self.__head:
+            chunk, self.__head = self.__head[:size], self.__head[size:]
+        if len(chunk) < size:
+            chunk += self.__file.read(size - len(chunk))
+        if len(chunk) < size and self.__tail:
+            tail, self.__tail = self.__tail[: size - len(chunk)], self.__tail[size - len(chunk) :]  # noqa: E203
+            chunk += tail
+        return chunk
+
+    def close(self):
+        self.__file.close()
 
 
 class API:
@@ -20,6 +65,24 @@ class API:
     def host(self) -> str:
         return self.__host
 
+    @property
+    def session(self) -> Session:
+        key = (getpid(), self.__endpoint)
+        session = SESSIONS.get(key)
+        if session is None:
+            with SESSIONS_LOCK:
+                session = SESSIONS.get(key)
+                if session is None:
+                    session = SESSIONS[key] = Session()
+        return session
+
+    def close(self):
+        """Close the keep-alive connections to the endpoint."""
+        with SESSIONS_LOCK:
+            session = SESSIONS.pop((getpid(), self.__endpoint), None)
+        if session is not None:
+            session.close()
+
     def request(
         self,
         method: Union[Literal["POST"], Literal["GET"]],
@@ -29,8 +92,10 @@ class API:
         timeout=(int(environ.get('API_TIMEOUT', 10)), 
                  int(environ.get('API_READ_TIMEOUT', 30))),
     ) -> tuple[bool, str, Optional[int], Optional[dict]]:
+        body = None
         try:
             kwargs = {}
+            headers = {"User-Agent": "bwapi", "Host": self.__host}
             if isinstance(data, dict):
                 kwargs["json"] = data
             elif isinstance(data, bytes):
@@ -38,17 +103,24 @@ class API:
             elif data is not None:
                 return False, f"Unsupported data type: {type(data)}", None, None
 
-            if files:
+            if files and len(files) == 1 and isinstance(next(iter(files.values())), Path):
+                # Files on disk are streamed instead of being encoded in memory
+                body = MultipartFile(*next(iter(files.items())))
+                headers["Content-Type"] = f"multipart/form-data; boundary={body.boundary}"
+                kwargs["data"] = body
+            elif files:
                 kwargs["files"] = files
 
-            resp = request(
+            resp = self.session.request(
                 method,
                 f"{self.__endpoint}{url if not url.startswith('/') else url[1:]}",
                 timeout=timeout,
-                headers={"User-Agent": "bwapi", "Host": self.__host},
+                headers=headers,
                 **kwargs,
             )
+            return True, "ok", resp.status_code, resp.json()
         except Exception as e:
             return False, f"Request failed: {e}", None, None
-
-        return True, "ok", resp.status_code, resp.json()
+        finally:
+            if body is not None:
+                body.close()
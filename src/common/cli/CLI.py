@@ -271,6 +271,30 @@ class CLI(ApiCaller):
 
         return True, cli_str
 
+    def jobs(self, job_name: Optional[str] = None) -> Tuple[bool, str]:
+        if not self.__db:
+            raise Exception("This command can only be executed on the scheduler")
+
+        stats = self.__db.get_jobs_runs_stats(job_name)
+        if job_name and job_name not in stats:
+            return False, f"No run found for job {job_name}"
+
+        cli_str = f"{'job':<32} {'runs':>6} {'failures':>8} {'last (s)':>10} {'p50 (s)':>10} {'p90 (s)':>10} {'p99 (s)':>10} {'max (s)':>10}\n"
+        for name, job_stats in sorted(stats.items(), key=lambda item: item[1]["p90"], reverse=True):
+            cli_str += (
+                f"{name:<32} {job_stats['runs']:>6} {job_stats['failures']:>8} {job_stats['last_duration']:>10.2f} "
+                + f"{job_stats['p50']:>10.2f} {job_stats['p90']:>10.2f} {job_stats['p99']:>10.2f} {job_stats['max']:>10.2f}\n"
+            )
+
+        if job_name:
+            cli_str += f"\nLast runs of job {job_name}:\n"
+            for job_run in self.__db.get_job_runs(job_name):
+                cli_str += f"- {job_run['start_date']} ; exit code {job_run['exit_code']} ; {job_run['duration']:.2f}s ; {'success' if job_run['success'] else 'failure'}\n"
+                if not job_run["success"] and job_run["output"]:
+                    cli_str += "".join(f"    {line}\n" for line in job_run["output"].splitlines()[-10:])
+
+        return True, cli_str
+
     def custom(self, plugin_id: str, command: str, *args: str, debug: bool = False) -> Tuple[bool, str]:
         if not self.__db:
             raise Exception("This command can only be executed on the scheduler")
@@ -50,6 +50,10 @@ if __name__ == "__main__":
         # Bans subparser
         parser_bans = subparsers.add_parser("bans", help="list current bans")
 
+        # Jobs subparser
+        parser_jobs = subparsers.add_parser("jobs", help="list the durations of the jobs runs")
+        parser_jobs.add_argument("job_name", nargs="?", help="the job to show the last runs of")
+
         # Plugin subparser
         parser_plugin = subparsers.add_parser("plugin", help="execute a custom command from a plugin")
         parser_plugin.add_argument("plugin_id", help="the plugin id that you want to execute the command on")
@@ -71,6 +75,8 @@ if __name__ == "__main__":
             ret, err = cli.ban(args.ip, args.exp, args.reason)
         elif args.command == "bans":
             ret, err = cli.bans()
+        elif args.command == "jobs":
+            ret, err = cli.jobs(args.job_name)
         else:
             ret, err = cli.custom(args.plugin_id, args.command, *args.arg, debug=args.debug)
 
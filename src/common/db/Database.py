@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 
 from contextlib import contextmanager, suppress
-from copy import deepcopy
 from datetime import datetime
+from hashlib import sha256
 from io import BytesIO
 from logging import Logger
 from os import _exit, getenv, listdir, sep
@@ -10,7 +10,7 @@ from os.path import join as os_join
 from pathlib import Path
 from re import compile as re_compile, escape, search
 from sys import argv, path as sys_path
-from typing import Any, Dict, List, Literal, Optional, Set, Tuple, Union
+from typing import Any, Dict, Iterator, List, Literal, Optional, Set, Tuple, Union
 from time import sleep
 from uuid import uuid4
 from zipfile import ZIP_DEFLATED, ZipFile
@@ -26,21 +26,28 @@ from model import (
     Jobs,
     Plugin_pages,
     Jobs_cache,
+    Jobs_runs,
     Custom_configs,
     Selects,
     Users,
     BwcliCommands,
     Metadata,
+    Config_version,
+    Blobs,
+    Blob_chunks,
 )
 
 for deps_path in [os_join(sep, "usr", "share", "bunkerweb", *paths) for paths in (("deps", "python"), ("utils",))]:
     if deps_path not in sys_path:
         sys_path.append(deps_path)
 
-from common_utils import bytes_hash  # type: ignore
+from common_utils import bytes_hash, file_hash  # type: ignore
 
 from pymysql import install_as_MySQLdb
-from sqlalchemy import create_engine, event, MetaData as sql_metadata, join, select as db_select, text, inspect
+from sqlalchemy import bindparam, create_engine, event, MetaData as sql_metadata, join, select as db_select, text, inspect
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.engine import Engine
 from sqlalchemy.exc import (
     ArgumentError,
@@ -52,6 +59,7 @@ from sqlalchemy.exc import (
 )
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.pool import QueuePool
+from sqlalchemy.schema import CreateColumn
 from sqlite3 import Connection as SQLiteConnection
 
 install_as_MySQLdb()
@@ -69,6 +77,10 @@ def set_sqlite_pragma(dbapi_connection, _):
 class Database:
     DB_STRING_RX = re_compile(r"^(?P<database>(mariadb|mysql)(\+pymysql)?|sqlite(\+pysqlite)?|postgresql(\+psycopg)?):/+(?P<path>/[^\s]+)")
     READONLY_ERROR = ("readonly", "read-only", "command denied", "Access denied")
+    CHANGES_CHANNEL = "bw_changes"
+    CONFIG_CACHE_SIZE = 32
+    # Size of the rows of the blob store, small enough for the default max_allowed_packet of MySQL and MariaDB
+    BLOB_CHUNK_SIZE = 1024 * 1024
 
     def __init__(
         self, logger: Logger, sqlalchemy_string: Optional[str] = None, *, ui: bool = False, pool: Optional[bool] = None, log: bool = True, **kwargs
@@ -83,6 +95,10 @@ class Database:
 
         self.__session_factory = None
         self.sql_engine = None
+        self.__changes_connection = None
+        self.__data_version = None
+        # Configs already built by this process, keyed by the version of the config in the database and the arguments used to build them
+        self.__config_cache: Dict[tuple, Dict[str, Any]] = {}
 
         if not sqlalchemy_string:
             sqlalchemy_string = getenv("DATABASE_URI", "sqlite:////var/lib/bunkerweb/db.sqlite3")
@@ -170,9 +186,7 @@ class Database:
                         conn.execute(text("SELECT 1"))
                 else:
                     with self.sql_engine.connect() as conn:
-                        table_name = uuid4().hex
-                        conn.execute(text(f"CREATE TABLE IF NOT EXISTS test_{table_name} (id INT)"))
-                        conn.execute(text(f"DROP TABLE IF EXISTS test_{table_name}"))
+                        self.__probe_write(conn)
 
                 not_connected = False
             except (OperationalError, DatabaseError) as e:
@@ -221,15 +235,26 @@ class Database:
         with self.__db_session() as session:
             session.execute(text("SELECT 1"))
 
-    def test_write(self):
-        """Test the write access to the database"""
+    def test_write(self, *, ddl: bool = False):
+        """Test the write access to the database, by creating and dropping a table if ddl is set"""
         self.logger.debug("Testing write access to the database ...")
         with self.__db_session() as session:
-            table_name = uuid4().hex
-            session.execute(text(f"CREATE TABLE IF NOT EXISTS test_{table_name} (id INT)"))
-            session.execute(text(f"DROP TABLE IF EXISTS test_{table_name}"))
+            self.__probe_write(session.connection(), ddl=ddl)
             session.commit()
 
+    def __probe_write(self, conn: Any, *, ddl: bool = False):
+        """Check that the database accepts writes without taking any lock nor changing anything, unless ddl is set or the tables are not created yet.
+
+        The probe is an update matching no row, read-only databases and users without the privileges reject it before looking at the rows.
+        """
+        if not ddl and inspect(conn).has_table(Metadata.__tablename__):
+            conn.execute(text(f"UPDATE {Metadata.__tablename__} SET id = id WHERE 1 = 0"))
+            return
+
+        table_name = uuid4().hex
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS test_{table_name} (id INT)"))
+        conn.execute(text(f"DROP TABLE IF EXISTS test_{table_name}"))
+
     def retry_connection(self, *, readonly: bool = False, fallback: bool = False, log: bool = True, **kwargs) -> None:
         """Retry the connection to the database"""
         self.last_connection_retry = datetime.now()
@@ -244,16 +269,15 @@ class Database:
 
         self.sql_engine.dispose(close=True)
         self.sql_engine = create_engine(self.database_uri_readonly if fallback else self.database_uri, **self._engine_kwargs | kwargs)
+        self.__config_cache.clear()
 
         if fallback or readonly:
             with self.sql_engine.connect() as conn:
                 conn.execute(text("SELECT 1"))
             return
 
-        table_name = uuid4().hex
         with self.sql_engine.connect() as conn:
-            conn.execute(text(f"CREATE TABLE IF NOT EXISTS test_{table_name} (id INT)"))
-            conn.execute(text(f"DROP TABLE IF EXISTS test_{table_name}"))
+            self.__probe_write(conn)
 
     @contextmanager
     def __db_session(self) -> Any:
@@ -639,12 +663,95 @@ class Database:
                             {Plugins.config_changed: value, Plugins.last_config_change: current_time}
                         )
 
+                if value:
+                    self.__notify_changes(session)
+
                 session.commit()
             except BaseException as e:
                 return str(e)
 
         return ""
 
+    def __notify_changes(self, session: Any):
+        """Notify the schedulers waiting for changes, PostgreSQL only sends the notification once the session is committed."""
+        if self.sql_engine is not None and self.sql_engine.dialect.name == "postgresql":
+            session.execute(text(f"NOTIFY {self.CHANGES_CHANNEL}"))
+
+    def wait_for_changes(self, timeout: float, *, poll_interval: float = 1.0) -> bool:
+        """Wait until the database may have been changed by another connection or until the timeout expires and return whether it may have changed.
+
+        PostgreSQL is listened to with LISTEN/NOTIFY and the data_version of SQLite is checked every 100ms. The other databases, and PostgreSQL
+        replicas which don't get the notifications, are polled : they are considered changed every poll_interval seconds.
+        The first call always returns True as the changes made before it are not known.
+        """
+        assert self.sql_engine is not None, "The database engine is not initialized"
+        dialect = self.sql_engine.dialect.name
+
+        try:
+            if dialect == "postgresql" and not self.readonly:
+                return self.__wait_for_notification(timeout)
+            elif dialect == "sqlite":
+                return self.__wait_for_data_version(timeout)
+        except BaseException as e:
+            self.logger.debug(f"Error while waiting for changes in the database, polling it instead : {e}")
+            self.close_changes_feed()
+
+        sleep(min(timeout, poll_interval))
+        return True
+
+    def __open_changes_connection(self) -> Any:
+        assert self.sql_engine is not None, "The database engine is not initialized"
+        # The connection is kept out of the pool as it is only used to wait for changes
+        connection = self.sql_engine.raw_connection()
+        driver_connection = connection.driver_connection
+        connection.detach()
+        driver_connection.rollback()
+        return driver_connection
+
+    def __wait_for_notification(self, timeout: float) -> bool:
+        if self.__changes_connection is None:
+            self.__changes_connection = self.__open_changes_connection()
+            self.__changes_connection.autocommit = True
+            self.__changes_connection.execute(f"LISTEN {self.CHANGES_CHANNEL}")
+            return True
+
+        notified = False
+        for _ in self.__changes_connection.notifies(timeout=timeout, stop_after=1):
+            notified = True
+
+        # The notifications sent at the same time are handled with this one
+        if notified:
+            for _ in self.__changes_connection.notifies(timeout=0):
+                pass
+        return notified
+
+    def __wait_for_data_version(self, timeout: float) -> bool:
+        # The data_version of a connection changes when another connection commits changes to the database
+        if self.__changes_connection is None:
+            self.__changes_connection = self.__open_changes_connection()
+            self.__data_version = self.__changes_connection.execute("PRAGMA data_version").fetchone()[0]
+            return True
+
+        end_time = datetime.now().timestamp() + timeout
+        while True:
+            data_version = self.__changes_connection.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self.__data_version:
+                self.__data_version = data_version
+                return True
+
+            remaining = end_time - datetime.now().timestamp()
+            if remaining <= 0:
+                return False
+            sleep(min(remaining, 0.1))
+
+    def close_changes_feed(self):
+        """Close the connection used to wait for changes, the next call to wait_for_changes opens a new one."""
+        if self.__changes_connection is not None:
+            with suppress(BaseException):
+                self.__changes_connection.close()
+            self.__changes_connection = None
+            self.__data_version = None
+
     def init_tables(self, default_plugins: List[dict], bunkerweb_version: str) -> Tuple[bool, str]:
         """Initialize the database tables and return the result"""
 
@@ -703,6 +810,12 @@ class Database:
                 Base.metadata.drop_all(self.sql_engine)
 
         if has_all_tables and db_version and db_version == bunkerweb_version:
+            # Create the tables and the columns added without a version change, like bw_jobs_runs and the blob_id columns
+            try:
+                Base.metadata.create_all(self.sql_engine, checkfirst=True)
+                self.__add_missing_columns()
+            except BaseException as e:
+                return False, str(e)
             return False, ""
 
         try:
@@ -729,6 +842,7 @@ class Database:
 
                     for plugin_job in session.query(Jobs).with_entities(Jobs.name).filter(Jobs.plugin_id.in_(missing_ids)):
                         session.query(Jobs_cache).filter(Jobs_cache.job_name == plugin_job.name).delete()
+                        session.query(Jobs_runs).filter(Jobs_runs.job_name == plugin_job.name).delete()
                         session.query(Jobs).filter(Jobs.name == plugin_job.name).delete()
 
                     for plugin_setting in session.query(Settings).with_entities(Settings.id).filter(Settings.plugin_id.in_(missing_ids)):
@@ -757,6 +871,7 @@ class Database:
 
                     for plugin_job in session.query(Jobs).with_entities(Jobs.name).filter(Jobs.plugin_id.in_(missing_values)):
                         session.query(Jobs_cache).filter(Jobs_cache.job_name == plugin_job.name).delete()
+                        session.query(Jobs_runs).filter(Jobs_runs.job_name == plugin_job.name).delete()
                         session.query(Jobs).filter(Jobs.name == plugin_job.name).delete()
 
                     for plugin_setting in session.query(Settings).with_entities(Settings.id).filter(Settings.plugin_id.in_(missing_values)):
@@ -818,8 +933,10 @@ class Database:
                         if plugin.get("method", "manual") != db_plugin.method:
                             updates[Plugins.method] = plugin.get("method", "manual")
 
-                        if plugin.get("data") != db_plugin.data:
-                            updates[Plugins.data] = plugin.get("data")
+                        blob_id = self.__store_blob(session, plugin["data"]) if plugin.get("data") else None
+                        if blob_id != db_plugin.blob_id:
+                            updates[Plugins.blob_id] = blob_id
+                            updates[Plugins.data] = None
 
                         if plugin.get("checksum") != db_plugin.checksum:
                             updates[Plugins.checksum] = plugin.get("checksum")
@@ -837,7 +954,7 @@ class Database:
                                 stream=plugin["stream"],
                                 type=plugin.get("type", "core"),
                                 method=plugin.get("method"),
-                                data=plugin.get("data"),
+                                blob_id=self.__store_blob(session, plugin["data"]) if plugin.get("data") else None,
                                 checksum=plugin.get("checksum"),
                             )
                         )
@@ -967,6 +1084,7 @@ class Database:
                         self.logger.warning(f'Removing {len(missing_names)} jobs from plugin "{plugin["id"]}" as they are no longer in the list')
                         session.query(Jobs).filter(Jobs.name.in_(missing_names), Jobs.plugin_id == plugin["id"]).delete()
                         session.query(Jobs_cache).filter(Jobs_cache.job_name.in_(missing_names)).delete()
+                        session.query(Jobs_runs).filter(Jobs_runs.job_name.in_(missing_names)).delete()
 
                         if "bw_jobs" in old_data:
                             indexes = [i for i, job in enumerate(old_data["bw_jobs"]) if job.plugin_id == plugin["id"]]
@@ -997,7 +1115,7 @@ class Database:
                             job["reload"] = job.get("reload", False)
                             if db_plugin:
                                 self.logger.warning(f'Job "{job["name"]}" does not exist, creating it')
-                            to_put.append(Jobs(plugin_id=plugin["id"], **job))
+                            to_put.append(Jobs(plugin_id=plugin["id"], name=job["name"], file_name=job["file_name"], every=job["every"], reload=job["reload"]))
                         else:
                             updates = {}
 
@@ -1175,6 +1293,9 @@ class Database:
 
             try:
                 session.add_all(to_put)
+                # The version is bumped in the transaction of the writes so that no process can cache the config between them
+                self.__bump_config_version(session)
+                self.__delete_unused_blobs(session)
                 session.commit()
             except BaseException as e:
                 return False, str(e)
@@ -1204,6 +1325,7 @@ class Database:
                                 existing_row = session.query(Metadata).filter_by(id=1).first()
                                 if not existing_row:
                                     session.add(Metadata(**row))
+                                    self.__bump_config_version(session)
                                     session.commit()
                                     continue
                                 session.query(Metadata).filter_by(id=1).update(row)
@@ -1213,6 +1335,7 @@ class Database:
                             existing_row = session.query(Base.metadata.tables[table_name]).filter_by(**row).first()
                             if not existing_row:
                                 session.execute(Base.metadata.tables[table_name].insert().values(row))
+                                self.__bump_config_version(session)
                                 session.commit()
                         except IntegrityError as e:
                             session.rollback()
@@ -1223,6 +1346,34 @@ class Database:
 
         return True, ""
 
+    def __add_missing_columns(self):
+        """Add the nullable columns of the model that are missing from the existing tables, with their foreign keys"""
+        inspector = inspect(self.sql_engine)
+        dialect = self.sql_engine.dialect
+        with self.sql_engine.begin() as conn:
+            for table_name, table in Base.metadata.tables.items():
+                existing_columns = {column["name"] for column in inspector.get_columns(table_name)}
+                for column in table.columns:
+                    if column.name in existing_columns:
+                        continue
+                    elif not column.nullable:
+                        raise ValueError(f'Column "{column.name}" of table "{table_name}" is missing and can\'t be added as it isn\'t nullable')
+
+                    self.logger.warning(f'Column "{column.name}" of table "{table_name}" is missing, adding it')
+                    statement = f"ALTER TABLE {table_name} ADD COLUMN {CreateColumn(column).compile(dialect=dialect)}"
+                    for foreign_key in column.foreign_keys:
+                        reference = f"{foreign_key.column.table.name} ({foreign_key.column.name})"
+                        if foreign_key.onupdate:
+                            reference += f" ON UPDATE {foreign_key.onupdate.upper()}"
+                        if foreign_key.ondelete:
+                            reference += f" ON DELETE {foreign_key.ondelete.upper()}"
+                        # MySQL and MariaDB ignore the references in the definition of a column
+                        if dialect.name in ("mysql", "mariadb"):
+                            statement += f", ADD FOREIGN KEY ({column.name}) REFERENCES {reference}"
+                        else:
+                            statement += f" REFERENCES {reference}"
+                    conn.execute(text(statement))
+
     def save_config(self, config: Dict[str, Any], method: str, changed: Optional[bool] = True) -> Union[str, Set[str]]:
         """Save the config in the database"""
         to_put = []
@@ -1233,26 +1384,51 @@ class Database:
             changed_plugins = set()
             changed_services = False
 
-            for db_global_config in session.query(Global_values).filter_by(method=method).all():
+            # The settings and the current values are loaded once, the changes are computed in memory and applied in bulk at the end
+            settings = {setting.id: setting for setting in session.query(Settings).with_entities(Settings.id, Settings.default, Settings.plugin_id)}
+            db_global_values = {
+                (global_value.setting_id, global_value.suffix): global_value
+                for global_value in session.query(Global_values).with_entities(
+                    Global_values.setting_id, Global_values.suffix, Global_values.value, Global_values.method
+                )
+            }
+            db_services_settings = {
+                (service_setting.service_id, service_setting.setting_id, service_setting.suffix): service_setting
+                for service_setting in session.query(Services_settings).with_entities(
+                    Services_settings.service_id, Services_settings.setting_id, Services_settings.suffix, Services_settings.value, Services_settings.method
+                )
+            }
+            global_values_to_upsert: Dict[Tuple[str, int], Dict[str, Any]] = {}
+            global_values_to_delete: Set[Tuple[str, int]] = set()
+            services_settings_to_upsert: Dict[Tuple[str, str, int], Dict[str, Any]] = {}
+            services_settings_to_delete: Set[Tuple[str, str, int]] = set()
+
+            for db_global_config in db_global_values.values():
+                if db_global_config.method != method:
+                    continue
+
                 key = db_global_config.setting_id
                 if db_global_config.suffix:
                     key = f"{key}_{db_global_config.suffix}"
 
                 if key not in config and (db_global_config.suffix or f"{key}_0" not in config):
-                    session.delete(db_global_config)
-                    changed_plugins.add(session.query(Settings).with_entities(Settings.plugin_id).filter_by(id=db_global_config.setting_id).first().plugin_id)
+                    global_values_to_delete.add((db_global_config.setting_id, db_global_config.suffix))
+                    changed_plugins.add(settings[db_global_config.setting_id].plugin_id)
 
                     if key == "SERVER_NAME":
                         changed_services = True
 
-            for db_service_config in session.query(Services_settings).filter_by(method=method).all():
+            for db_service_config in db_services_settings.values():
+                if db_service_config.method != method:
+                    continue
+
                 key = f"{db_service_config.service_id}_{db_service_config.setting_id}"
                 if db_service_config.suffix:
                     key = f"{key}_{db_service_config.suffix}"
 
                 if key not in config and (db_service_config.suffix or f"{key}_0" not in config):
-                    session.delete(db_service_config)
-                    changed_plugins.add(session.query(Settings).with_entities(Settings.plugin_id).filter_by(id=db_service_config.setting_id).first().plugin_id)
+                    services_settings_to_delete.add((db_service_config.service_id, db_service_config.setting_id, db_service_config.suffix))
+                    changed_plugins.add(settings[db_service_config.setting_id].plugin_id)
 
             if config:
                 db_global_config = {}
@@ -1299,30 +1475,39 @@ class Database:
                         session.query(Services).filter(Services.id.in_(missing_drafts)).update({Services.is_draft: False})
                         changed_services = True
 
+                new_drafts = []
                 for draft in drafts:
                     if draft not in db_drafts:
                         if draft not in db_ids:
                             to_put.append(Services(id=draft, method=method, is_draft=True))
                             db_ids[draft] = {"method": method, "is_draft": True}
                         elif method == db_ids[draft]["method"]:
-                            session.query(Services).filter(Services.id == draft).update({Services.is_draft: True})
-                            changed_services = True
+                            new_drafts.append(draft)
+
+                if new_drafts:
+                    session.query(Services).filter(Services.id.in_(new_drafts)).update({Services.is_draft: True})
+                    changed_services = True
 
                 if config.get("MULTISITE", "no") == "yes":
-                    global_values = []
+                    global_values = set()
+                    # Position of the services in the list to find the service of a setting without going through the whole list
+                    services_positions = {service: i for i, service in reversed(list(enumerate(services)))}
                     for key, value in config.copy().items():
                         suffix = 0
-                        original_key = deepcopy(key)
+                        original_key = key
                         if self.suffix_rx.search(key):
                             suffix = int(key.split("_")[-1])
                             key = key[: -len(str(suffix)) - 1]
 
-                        setting = session.query(Settings).with_entities(Settings.default, Settings.plugin_id).filter_by(id=key).first()
+                        setting = settings.get(key)
 
                         if not setting and services:
-                            try:
-                                server_name = next(service for service in services if key.startswith(f"{service}_"))
-                            except StopIteration:
+                            server_name = min(
+                                (key[:i] for i, char in enumerate(key) if char == "_" and key[:i] in services_positions),
+                                key=services_positions.get,
+                                default=None,
+                            )
+                            if server_name is None:
                                 continue
 
                             if server_name not in db_ids:
@@ -1333,17 +1518,12 @@ class Database:
 
                             key = key.replace(f"{server_name}_", "")
                             original_key = original_key.replace(f"{server_name}_", "")
-                            setting = session.query(Settings).with_entities(Settings.default, Settings.plugin_id).filter_by(id=key).first()
+                            setting = settings.get(key)
 
                             if not setting:
                                 continue
 
-                            service_setting = (
-                                session.query(Services_settings)
-                                .with_entities(Services_settings.value, Services_settings.method)
-                                .filter_by(service_id=server_name, setting_id=key, suffix=suffix)
-                                .first()
-                            )
+                            service_setting = db_services_settings.get((server_name, key, suffix))
 
                             if not service_setting:
                                 if key != "SERVER_NAME" and (
@@ -1354,59 +1534,54 @@ class Database:
                                     continue
 
                                 changed_plugins.add(setting.plugin_id)
-                                to_put.append(Services_settings(service_id=server_name, setting_id=key, value=value, suffix=suffix, method=method))
+                                services_settings_to_upsert[(server_name, key, suffix)] = {
+                                    "service_id": server_name,
+                                    "setting_id": key,
+                                    "value": value,
+                                    "suffix": suffix,
+                                    "method": method,
+                                }
                             elif (
                                 method == service_setting.method or (service_setting.method not in ("scheduler", "autoconf") and method == "autoconf")
                             ) and service_setting.value != value:
                                 changed_plugins.add(setting.plugin_id)
-                                query = session.query(Services_settings).filter(
-                                    Services_settings.service_id == server_name,
-                                    Services_settings.setting_id == key,
-                                    Services_settings.suffix == suffix,
-                                )
 
                                 if key != "SERVER_NAME" and (
                                     (original_key not in config and original_key not in db_global_config and value == setting.default)
                                     or (original_key in config and value == config[original_key])
                                     or (original_key in db_global_config and value == db_global_config[original_key])
                                 ):
-                                    query.delete()
+                                    services_settings_to_delete.add((server_name, key, suffix))
                                     continue
 
-                                query.update({Services_settings.value: value, Services_settings.method: method})
+                                services_settings_to_upsert[(server_name, key, suffix)] = {
+                                    "service_id": server_name,
+                                    "setting_id": key,
+                                    "value": value,
+                                    "suffix": suffix,
+                                    "method": method,
+                                }
                         elif setting and original_key not in global_values:
-                            global_values.append(original_key)
-                            global_value = (
-                                session.query(Global_values)
-                                .with_entities(Global_values.value, Global_values.method)
-                                .filter_by(setting_id=key, suffix=suffix)
-                                .first()
-                            )
+                            global_values.add(original_key)
+                            global_value = db_global_values.get((key, suffix))
 
                             if not global_value:
                                 if value == setting.default:
                                     continue
 
                                 changed_plugins.add(setting.plugin_id)
-                                to_put.append(Global_values(setting_id=key, value=value, suffix=suffix, method=method))
+                                global_values_to_upsert[(key, suffix)] = {"setting_id": key, "value": value, "suffix": suffix, "method": method}
                             elif (
                                 method == global_value.method or (global_value.method not in ("scheduler", "autoconf") and method == "autoconf")
                             ) and global_value.value != value:
                                 changed_plugins.add(setting.plugin_id)
-                                query = session.query(Global_values).filter(Global_values.setting_id == key, Global_values.suffix == suffix)
 
                                 if value == setting.default:
-                                    query.delete()
+                                    global_values_to_delete.add((key, suffix))
                                     continue
-                                query.update({Global_values.value: value, Global_values.method: method})
+                                global_values_to_upsert[(key, suffix)] = {"setting_id": key, "value": value, "suffix": suffix, "method": method}
                 elif method != "autoconf":
-                    if (
-                        config.get("SERVER_NAME", "www.example.com")
-                        and not session.query(Services)
-                        .with_entities(Services.id)
-                        .filter_by(id=config.get("SERVER_NAME", "www.example.com").split(" ")[0])
-                        .first()
-                    ):
+                    if config.get("SERVER_NAME", "www.example.com") and config.get("SERVER_NAME", "www.example.com").split(" ")[0] not in db_ids:
                         to_put.append(Services(id=config.get("SERVER_NAME", "www.example.com").split(" ")[0], method=method))
                         changed_services = True
 
@@ -1416,34 +1591,28 @@ class Database:
                             suffix = int(key.split("_")[-1])
                             key = key[: -len(str(suffix)) - 1]
 
-                        setting = session.query(Settings).with_entities(Settings.default, Settings.plugin_id).filter_by(id=key).first()
+                        setting = settings.get(key)
 
                         if not setting:
                             continue
 
-                        global_value = (
-                            session.query(Global_values)
-                            .with_entities(Global_values.value, Global_values.method)
-                            .filter_by(setting_id=key, suffix=suffix)
-                            .first()
-                        )
+                        global_value = db_global_values.get((key, suffix))
 
                         if not global_value:
                             if value == setting.default:
                                 continue
 
                             changed_plugins.add(setting.plugin_id)
-                            to_put.append(Global_values(setting_id=key, value=value, suffix=suffix, method=method))
+                            global_values_to_upsert[(key, suffix)] = {"setting_id": key, "value": value, "suffix": suffix, "method": method}
                         elif (
                             method == global_value.method or (global_value.method not in ("scheduler", "autoconf") and method == "autoconf")
                         ) and value != global_value.value:
                             changed_plugins.add(setting.plugin_id)
-                            query = session.query(Global_values).filter(Global_values.setting_id == key, Global_values.suffix == suffix)
 
                             if value == setting.default:
-                                query.delete()
+                                global_values_to_delete.add((key, suffix))
                                 continue
-                            query.update({Global_values.value: value, Global_values.method: method})
+                            global_values_to_upsert[(key, suffix)] = {"setting_id": key, "value": value, "suffix": suffix, "method": method}
 
             if changed_services:
                 changed_plugins = set(plugin.id for plugin in session.query(Plugins).with_entities(Plugins.id).all())
@@ -1457,15 +1626,132 @@ class Database:
 
                     if changed_plugins:
                         session.query(Plugins).filter(Plugins.id.in_(changed_plugins)).update({Plugins.config_changed: True})
+                        self.__notify_changes(session)
 
             try:
+                # The new services are inserted first as the settings reference them
                 session.add_all(to_put)
+                session.flush()
+                self.__bulk_delete(session, Global_values, global_values_to_delete)
+                self.__bulk_delete(session, Services_settings, services_settings_to_delete)
+                self.__bulk_upsert(session, Global_values, list(global_values_to_upsert.values()))
+                self.__bulk_upsert(session, Services_settings, list(services_settings_to_upsert.values()))
+                self.__bump_config_version(session)
+                # The cache files of the removed services can be the last ones using their blobs
+                self.__delete_unused_blobs(session)
                 session.commit()
             except BaseException as e:
                 return str(e)
 
         return changed_plugins
 
+    def __bulk_delete(self, session: Any, model: Any, keys: Set[tuple]):
+        """Delete the rows of the model by their primary key with a single statement executed for all of them"""
+        if not keys:
+            return
+
+        columns = list(model.__table__.primary_key.columns)
+        stmt = model.__table__.delete().where(*[column == bindparam(f"b_{column.name}") for column in columns])
+        session.execute(stmt, [{f"b_{column.name}": value for column, value in zip(columns, key)} for key in keys])
+
+    def __bulk_upsert(self, session: Any, model: Any, rows: List[Dict[str, Any]]):
+        """Insert the rows of the model or update the value and the method of the existing ones with a single statement executed for all of them"""
+        if not rows:
+            return
+
+        dialect = session.get_bind().dialect.name
+        if dialect in ("mysql", "mariadb"):
+            stmt = mysql_insert(model.__table__)
+            stmt = stmt.on_duplicate_key_update(value=stmt.inserted.value, method=stmt.inserted.method)
+        else:
+            stmt = (postgresql_insert if dialect == "postgresql" else sqlite_insert)(model.__table__)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[column.name for column in model.__table__.primary_key.columns],
+                set_={"value": stmt.excluded.value, "method": stmt.excluded.method},
+            )
+        session.execute(stmt, rows)
+
+    def __insert_missing(self, session: Any, model: Any, rows: List[Dict[str, Any]]):
+        """Insert the rows of the model that don't already exist, the existing ones are left untouched"""
+        if not rows:
+            return
+
+        dialect = session.get_bind().dialect.name
+        if dialect in ("mysql", "mariadb"):
+            stmt = mysql_insert(model.__table__)
+            stmt = stmt.on_duplicate_key_update({column.name: stmt.inserted[column.name] for column in model.__table__.primary_key.columns})
+        else:
+            stmt = (postgresql_insert if dialect == "postgresql" else sqlite_insert)(model.__table__).on_conflict_do_nothing()
+        session.execute(stmt, rows)
+
+    def __store_blob(self, session: Any, content: Union[bytes, Path]) -> str:
+        """Store the content in the blob store if it isn't already there and return its id, files are read and stored chunk by chunk"""
+        if isinstance(content, Path):
+            blob_id = file_hash(content, algorithm="sha256")
+        else:
+            blob_id = bytes_hash(content, algorithm="sha256")
+
+        # The existing blob is locked until the reference to it is committed so that __delete_unused_blobs can't delete it in between
+        if session.query(Blobs).with_entities(Blobs.id).filter_by(id=blob_id).with_for_update().first():
+            return blob_id
+
+        if isinstance(content, Path):
+            self.__insert_missing(session, Blobs, [{"id": blob_id, "size": content.stat().st_size}])
+            with content.open("rb") as f:
+                position = 0
+                while chunk := f.read(self.BLOB_CHUNK_SIZE):
+                    self.__insert_missing(session, Blob_chunks, [{"blob_id": blob_id, "position": position, "data": chunk}])
+                    position += 1
+            return blob_id
+
+        self.__insert_missing(session, Blobs, [{"id": blob_id, "size": len(content)}])
+        view = memoryview(content)
+        for position, offset in enumerate(range(0, len(content), self.BLOB_CHUNK_SIZE)):
+            self.__insert_missing(
+                session, Blob_chunks, [{"blob_id": blob_id, "position": position, "data": view[offset : offset + self.BLOB_CHUNK_SIZE].tobytes()}]  # noqa: E203
+            )
+        return blob_id
+
+    def __get_blob(self, session: Any, blob_id: str) -> bytes:
+        """Get the whole content of the blob"""
+        return b"".join(
+            chunk.data for chunk in session.query(Blob_chunks).with_entities(Blob_chunks.data).filter_by(blob_id=blob_id).order_by(Blob_chunks.position)
+        )
+
+    def __iter_blob(self, blob_id: str) -> Iterator[bytes]:
+        """Yield the chunks of the blob, only one of them is in memory at a time, and raise a ValueError if the content read doesn't match the blob"""
+        content_hash = sha256()
+        size = 0
+        with self.__db_session() as session:
+            # The chunks are read in the same transaction and the blob is locked until the end so that __delete_unused_blobs can't delete it in between
+            blob = session.query(Blobs).with_entities(Blobs.size).filter_by(id=blob_id).with_for_update(read=True).first()
+            if not blob:
+                raise ValueError(f"Blob {blob_id} not found")
+
+            position = 0
+            while chunk := session.query(Blob_chunks).with_entities(Blob_chunks.data).filter_by(blob_id=blob_id, position=position).first():
+                content_hash.update(chunk.data)
+                size += len(chunk.data)
+                yield chunk.data
+                position += 1
+
+        if size != blob.size or content_hash.hexdigest() != blob_id:
+            raise ValueError(f"Blob {blob_id} is corrupted, read {size} bytes out of {blob.size}")
+
+    def __delete_unused_blobs(self, session: Any):
+        """Delete the blobs that are not referenced anymore, their chunks are deleted with them"""
+        unused = (
+            Blobs.id.not_in(session.query(Jobs_cache.blob_id).filter(Jobs_cache.blob_id.is_not(None))),
+            Blobs.id.not_in(session.query(Plugins.blob_id).filter(Plugins.blob_id.is_not(None))),
+        )
+        blob_ids = [blob.id for blob in session.query(Blobs).with_entities(Blobs.id).filter(*unused)]
+        if not blob_ids:
+            return
+
+        # Wait for the transactions reusing these blobs (see __store_blob) and check again once they committed their references
+        session.query(Blobs).with_entities(Blobs.id).filter(Blobs.id.in_(blob_ids)).order_by(Blobs.id).with_for_update().all()
+        session.query(Blobs).filter(Blobs.id.in_(blob_ids), *unused).delete(synchronize_session=False)
+
     def save_custom_configs(
         self,
         custom_configs: List[
@@ -1551,6 +1837,7 @@ class Database:
                     if metadata is not None:
                         metadata.custom_configs_changed = True
                         metadata.last_custom_configs_change = datetime.now()
+                        self.__notify_changes(session)
 
             try:
                 session.add_all(to_put)
@@ -1560,6 +1847,40 @@ class Database:
 
         return message
 
+    def __bump_config_version(self, session: Any):
+        """Bump the version of the config in the transaction of the session so that the configs cached by the processes are not used anymore"""
+        if not session.query(Config_version).filter_by(id=1).update({Config_version.version: Config_version.version + 1}):
+            session.add(Config_version(id=1, version=1))
+
+    def __get_config_cache_key(self, *args) -> Optional[tuple]:
+        """Get the key of the config cache for the current version of the config, None if the version can't be read"""
+        try:
+            with self.__db_session() as session:
+                version = session.query(Config_version).with_entities(Config_version.version).filter_by(id=1).first()
+        except BaseException:
+            return None
+        return (version.version if version else 0,) + args
+
+    def __get_cached_config(self, key: Optional[tuple]) -> Optional[Dict[str, Any]]:
+        """Get a copy of the cached config that the caller can modify, None if it is not cached"""
+        config = self.__config_cache.get(key) if key is not None else None
+        if config is None:
+            return None
+        return {setting: value.copy() if isinstance(value, dict) else value for setting, value in config.items()}
+
+    def __cache_config(self, key: Optional[tuple], config: Dict[str, Any]) -> Dict[str, Any]:
+        """Cache the config and return a copy of it that the caller can modify"""
+        if key is None:
+            return config
+
+        # Only the configs of the latest version are kept
+        for cached_key in [cached_key for cached_key in self.__config_cache if cached_key[0] != key[0]]:
+            self.__config_cache.pop(cached_key, None)
+        while len(self.__config_cache) >= self.CONFIG_CACHE_SIZE:
+            self.__config_cache.pop(next(iter(self.__config_cache)), None)
+        self.__config_cache[key] = config
+        return self.__get_cached_config(key) or {}
+
     def get_non_default_settings(
         self,
         global_only: bool = False,
@@ -1571,6 +1892,13 @@ class Database:
         original_multisite: Optional[Set[str]] = None,
     ) -> Dict[str, Any]:
         """Get the config from the database"""
+        cache_key = None
+        if original_config is None and original_multisite is None:
+            cache_key = self.__get_config_cache_key("non_default", global_only, methods, with_drafts, frozenset(filtered_settings or ()))
+            cached_config = self.__get_cached_config(cache_key)
+            if cached_config is not None:
+                return cached_config
+
         filtered_settings = set(filtered_settings or [])
 
         if filtered_settings and not global_only:
@@ -1663,7 +1991,7 @@ class Database:
 
             config["SERVER_NAME"] = servers if not methods else {"value": servers, "global": True, "method": "default"}
 
-            return config
+            return self.__cache_config(cache_key, config)
 
     def get_config(
         self,
@@ -1672,7 +2000,12 @@ class Database:
         with_drafts: bool = False,
         filtered_settings: Optional[Union[List[str], Set[str], Tuple[str]]] = None,
     ) -> Dict[str, Any]:
-        """Get the config from the database"""
+        """Get the config from the database, the config built by a previous call is reused as long as the config in the database doesn't change"""
+        cache_key = self.__get_config_cache_key("config", global_only, methods, with_drafts, frozenset(filtered_settings or ()))
+        cached_config = self.__get_cached_config(cache_key)
+        if cached_config is not None:
+            return cached_config
+
         with self.__db_session() as session:
             config = {}
             multisite = set()
@@ -1697,13 +2030,16 @@ class Database:
                 if setting.context == "multisite":
                     multisite.add(setting.id)
 
-        return self.get_non_default_settings(
-            global_only=global_only,
-            methods=methods,
-            with_drafts=with_drafts,
-            filtered_settings=filtered_settings,
-            original_config=config,
-            original_multisite=multisite,
+        return self.__cache_config(
+            cache_key,
+            self.get_non_default_settings(
+                global_only=global_only,
+                methods=methods,
+                with_drafts=with_drafts,
+                filtered_settings=filtered_settings,
+                original_config=config,
+                original_multisite=multisite,
+            ),
         )
 
     def get_custom_configs(self) -> List[Dict[str, Any]]:
@@ -1751,8 +2087,19 @@ class Database:
 
         return services
 
-    def update_job(self, plugin_id: str, job_name: str, success: bool) -> str:
-        """Update the job last_run in the database"""
+    def update_job(
+        self,
+        plugin_id: str,
+        job_name: str,
+        success: bool,
+        *,
+        start_date: Optional[datetime] = None,
+        end_date: Optional[datetime] = None,
+        exit_code: Optional[int] = None,
+        output: Optional[str] = None,
+        max_runs: int = 100,
+    ) -> str:
+        """Update the job last_run in the database and add the run to the history of the job, keeping its last max_runs runs, if its start date is given"""
         with self.__db_session() as session:
             if self.readonly:
                 return "The database is read-only, the changes will not be saved"
@@ -1765,6 +2112,27 @@ class Database:
             job.last_run = datetime.now()
             job.success = success
 
+            if start_date:
+                end_date = end_date or job.last_run
+                session.add(
+                    Jobs_runs(
+                        job_name=job_name,
+                        success=success,
+                        exit_code=exit_code,
+                        start_date=start_date,
+                        end_date=end_date,
+                        duration=(end_date - start_date).total_seconds(),
+                        output=output,
+                    )
+                )
+
+                # Only the last max_runs runs of the job are kept
+                oldest_run = (
+                    session.query(Jobs_runs).with_entities(Jobs_runs.id).filter_by(job_name=job_name).order_by(Jobs_runs.id.desc()).offset(max_runs).first()
+                )
+                if oldest_run:
+                    session.query(Jobs_runs).filter(Jobs_runs.job_name == job_name, Jobs_runs.id <= oldest_run.id).delete()
+
             try:
                 session.commit()
             except BaseException as e:
@@ -1786,6 +2154,8 @@ class Database:
 
             try:
                 session.query(Jobs_cache).filter_by(**filters).delete()
+                self.__delete_unused_blobs(session)
+                session.commit()
             except BaseException as e:
                 return str(e)
 
@@ -1795,18 +2165,23 @@ class Database:
         self,
         service_id: Optional[str],
         file_name: str,
-        data: bytes,
+        data: Union[bytes, Path],
         *,
         job_name: Optional[str] = None,
         checksum: Optional[str] = None,
     ) -> str:
-        """Update the plugin cache in the database"""
+        """Update the plugin cache in the database, the content is stored in the blob store and streamed from the file if data is a path"""
         job_name = job_name or argv[0].replace(".py", "")
         service_id = service_id or None
         with self.__db_session() as session:
             if self.readonly:
                 return "The database is read-only, the changes will not be saved"
 
+            try:
+                blob_id = self.__store_blob(session, data)
+            except BaseException as e:
+                return str(e)
+
             cache = session.query(Jobs_cache).filter_by(job_name=job_name, service_id=service_id, file_name=file_name).first()
 
             if not cache:
@@ -1815,17 +2190,20 @@ class Database:
                         job_name=job_name,
                         service_id=service_id,
                         file_name=file_name,
-                        data=data,
+                        blob_id=blob_id,
                         last_update=datetime.now(),
                         checksum=checksum,
                     )
                 )
             else:
-                cache.data = data
+                cache.data = None
+                cache.blob_id = blob_id
                 cache.last_update = datetime.now()
                 cache.checksum = checksum
 
             try:
+                session.flush()
+                self.__delete_unused_blobs(session)
                 session.commit()
             except BaseException as e:
                 return str(e)
@@ -1857,6 +2235,7 @@ class Database:
 
                     for plugin_job in session.query(Jobs).with_entities(Jobs.name).filter(Jobs.plugin_id.in_(missing_ids)):
                         session.query(Jobs_cache).filter(Jobs_cache.job_name == plugin_job.name).delete()
+                        session.query(Jobs_runs).filter(Jobs_runs.job_name == plugin_job.name).delete()
                         session.query(Jobs).filter(Jobs.name == plugin_job.name).delete()
 
                     for plugin_setting in session.query(Settings).with_entities(Settings.id).filter(Settings.plugin_id.in_(missing_ids)):
@@ -1881,7 +2260,7 @@ class Database:
                         Plugins.description,
                         Plugins.version,
                         Plugins.method,
-                        Plugins.data,
+                        Plugins.blob_id,
                         Plugins.checksum,
                         Plugins.type,
                     )
@@ -1917,8 +2296,10 @@ class Database:
                     if plugin["method"] != db_plugin.method:
                         updates[Plugins.method] = plugin["method"]
 
-                    if plugin.get("data") != db_plugin.data:
-                        updates[Plugins.data] = plugin.get("data")
+                    blob_id = self.__store_blob(session, plugin["data"]) if plugin.get("data") else None
+                    if blob_id != db_plugin.blob_id:
+                        updates[Plugins.blob_id] = blob_id
+                        updates[Plugins.data] = None
 
                     if plugin.get("checksum") != db_plugin.checksum:
                         updates[Plugins.checksum] = plugin.get("checksum")
@@ -2027,6 +2408,7 @@ class Database:
                         # Remove jobs that are no longer in the list
                         session.query(Jobs).filter(Jobs.name.in_(missing_names)).delete()
                         session.query(Jobs_cache).filter(Jobs_cache.job_name.in_(missing_names)).delete()
+                        session.query(Jobs_runs).filter(Jobs_runs.job_name.in_(missing_names)).delete()
 
                     for job in jobs:
                         db_job = (
@@ -2040,7 +2422,7 @@ class Database:
                             changes = True
                             job["file_name"] = job.pop("file")
                             job["reload"] = job.get("reload", False)
-                            to_put.append(Jobs(plugin_id=plugin["id"], **job))
+                            to_put.append(Jobs(plugin_id=plugin["id"], name=job["name"], file_name=job["file_name"], every=job["every"], reload=job["reload"]))
                         else:
                             updates = {}
 
@@ -2200,7 +2582,7 @@ class Database:
                         stream=plugin["stream"],
                         type=_type,
                         method=plugin["method"],
-                        data=plugin.get("data"),
+                        blob_id=self.__store_blob(session, plugin["data"]) if plugin.get("data") else None,
                         checksum=plugin.get("checksum"),
                     )
                 )
@@ -2232,7 +2614,7 @@ class Database:
 
                     job["file_name"] = job.pop("file")
                     job["reload"] = job.get("reload", False)
-                    to_put.append(Jobs(plugin_id=plugin["id"], **job))
+                    to_put.append(Jobs(plugin_id=plugin["id"], name=job["name"], file_name=job["file_name"], every=job["every"], reload=job["reload"]))
 
                 plugin_path = Path(sep, "var", "tmp", "bunkerweb", "ui", plugin["id"])
                 plugin_path = (
@@ -2337,9 +2719,12 @@ class Database:
                         elif _type == "pro":
                             metadata.pro_plugins_changed = True
                             metadata.last_pro_plugins_change = datetime.now()
+                        self.__notify_changes(session)
 
             try:
                 session.add_all(to_put)
+                self.__bump_config_version(session)
+                self.__delete_unused_blobs(session)
                 session.commit()
             except BaseException as e:
                 return str(e)
@@ -2352,7 +2737,7 @@ class Database:
         with self.__db_session() as session:
             entities = [Plugins.id, Plugins.stream, Plugins.name, Plugins.description, Plugins.version, Plugins.type, Plugins.method, Plugins.checksum]
             if with_data:
-                entities.append(Plugins.data)  # type: ignore
+                entities.extend([Plugins.data, Plugins.blob_id])  # type: ignore
 
             db_plugins = session.query(Plugins).with_entities(*entities)
             if _type != "all":
@@ -2371,7 +2756,7 @@ class Database:
                     "page": page is not None,
                     "settings": {},
                     "checksum": plugin.checksum,
-                } | ({"data": plugin.data} if with_data else {})
+                } | ({"data": self.__get_blob(session, plugin.blob_id) if plugin.blob_id else plugin.data} if with_data else {})
 
                 for setting in (
                     session.query(Settings)
@@ -2419,41 +2804,99 @@ class Database:
             return session.query(Jobs).filter(Jobs.success == False).count()  # noqa: E712
 
     def get_jobs(self) -> Dict[str, Dict[str, Any]]:
-        """Get jobs."""
+        """Get jobs with the metadata of their cache files."""
+        jobs = {}
         with self.__db_session() as session:
-            return {
-                job.name: {
-                    "plugin_id": job.plugin_id,
-                    "every": job.every,
-                    "reload": job.reload,
-                    "success": job.success,
-                    "last_run": job.last_run.strftime("%Y/%m/%d, %I:%M:%S %p") if job.last_run is not None else "Never",
-                    "cache": [
+            query = (
+                session.query(Jobs)
+                .with_entities(
+                    Jobs.name,
+                    Jobs.plugin_id,
+                    Jobs.every,
+                    Jobs.reload,
+                    Jobs.success,
+                    Jobs.last_run,
+                    Jobs_cache.service_id,
+                    Jobs_cache.file_name,
+                    Jobs_cache.last_update,
+                )
+                .outerjoin(Jobs_cache, Jobs_cache.job_name == Jobs.name)
+            )
+
+            for job in query:
+                if job.name not in jobs:
+                    jobs[job.name] = {
+                        "plugin_id": job.plugin_id,
+                        "every": job.every,
+                        "reload": job.reload,
+                        "success": job.success,
+                        "last_run": job.last_run.strftime("%Y/%m/%d, %I:%M:%S %p") if job.last_run is not None else "Never",
+                        "cache": [],
+                    }
+
+                if job.file_name is not None:
+                    jobs[job.name]["cache"].append(
                         {
-                            "service_id": cache.service_id,
-                            "file_name": cache.file_name,
-                            "last_update": cache.last_update.strftime("%Y/%m/%d, %I:%M:%S %p") if cache.last_update is not None else "Never",
+                            "service_id": job.service_id,
+                            "file_name": job.file_name,
+                            "last_update": job.last_update.strftime("%Y/%m/%d, %I:%M:%S %p") if job.last_update is not None else "Never",
                         }
-                        for cache in session.query(Jobs_cache)
-                        .with_entities(
-                            Jobs_cache.service_id,
-                            Jobs_cache.file_name,
-                            Jobs_cache.last_update,
-                        )
-                        .filter_by(job_name=job.name)
-                    ],
-                }
-                for job in (
-                    session.query(Jobs).with_entities(
-                        Jobs.name,
-                        Jobs.plugin_id,
-                        Jobs.every,
-                        Jobs.reload,
-                        Jobs.success,
-                        Jobs.last_run,
                     )
-                )
+        return jobs
+
+    def get_jobs_runs_stats(self, job_name: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Get the number of runs, the failures and the duration percentiles (in seconds) of the recorded runs of the jobs."""
+        jobs_runs = {}
+        with self.__db_session() as session:
+            query = session.query(Jobs_runs).with_entities(Jobs_runs.job_name, Jobs_runs.success, Jobs_runs.end_date, Jobs_runs.duration)
+            if job_name:
+                query = query.filter_by(job_name=job_name)
+
+            for run in query.order_by(Jobs_runs.id):
+                jobs_runs.setdefault(run.job_name, []).append(run)
+
+        stats = {}
+        for name, runs in jobs_runs.items():
+            durations = sorted(run.duration for run in runs)
+            stats[name] = {
+                "runs": len(runs),
+                "failures": sum(not run.success for run in runs),
+                "last_run": runs[-1].end_date.strftime("%Y/%m/%d, %I:%M:%S %p"),
+                "last_duration": runs[-1].duration,
+                "p50": self.__percentile(durations, 50),
+                "p90": self.__percentile(durations, 90),
+                "p99": self.__percentile(durations, 99),
+                "max": durations[-1],
             }
+        return stats
+
+    @staticmethod
+    def __percentile(values: List[float], percent: float) -> float:
+        """Return the percentile of the sorted values using a linear interpolation between the closest ranks."""
+        rank = (len(values) - 1) * percent / 100
+        lower = int(rank)
+        upper = min(lower + 1, len(values) - 1)
+        return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+    def get_job_runs(self, job_name: str, *, limit: int = 10) -> List[Dict[str, Any]]:
+        """Get the last runs of a job, the most recent first."""
+        with self.__db_session() as session:
+            return [
+                {
+                    "success": run.success,
+                    "exit_code": run.exit_code,
+                    "start_date": run.start_date.strftime("%Y/%m/%d, %I:%M:%S %p"),
+                    "duration": run.duration,
+                    "output": run.output or "",
+                }
+                for run in (
+                    session.query(Jobs_runs)
+                    .with_entities(Jobs_runs.success, Jobs_runs.exit_code, Jobs_runs.start_date, Jobs_runs.duration, Jobs_runs.output)
+                    .filter_by(job_name=job_name)
+                    .order_by(Jobs_runs.id.desc())
+                    .limit(limit)
+                )
+            ]
 
     def get_job_cache_file(
         self, job_name: str, file_name: str, *, service_id: str = "", plugin_id: str = "", with_info: bool = False, with_data: bool = True
@@ -2463,75 +2906,87 @@ class Database:
         if with_info:
             entities.extend([Jobs_cache.last_update, Jobs_cache.checksum])
         if with_data:
-            entities.append(Jobs_cache.data)
-
-        filters = {"job_name": job_name, "file_name": file_name}
-        if service_id:
-            filters["service_id"] = service_id
+            entities.extend([Jobs_cache.data, Jobs_cache.blob_id])
 
         with self.__db_session() as session:
-            if plugin_id:
-                job = session.query(Jobs).filter_by(name=job_name, plugin_id=plugin_id).first()
-                if not job:
-                    return None
-            data = session.query(Jobs_cache).with_entities(*entities).filter_by(**filters).first()
+            query = self.__get_job_cache_file_query(session, entities, job_name, file_name, service_id=service_id, plugin_id=plugin_id)
+            data = query.first()
+            if data and with_data:
+                content = self.__get_blob(session, data.blob_id) if data.blob_id else data.data
 
         if not data:
             return None
         elif with_data and not with_info:
-            return data.data
+            return content
 
         ret_data = {}
         if with_info:
             ret_data["last_update"] = data.last_update.timestamp() if data.last_update is not None else "Never"
             ret_data["checksum"] = data.checksum
         if with_data:
-            ret_data["data"] = data.data
+            ret_data["data"] = content
         return ret_data
 
-    def get_jobs_cache_files(self, *, job_name: str = "", plugin_id: str = "") -> List[Dict[str, Any]]:
-        """Get jobs cache files."""
+    def __get_job_cache_file_query(self, session: Any, entities: list, job_name: str, file_name: str, *, service_id: str = "", plugin_id: str = "") -> Any:
+        """Get the query of the job cache file selecting the given entities"""
+        query = session.query(Jobs_cache).with_entities(*entities).filter(Jobs_cache.job_name == job_name, Jobs_cache.file_name == file_name)
+        # An empty service_id is the global cache file, not any of the services' ones
+        query = query.filter(Jobs_cache.service_id == service_id) if service_id else query.filter(Jobs_cache.service_id.is_(None))
+        if plugin_id:
+            query = query.join(Jobs, Jobs.name == Jobs_cache.job_name).filter(Jobs.plugin_id == plugin_id)
+        return query
+
+    def iter_job_cache_file(self, job_name: str, file_name: str, *, service_id: str = "", plugin_id: str = "") -> Iterator[bytes]:
+        """Yield the content of the job cache file chunk by chunk, without loading all of it in memory."""
         with self.__db_session() as session:
-            filters = {}
-            query = session.query(Jobs_cache).with_entities(Jobs_cache.job_name, Jobs_cache.service_id, Jobs_cache.file_name, Jobs_cache.data)
+            data = self.__get_job_cache_file_query(session, [Jobs_cache.blob_id], job_name, file_name, service_id=service_id, plugin_id=plugin_id).first()
 
-            if job_name:
-                query = query.filter_by(job_name=job_name)
-                filters["name"] = job_name
+        if not data:
+            return
+        elif data.blob_id:
+            yield from self.__iter_blob(data.blob_id)
+            return
 
-            db_cache = query.all()
+        # Cache file saved before the blob store
+        with self.__db_session() as session:
+            data = self.__get_job_cache_file_query(session, [Jobs_cache.data], job_name, file_name, service_id=service_id, plugin_id=plugin_id).first()
+        if data and data.data:
+            yield data.data
+
+    def get_jobs_cache_files(self, *, job_name: str = "", plugin_id: str = "", with_data: bool = True) -> List[Dict[str, Any]]:
+        """Get jobs cache files, only their metadata if with_data is False, the last update is a timestamp or None if the file was never updated."""
+        entities = [
+            Jobs.plugin_id,
+            Jobs_cache.job_name,
+            Jobs_cache.service_id,
+            Jobs_cache.file_name,
+            Jobs_cache.last_update,
+            Jobs_cache.checksum,
+        ]
+        if with_data:
+            entities.extend([Jobs_cache.data, Jobs_cache.blob_id])
 
-            if not db_cache:
-                return []
+        with self.__db_session() as session:
+            query = session.query(Jobs_cache).with_entities(*entities).join(Jobs, Jobs.name == Jobs_cache.job_name)
 
+            if job_name:
+                query = query.filter(Jobs_cache.job_name == job_name)
             if plugin_id:
-                filters["plugin_id"] = plugin_id
-
-            query = session.query(Jobs).with_entities(Jobs.name, Jobs.plugin_id)
-
-            if filters:
-                query = query.filter_by(**filters)
-
-            jobs = {}
-            for job in query:
-                jobs[job.name] = job.plugin_id
-
-            if not jobs:
-                return []
+                query = query.filter(Jobs.plugin_id == plugin_id)
 
             cache_files = []
-            for cache in db_cache:
-                if cache.job_name not in jobs:
-                    continue
-                cache_files.append(
-                    {
-                        "plugin_id": jobs[cache.job_name],
-                        "job_name": cache.job_name,
-                        "service_id": cache.service_id,
-                        "file_name": cache.file_name,
-                        "data": cache.data,
-                    }
-                )
+            for cache in query:
+                cache_file = {
+                    "plugin_id": cache.plugin_id,
+                    "job_name": cache.job_name,
+                    "service_id": cache.service_id,
+                    "file_name": cache.file_name,
+                    "last_update": cache.last_update.timestamp() if cache.last_update is not None else None,
+                    "checksum": cache.checksum,
+                }
+                if with_data:
+                    cache_file["data"] = self.__get_blob(session, cache.blob_id) if cache.blob_id else cache.data
+                cache_files.append(cache_file)
             return cache_files
 
     def add_instance(self, hostname: str, port: int, server_name: str, changed: Optional[bool] = True) -> str:
@@ -2553,6 +3008,7 @@ class Database:
                     if metadata is not None:
                         metadata.instances_changed = True
                         metadata.last_instances_change = datetime.now()
+                        self.__notify_changes(session)
 
             try:
                 session.commit()
@@ -2585,6 +3041,7 @@ class Database:
                     if metadata is not None:
                         metadata.instances_changed = True
                         metadata.last_instances_change = datetime.now()
+                        self.__notify_changes(session)
 
             try:
                 session.add_all(to_put)
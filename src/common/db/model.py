@@ -2,10 +2,12 @@
 
 from sqlalchemy import (
     TEXT,
+    BigInteger,
     Boolean,
     Column,
     DateTime,
     Enum,
+    Float,
     ForeignKey,
     Identity,
     Integer,
@@ -13,7 +15,7 @@ from sqlalchemy import (
     PrimaryKeyConstraint,
     String,
 )
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.orm import declarative_base, deferred, relationship
 from sqlalchemy.schema import UniqueConstraint
 
 CONTEXTS_ENUM = Enum("global", "multisite", name="contexts_enum")
@@ -46,6 +48,26 @@ PRO_STATUS_ENUM = Enum("active", "invalid", "expired", "suspended", name="pro_st
 Base = declarative_base()
 
 
+class Blobs(Base):
+    __tablename__ = "bw_blobs"
+
+    # sha256 of the content, identical payloads are stored once
+    id = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+
+    chunks = relationship("Blob_chunks", back_populates="blob", cascade="all")
+
+
+class Blob_chunks(Base):
+    __tablename__ = "bw_blob_chunks"
+
+    blob_id = Column(String(64), ForeignKey("bw_blobs.id", onupdate="cascade", ondelete="cascade"), primary_key=True)
+    position = Column(Integer, primary_key=True)
+    data = Column(LargeBinary(length=(2**24) - 1), nullable=False)
+
+    blob = relationship("Blobs", back_populates="chunks")
+
+
 class Plugins(Base):
     __tablename__ = "bw_plugins"
 
@@ -56,7 +78,9 @@ class Plugins(Base):
     stream = Column(STREAM_TYPES_ENUM, default="no", nullable=False)
     type = Column(PLUGIN_TYPES_ENUM, default="core", nullable=False)
     method = Column(METHODS_ENUM, default="manual", nullable=False)
+    # Only set for the plugins saved before the blob store, the archive is now referenced by blob_id
     data = Column(LargeBinary(length=(2**32) - 1), nullable=True)
+    blob_id = Column(String(64), ForeignKey("bw_blobs.id", onupdate="cascade"), nullable=True)
     checksum = Column(String(128), nullable=True)
     config_changed = Column(Boolean, default=False, nullable=True)
     last_config_change = Column(DateTime, nullable=True)
@@ -150,6 +174,7 @@ class Jobs(Base):
 
     plugin = relationship("Plugins", back_populates="jobs")
     cache = relationship("Jobs_cache", back_populates="job", cascade="all")
+    runs = relationship("Jobs_runs", back_populates="job", cascade="all")
 
 
 class Plugin_pages(Base):
@@ -174,7 +199,9 @@ class Jobs_cache(Base):
     job_name = Column(String(128), ForeignKey("bw_jobs.name", onupdate="cascade", ondelete="cascade"), nullable=False)
     service_id = Column(String(64), ForeignKey("bw_services.id", onupdate="cascade", ondelete="cascade"), nullable=True)
     file_name = Column(String(256), nullable=False)
-    data = Column(LargeBinary(length=(2**32) - 1), nullable=True)
+    # Only set for the cache files saved before the blob store, the content is now referenced by blob_id, and only loaded when accessed
+    data = deferred(Column(LargeBinary(length=(2**32) - 1), nullable=True))
+    blob_id = Column(String(64), ForeignKey("bw_blobs.id", onupdate="cascade"), nullable=True)
     last_update = Column(DateTime, nullable=True)
     checksum = Column(String(128), nullable=True)
 
@@ -182,6 +209,21 @@ class Jobs_cache(Base):
     service = relationship("Services", back_populates="jobs_cache")
 
 
+class Jobs_runs(Base):
+    __tablename__ = "bw_jobs_runs"
+
+    id = Column(Integer, Identity(start=1, increment=1), primary_key=True)
+    job_name = Column(String(128), ForeignKey("bw_jobs.name", onupdate="cascade", ondelete="cascade"), nullable=False, index=True)
+    success = Column(Boolean, nullable=False)
+    exit_code = Column(Integer, nullable=True)
+    start_date = Column(DateTime, nullable=False)
+    end_date = Column(DateTime, nullable=False)
+    duration = Column(Float, nullable=False)
+    output = Column(TEXT, nullable=True)
+
+    job = relationship("Jobs", back_populates="runs")
+
+
 class Custom_configs(Base):
     __tablename__ = "bw_custom_configs"
     __table_args__ = (UniqueConstraint("service_id", "type", "name"),)
@@ -255,3 +297,10 @@ class Metadata(Base):
     failover = Column(Boolean, default=None, nullable=True)
     integration = Column(INTEGRATIONS_ENUM, default="Unknown", nullable=False)
     version = Column(String(32), default="1.5.12", nullable=False)
+
+
+class Config_version(Base):
+    __tablename__ = "bw_config_version"
+
+    id = Column(Integer, primary_key=True, default=1)
+    version = Column(Integer, default=0, nullable=False)
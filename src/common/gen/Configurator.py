@@ -8,7 +8,7 @@ from logging import Logger
 from os import cpu_count, listdir, sep, environ
 from os.path import basename, dirname, join
 from pathlib import Path
-from re import compile as re_compile, error as RegexError, search as re_search
+from re import Pattern, compile as re_compile, error as RegexError
 from sys import path as sys_path
 from tarfile import open as tar_open
 from threading import Lock, Semaphore, Thread
@@ -22,8 +22,8 @@ if join(sep, "usr", "share", "bunkerweb", "utils") not in sys_path:
 class Configurator:
     def __init__(
         self,
-        settings: str,
-        core: str,
+        settings: Union[str, Dict[str, Any]],
+        core: Union[str, List[Dict[str, Any]]],
         external_plugins: Union[str, List[Dict[str, Any]]],
         pro_plugins: Union[str, List[Dict[str, Any]]],
         variables: Union[str, Dict[str, Any]],
@@ -37,9 +37,14 @@ class Configurator:
         self.__setting_id_rx = re_compile(r"^[A-Z0-9_]{1,256}$")
         self.__name_rx = re_compile(r"^[\w.-]{1,128}$")
         self.__job_file_rx = re_compile(r"^[\w./-]{1,256}$")
-        self.__settings = self.__load_settings(settings)
-        self.__core_plugins = []
-        self.__load_plugins(core)
+        self.__settings = self.__load_settings(settings) if isinstance(settings, str) else settings
+
+        if isinstance(core, str):
+            self.__core_plugins = []
+            self.__load_plugins(core)
+        else:
+            self.__core_plugins = core
+
         self.__disable_test = environ.get('DISABLE_CONFIGURATION_TESTING', 'no') == 'yes'
 
         if isinstance(external_plugins, str):
@@ -59,8 +64,19 @@ class Configurator:
         else:
             self.__variables = variables
 
+        # Index the settings once so that each variable is resolved with hash lookups
+        self.__targets = [
+            self.__settings,
+            self.get_plugins_settings("core"),
+            self.get_plugins_settings("external"),
+            self.get_plugins_settings("pro"),
+        ]
+        self.__settings_index, self.__multiple_index = self.__index_settings()
+        self.__regexes: Dict[str, Optional[Pattern]] = {}
+
         self.__multisite = self.__variables.get("MULTISITE", "no") == "yes"
         self.__servers = self.__map_servers()
+        self.__servers_trie = self.__build_servers_trie()
 
     def get_settings(self) -> Dict[str, Any]:
         return self.__settings
@@ -90,12 +106,12 @@ class Configurator:
             if not server_name:
                 continue
 
-            if not re_search(self.__settings["SERVER_NAME"]["regex"], server_name) and not self.__disable_test:
+            if not self.__match_regex(self.__settings["SERVER_NAME"]["regex"], server_name) and not self.__disable_test:
                 self.__logger.warning(f"Ignoring server name {server_name} because regex is not valid")
                 continue
             names = [server_name]
             if f"{server_name}_SERVER_NAME" in self.__variables:
-                if not re_search(
+                if not self.__match_regex(
                     self.__settings["SERVER_NAME"]["regex"],
                     self.__variables[f"{server_name}_SERVER_NAME"],
                 ) and not self.__disable_test:
@@ -106,6 +122,41 @@ class Configurator:
             servers[server_name] = names
         return servers
 
+    def __index_settings(self) -> Tuple[Dict[str, Tuple[int, Dict[str, Any]]], Dict[str, Tuple[int, Dict[str, Any]]]]:
+        """Map each setting name to the index of the first target defining it, for exact names and for multiple settings."""
+        settings_index = {}
+        multiple_index = {}
+        for i, target in enumerate(self.__targets):
+            for setting, data in target.items():
+                settings_index.setdefault(setting, (i, data))
+                if "multiple" in data:
+                    multiple_index.setdefault(setting, (i, data))
+        return settings_index, multiple_index
+
+    def __build_servers_trie(self) -> Dict[str, Any]:
+        """Build a trie of the server names, each terminal node holds the position of the server to keep the servers order."""
+        trie = {}
+        for i, server in enumerate(self.__servers):
+            node = trie
+            for char in server:
+                node = node.setdefault(char, {})
+            node.setdefault("", i)
+        return trie
+
+    def __get_regex(self, regex: str) -> Optional[Pattern]:
+        if regex not in self.__regexes:
+            try:
+                self.__regexes[regex] = re_compile(regex)
+            except RegexError:
+                self.__regexes[regex] = None
+        return self.__regexes[regex]
+
+    def __match_regex(self, regex: str, value: str) -> bool:
+        pattern = self.__get_regex(regex)
+        if pattern is None:
+            raise RegexError(f"Invalid regex {regex}")
+        return bool(pattern.search(value))
+
     def __load_settings(self, path: str) -> Dict[str, Any]:
         return loads(Path(path).read_text())
 
@@ -174,12 +225,7 @@ class Configurator:
     def get_config(self) -> Dict[str, Any]:
         config = {}
         # Extract default settings
-        default_settings = [
-            self.__settings,
-            self.get_plugins_settings("core"),
-            self.get_plugins_settings("external"),
-            self.get_plugins_settings("pro"),
-        ]
+        default_settings = self.__targets
         for settings in default_settings:
             for setting, data in settings.items():
                 config[setting] = data["default"]
@@ -231,53 +277,60 @@ class Configurator:
         value = self.__variables[variable]
         # MULTISITE=no
         if not self.__multisite:
-            where, real_var = self.__find_var(variable)
-            if not where:
+            setting = self.__find_var(variable)
+            if not setting:
                 return False, f"variable name {variable} doesn't exist"
 
             try:
-                if not re_search(where[real_var]["regex"], value) and not self.__disable_test:
-                    return (False, f"value {value} doesn't match regex {where[real_var]['regex']}")
+                if not self.__match_regex(setting["regex"], value) and not self.__disable_test:
+                    return (False, f"value {value} doesn't match regex {setting['regex']}")
             except RegexError:
-                self.__logger.warning(f"Invalid regex for {variable} : {where[real_var]['regex']}, ignoring regex check")
+                self.__logger.warning(f"Invalid regex for {variable} : {setting['regex']}, ignoring regex check")
 
             return True, "ok"
         # MULTISITE=yes
         prefixed, real_var = self.__var_is_prefixed(variable)
-        where, real_var = self.__find_var(real_var)
-        if not where:
+        setting = self.__find_var(real_var)
+        if not setting:
             return False, f"variable name {variable} doesn't exist"
-        elif prefixed and where[real_var]["context"] != "multisite":
+        elif prefixed and setting["context"] != "multisite":
             return False, f"context of {variable} isn't multisite"
 
         try:
-            if not re_search(where[real_var]["regex"], value) and not self.__disable_test:
-                return (False, f"value {value} doesn't match regex {where[real_var]['regex']}")
+            if not self.__match_regex(setting["regex"], value) and not self.__disable_test:
+                return (False, f"value {value} doesn't match regex {setting['regex']}")
         except RegexError:
-            self.__logger.warning(f"Invalid regex for {variable} : {where[real_var]['regex']}, ignoring regex check")
+            self.__logger.warning(f"Invalid regex for {variable} : {setting['regex']}, ignoring regex check")
 
         return True, "ok"
 
-    def __find_var(self, variable: str) -> Tuple[Optional[Dict[str, Any]], str]:
-        targets = [
-            self.__settings,
-            self.get_plugins_settings("core"),
-            self.get_plugins_settings("external"),
-            self.get_plugins_settings("pro"),
-        ]
-        for target in targets:
-            if variable in target:
-                return target, variable
-            for real_var, settings in target.items():
-                if "multiple" in settings and re_search(f"^{real_var}_[0-9]+$", variable):
-                    return target, real_var
-        return None, variable
+    def __find_var(self, variable: str) -> Optional[Dict[str, Any]]:
+        exact = self.__settings_index.get(variable)
+
+        # Strip the numeric suffix of multiple settings (e.g. REVERSE_PROXY_HOST_1)
+        multiple = None
+        base, _, suffix = variable.rpartition("_")
+        if base and suffix.isdigit() and suffix.isascii():
+            multiple = self.__multiple_index.get(base)
+
+        # Targets are checked in order and an exact name takes precedence over a multiple setting of the same target
+        if exact and (not multiple or exact[0] <= multiple[0]):
+            return exact[1]
+        return multiple[1] if multiple else None
 
     def __var_is_prefixed(self, variable: str) -> Tuple[bool, str]:
-        for server in self.__servers:
-            if variable.startswith(f"{server}_"):
-                return True, variable.replace(f"{server}_", "", 1)
-        return False, variable
+        match = None
+        node = self.__servers_trie
+        for i, char in enumerate(variable):
+            node = node.get(char)
+            if node is None:
+                break
+            # A server name followed by an underscore, the first server in the SERVER_NAME order wins
+            if "" in node and variable[i + 1 : i + 2] == "_" and (match is None or node[""] < match[0]):  # noqa: E203
+                match = (node[""], i + 2)
+        if match is None:
+            return False, variable
+        return True, variable[match[1] :]  # noqa: E203
 
     def __validate_plugin(self, plugin: dict) -> Tuple[bool, str]:
         if not all(key in plugin for key in ("id", "name", "description", "version", "stream", "settings")):
@@ -342,5 +395,11 @@ class Configurator:
                 return (False, f"Invalid every for job {job['name']} in plugin {plugin['id']} (Must be once, minute, hour, day or week)")
             elif job["reload"] is not True and job["reload"] is not False:
                 return (False, f"Invalid reload for job {job['name']} in plugin {plugin['id']} (Must be true or false)")
+            elif not isinstance(job.get("depends_on", []), list) or not all(
+                isinstance(dependency, str) and self.__name_rx.match(dependency) for dependency in job.get("depends_on", [])
+            ):
+                return (False, f"Invalid depends_on for job {job['name']} in plugin {plugin['id']} (Must be a list of job names)")
+            elif type(job.get("weight", 1)) is not int or job.get("weight", 1) < 1:
+                return (False, f"Invalid weight for job {job['name']} in plugin {plugin['id']} (Must be an integer greater than 0)")
 
         return True, "ok"
@@ -1,22 +1,170 @@
 #!/usr/bin/env python3
 
+from collections.abc import ItemsView, Mapping
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from functools import partial
 from glob import glob
+from hashlib import sha256
 from importlib import import_module
-from os.path import basename, join
+from json import JSONDecodeError, dumps, loads
+from math import ceil
+from multiprocessing import get_context
+from os import cpu_count, getpid, sep, walk
+from os.path import basename, join, normpath
 from pathlib import Path
 from random import choice
+from shutil import rmtree
 from string import ascii_letters, digits
 from sys import path as sys_path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 if join("usr", "share", "bunkerweb", "deps", "python") in sys_path:
     sys_path.append(join("usr", "share", "bunkerweb", "deps", "python"))
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import BytecodeCache, Environment, FileSystemLoader, meta
+from jinja2.bccache import Bucket
+
+WORKER_TEMPLATOR: Optional["Templator"] = None
+MISSING = object()
+
+
+def init_worker(templator: "Templator"):
+    global WORKER_TEMPLATOR
+    templator.reload_jinja_env()
+    WORKER_TEMPLATOR = templator
+
+
+def render_servers_worker(servers: List[str], volatile_only: bool = False) -> Dict[str, Tuple[List[str], List[str]]]:
+    assert WORKER_TEMPLATOR is not None, "Worker is not initialized"
+    return WORKER_TEMPLATOR.render_servers(servers, volatile_only=volatile_only)
+
+
+class TemplatesBytecodeCache(BytecodeCache):
+    """Persistent cache of the compiled templates, keyed by template path and content hash.
+
+    Each templates directory gets its own namespace named after the files it contains, so the cached bytecode of a
+    plugin is dropped as soon as its confs directory changes.
+    """
+
+    def __init__(self, directory: Union[str, Path], searchpath: List[str]):
+        self.__directory = Path(directory)
+        self.__namespaces = {path: self.__get_namespace(path) for path in searchpath}
+
+    def __get_namespace(self, path: str) -> str:
+        prefix = sha256(path.encode("utf-8")).hexdigest()[:16]
+        signature = sha256()
+        for file in sorted(Path(path).rglob("*")):
+            if file.is_file():
+                stat = file.stat()
+                signature.update(f"{file.relative_to(path)}|{stat.st_mtime_ns}|{stat.st_size}\n".encode("utf-8"))
+        namespace = f"{prefix}-{signature.hexdigest()[:16]}"
+
+        # Remove the cached bytecode of the previous versions of the directory
+        for old_namespace in self.__directory.glob(f"{prefix}-*"):
+            if old_namespace.name != namespace:
+                rmtree(old_namespace, ignore_errors=True)
+        return namespace
+
+    def get_cache_key(self, name: str, filename: Optional[str] = None) -> str:
+        namespace = "default"
+        if filename:
+            for path, path_namespace in self.__namespaces.items():
+                if filename.startswith(join(path, "")):
+                    namespace = path_namespace
+                    break
+        return join(namespace, sha256(f"{name}|{filename}".encode("utf-8")).hexdigest())
+
+    def get_source_checksum(self, source: str) -> str:
+        return sha256(source.encode("utf-8")).hexdigest()
+
+    def load_bytecode(self, bucket: Bucket):
+        try:
+            with self.__directory.joinpath(f"{bucket.key}.cache").open("rb") as f:
+                bucket.load_bytecode(f)
+        except OSError:
+            pass
+
+    def dump_bytecode(self, bucket: Bucket):
+        cache_path = self.__directory.joinpath(f"{bucket.key}.cache")
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{getpid()}.tmp")
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with tmp_path.open("wb") as f:
+                bucket.write_bytecode(f)
+            tmp_path.replace(cache_path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+
+
+class LayeredConfig(Mapping):
+    """Read-only view of a config with some settings layered on top of it, neither of them is copied."""
+
+    __slots__ = ("__layer", "__config")
+
+    def __init__(self, layer: Dict[str, Any], config: Mapping):
+        self.__layer = layer
+        self.__config = config
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.__layer.get(key, MISSING)
+        return self.__config[key] if value is MISSING else value
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.__layer or key in self.__config
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.__config
+        for key in self.__layer:
+            if key not in self.__config:
+                yield key
+
+    def __len__(self) -> int:
+        return len(self.__config) + sum(key not in self.__config for key in self.__layer)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.__layer.get(key, MISSING)
+        return self.__config.get(key, default) if value is MISSING else value
+
+    def items(self) -> ItemsView:
+        return LayeredConfigItems(self)
+
+    def iter_items(self) -> Iterator[Tuple[str, Any]]:
+        for key, value in self.__config.items():
+            yield key, self.__layer.get(key, value)
+        for key, value in self.__layer.items():
+            if key not in self.__config:
+                yield key, value
+
+
+class LayeredConfigItems(ItemsView):
+    """Items of a LayeredConfig, iterated without looking up each key in every layer (templates loop over all the settings)."""
+
+    def __iter__(self) -> Iterator[Tuple[str, Any]]:
+        return self._mapping.iter_items()
 
 
 class Templator:
-    def __init__(self, templates: str, core: str, plugins: str, pro_plugins: str, output: str, target: str, config: Dict[str, Any]):
+    MANIFEST_NAME = ".manifest.json"
+    WRITE_BUFFER_SIZE = 64 * 1024
+    # Names through which a template can read more than the settings of its server : the whole config, files or modules
+    VOLATILE_NAMES = frozenset(("all", "import", "is_custom_conf", "read_lines"))
+
+    def __init__(
+        self,
+        templates: str,
+        core: str,
+        plugins: str,
+        pro_plugins: str,
+        output: str,
+        target: str,
+        config: Dict[str, Any],
+        *,
+        incremental: bool = False,
+        workers: Optional[int] = None,
+        cache_dir: Optional[str] = None,
+        custom_confs: str = join(sep, "etc", "bunkerweb", "configs"),
+    ):
         self.__templates = templates
         self.__global_templates = [basename(template) for template in glob(join(self.__templates, "*", "*.conf"))]
         self.__core = core
@@ -25,26 +173,192 @@ class Templator:
         self.__output = output
         self.__target = target
         self.__config = config
+        self.__multisite = self.__config.get("MULTISITE", "no") == "yes"
+        self.__servers = [self.__config.get("SERVER_NAME", "").strip()]
+        if self.__multisite:
+            self.__servers = self.__config.get("SERVER_NAME", "").strip().split(" ")
+        self.__global_config, self.__servers_config = self.__split_config()
+        self.__helpers = {
+            "import": import_module,
+            "is_custom_conf": self.__is_custom_conf,
+            "has_variable": Templator.has_variable,
+            "random": Templator.random,
+            "read_lines": Templator.read_lines,
+        }
+        self.__incremental = incremental
+        self.__workers = workers or cpu_count() or 1
+        self.__custom_confs = normpath(custom_confs)
+        self.__custom_confs_index = self.__index_custom_confs()
+        self.__manifest_path = Path(self.__output, self.MANIFEST_NAME)
+        self.__searchpath = self.__get_searchpath()
+        self.__bytecode_cache = TemplatesBytecodeCache(cache_dir, self.__searchpath) if cache_dir else None
         self.__jinja_env = self.__load_jinja_env()
+        # Listed once instead of walking the templates directories for each server
+        self.__templates_list = self.__jinja_env.list_templates()
+        self.__volatile_templates: Set[str] = set()
 
-    def render(self):
-        self.__render_global()
-        servers = [self.__config.get("SERVER_NAME", "").strip()]
-        if self.__config.get("MULTISITE", "no") == "yes":
-            servers = self.__config.get("SERVER_NAME", "").strip().split(" ")
-        for server in servers:
-            self.__render_server(server)
+    def render(self) -> List[str]:
+        """Render the global and per-server templates and return the list of paths that changed.
 
-    def __load_jinja_env(self) -> Environment:
+        In incremental mode, a manifest of each server's effective config and of the templates checksums is kept
+        in the output directory so that only the servers whose inputs changed are rendered again and only the
+        directories of removed servers are deleted. Global templates are always rendered as they depend on every
+        server, but only files whose content changed are rewritten and reported. The same goes for the variables.env
+        of each server and for its templates that read the whole config, files or other templates, as their output
+        can change without the server's own settings changing.
+
+        Servers are rendered by a pool of worker processes when more than one worker is configured, the output is
+        the same as with a serial rendering.
+        """
+        servers = self.__servers
+
+        if not self.__incremental:
+            # The manifest would not match the rendered files anymore
+            self.__manifest_path.unlink(missing_ok=True)
+            changed, _ = self.__render_global()
+            for server_changed, _ in self.__render_servers(servers).values():
+                changed.extend(server_changed)
+            return list(dict.fromkeys(changed))
+
+        old_manifest = self.__load_manifest()
+        manifest = {"target": self.__target, "templates": self.__get_templates_checksums(), "global": {}, "servers": {}}
+        full_render = old_manifest.get("target") != manifest["target"] or old_manifest.get("templates") != manifest["templates"]
+        self.__volatile_templates = self.__find_volatile_templates()
+
+        changed, files = self.__render_global()
+        changed.extend(self.__remove_stale_files(old_manifest.get("global", {}).get("files", []), files))
+        manifest["global"]["files"] = files
+
+        servers_checksums = {}
+        unchanged_servers = []
+        for server, checksum in self.__get_servers_checksums(servers).items():
+            old_server = old_manifest.get("servers", {}).get(server, {})
+            if not full_render and old_server.get("checksum") == checksum:
+                manifest["servers"][server] = old_server
+                unchanged_servers.append(server)
+                continue
+            servers_checksums[server] = checksum
+
+        for server_changed, _ in self.__render_servers(unchanged_servers, volatile_only=True).values():
+            changed.extend(server_changed)
+
+        for server, (server_changed, files) in self.__render_servers(list(servers_checksums)).items():
+            changed.extend(server_changed)
+            changed.extend(self.__remove_stale_files(old_manifest.get("servers", {}).get(server, {}).get("files", []), files))
+            manifest["servers"][server] = {"checksum": servers_checksums[server], "files": files}
+
+        for server, old_server in old_manifest.get("servers", {}).items():
+            if server in manifest["servers"]:
+                continue
+            if server:
+                server_path = Path(self.__output, server)
+                if server_path.is_dir():
+                    rmtree(server_path, ignore_errors=True)
+                    changed.append(server_path.as_posix())
+            else:
+                changed.extend(self.__remove_stale_files(old_server.get("files", []), []))
+
+        self.__write_file(self.__manifest_path, (dumps(manifest, sort_keys=True),))
+        return list(dict.fromkeys(changed))
+
+    def render_servers(self, servers: List[str], *, volatile_only: bool = False) -> Dict[str, Tuple[List[str], List[str]]]:
+        """Render the given servers serially and return their changed paths and rendered files, only their volatile files if volatile_only is set."""
+        return {server: self.__render_server(server, volatile_only=volatile_only) for server in servers}
+
+    def reload_jinja_env(self):
+        self.__jinja_env = self.__load_jinja_env()
+
+    def __render_servers(self, servers: List[str], *, volatile_only: bool = False) -> Dict[str, Tuple[List[str], List[str]]]:
+        workers = min(self.__workers, len(servers))
+        if workers <= 1:
+            return self.render_servers(servers, volatile_only=volatile_only)
+
+        # Each worker is forked with its own jinja environment and renders slices of servers
+        chunk_size = ceil(len(servers) / (workers * 4))
+        chunks = [servers[i : i + chunk_size] for i in range(0, len(servers), chunk_size)]  # noqa: E203
+        results = {}
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("fork"), initializer=init_worker, initargs=(self,)) as executor:
+            for chunk_results in executor.map(partial(render_servers_worker, volatile_only=volatile_only), chunks):
+                results.update(chunk_results)
+        return results
+
+    def __get_searchpath(self) -> List[str]:
         searchpath = [self.__templates]
         for subpath in glob(join(self.__core, "*", "confs")) + glob(join(self.__plugins, "*", "confs")) + glob(join(self.__pro_plugins, "*", "confs")):
             if Path(subpath).is_dir():
                 searchpath.append(subpath)
-        return Environment(loader=FileSystemLoader(searchpath=searchpath), lstrip_blocks=True, trim_blocks=True)
+        return searchpath
+
+    def __load_jinja_env(self) -> Environment:
+        return Environment(
+            loader=FileSystemLoader(searchpath=self.__searchpath), bytecode_cache=self.__bytecode_cache, lstrip_blocks=True, trim_blocks=True
+        )
+
+    def __load_manifest(self) -> Dict[str, Any]:
+        try:
+            manifest = loads(self.__manifest_path.read_text())
+        except (OSError, JSONDecodeError):
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    def __get_templates_checksums(self) -> Dict[str, str]:
+        checksums = {}
+        for template in self.__templates_list:
+            source = self.__jinja_env.loader.get_source(self.__jinja_env, template)[0]  # type: ignore
+            checksums[template] = sha256(source.encode("utf-8")).hexdigest()
+        return checksums
+
+    def __find_volatile_templates(self) -> Set[str]:
+        """Find the templates whose output can depend on more than the settings of the server they are rendered for."""
+        volatile_templates = set()
+        for template in self.__templates_list:
+            source = self.__jinja_env.loader.get_source(self.__jinja_env, template)[0]  # type: ignore
+            ast = self.__jinja_env.parse(source)
+            # The included or imported templates are not looked into
+            if self.VOLATILE_NAMES.intersection(meta.find_undeclared_variables(ast)) or next(meta.find_referenced_templates(ast), None) is not None:
+                volatile_templates.add(template)
+        return volatile_templates
+
+    def __split_config(self) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+        """Split the config once into the global settings and the prefix-stripped settings of each server."""
+        if not self.__multisite:
+            return self.__config, {}
+
+        servers_set = set(self.__servers)
+        global_config = {}
+        servers_config = {server: {} for server in self.__servers}
+        for variable, value in self.__config.items():
+            prefixed = False
+            index = variable.find("_")
+            while index != -1:
+                if variable[:index] in servers_set:
+                    servers_config[variable[:index]][variable[index + 1 :]] = value  # noqa: E203
+                    prefixed = True
+                index = variable.find("_", index + 1)
+            if not prefixed:
+                global_config[variable] = value
+        return global_config, servers_config
+
+    def __get_servers_checksums(self, servers: List[str]) -> Dict[str, str]:
+        """Compute a checksum of each server's effective config (global settings + its own prefix-stripped settings)."""
+        if not self.__multisite:
+            return {server: sha256(dumps(self.__config, sort_keys=True).encode("utf-8")).hexdigest() for server in servers}
+        return {
+            server: sha256(dumps(self.__global_config | self.__servers_config[server], sort_keys=True).encode("utf-8")).hexdigest() for server in servers
+        }
+
+    def __remove_stale_files(self, old_files: List[str], files: List[str]) -> List[str]:
+        removed = []
+        for file in set(old_files).difference(files):
+            file_path = Path(self.__output, file)
+            if file_path.is_file():
+                file_path.unlink(missing_ok=True)
+                removed.append(file_path.as_posix())
+        return removed
 
     def __find_templates(self, contexts) -> List[str]:
         templates = []
-        for template in self.__jinja_env.list_templates():
+        for template in self.__templates_list:
             if "global" in contexts and "/" not in template:
                 templates.append(template)
                 continue
@@ -53,66 +367,114 @@ class Templator:
                     templates.append(template)
         return templates
 
-    def __write_config(self, subpath: Optional[str] = None, config: Optional[Dict[str, Any]] = None):
-        real_path = Path(self.__output, subpath or "", "variables.env")
+    def __write_file(self, real_path: Path, chunks: Iterable[str]) -> bool:
+        """Stream the chunks to a temporary file which replaces the file only if its content differs, return whether the file changed.
+
+        The file is never half-written and the whole content is never held in memory.
+        """
         real_path.parent.mkdir(parents=True, exist_ok=True)
-        real_path.write_text("\n".join(f"{k}={v}" for k, v in (config or self.__config).items()))
+        tmp_path = real_path.with_name(f".{real_path.name}.{getpid()}.tmp")
+        try:
+            with tmp_path.open("w", encoding="utf-8", buffering=self.WRITE_BUFFER_SIZE) as f:
+                f.writelines(chunks)
+
+            if self.__incremental and real_path.is_file() and self.__same_content(tmp_path, real_path):
+                tmp_path.unlink()
+                return False
+
+            tmp_path.replace(real_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return True
+
+    def __same_content(self, path: Path, other_path: Path) -> bool:
+        if path.stat().st_size != other_path.stat().st_size:
+            return False
+        with path.open("rb") as f, other_path.open("rb") as other_f:
+            while True:
+                block = f.read(self.WRITE_BUFFER_SIZE)
+                if block != other_f.read(self.WRITE_BUFFER_SIZE):
+                    return False
+                if not block:
+                    return True
 
-    def __render_global(self):
-        self.__write_config()
+    def __write_config(self, subpath: Optional[str] = None, config: Optional[Mapping[str, Any]] = None) -> Tuple[Path, bool]:
+        real_path = Path(self.__output, subpath or "", "variables.env")
+        return real_path, self.__write_file(real_path, ("\n".join(f"{k}={v}" for k, v in (config or self.__config).items()),))
+
+    def __render_global(self) -> Tuple[List[str], List[str]]:
+        results = [self.__write_config()]
         templates = self.__find_templates(["global", "http", "stream", "default-server-http"])
         for template in templates:
-            self.__render_template(template)
+            results.append(self.__render_template(template))
+        return self.__split_results(results)
+
+    def __split_results(self, results: List[Tuple[Path, bool]]) -> Tuple[List[str], List[str]]:
+        """Split render results into the list of changed paths and the list of rendered files relative to the output."""
+        changed = [path.as_posix() for path, has_changed in results if has_changed]
+        files = [path.relative_to(self.__output).as_posix() for path, _ in results]
+        return changed, files
 
-    def __render_server(self, server: str):
+    def __render_server(self, server: str, *, volatile_only: bool = False) -> Tuple[List[str], List[str]]:
+        results = []
         templates = self.__find_templates(["modsec", "modsec-crs", "server-http", "server-stream"])
-        if self.__config.get("MULTISITE", "no") == "yes":
-            config = self.__config.copy()
-            for variable, value in self.__config.items():
-                if variable.startswith(f"{server}_"):
-                    config[variable.replace(f"{server}_", "", 1)] = value
-            self.__write_config(subpath=server, config=config)
+        if volatile_only:
+            templates = [template for template in templates if template in self.__volatile_templates]
+        subpath = None
+        config = None
+        if self.__multisite:
+            # Read-only views of the server's own settings layered on top of the whole config, so nothing is copied
+            subpath = server
+            results.append(self.__write_config(subpath=server, config=LayeredConfig(self.__servers_config[server], self.__config)))
+            server_config = self.__servers_config[server] | {"NGINX_PREFIX": join(self.__target, server) + "/"}
+            if f"{server}_SERVER_NAME" not in self.__config:
+                server_config["SERVER_NAME"] = server
+            config = LayeredConfig(server_config, self.__config)
 
         for template in templates:
-            subpath = None
-            config = None
             name = None
-            if self.__config.get("MULTISITE", "no") == "yes":
-                subpath = server
-                config = self.__config.copy()
-                for variable, value in self.__config.items():
-                    if variable.startswith(f"{server}_"):
-                        config[variable.replace(f"{server}_", "", 1)] = value
-                config["NGINX_PREFIX"] = join(self.__target, server) + "/"
-                server_key = f"{server}_SERVER_NAME"
-                if server_key not in self.__config:
-                    config["SERVER_NAME"] = server
-
             for root_conf in self.__global_templates:
                 if template.endswith(root_conf):
                     name = basename(template)
                     break
-            self.__render_template(template, subpath=subpath, config=config, name=name)
+            results.append(self.__render_template(template, subpath=subpath, config=config, name=name))
+        return self.__split_results(results)
 
     def __render_template(
         self,
         template: str,
         subpath: Optional[str] = None,
-        config: Optional[Dict[str, Any]] = None,
+        config: Optional[Mapping[str, Any]] = None,
         name: Optional[str] = None,
-    ):
+    ) -> Tuple[Path, bool]:
         # Get real config and output folder in case it's a server config and we are in multisite mode
-        real_config = config.copy() if config else self.__config.copy()
-        real_config["all"] = real_config.copy()
-        real_config["import"] = import_module
-        real_config["is_custom_conf"] = Templator.is_custom_conf
-        real_config["has_variable"] = Templator.has_variable
-        real_config["random"] = Templator.random
-        real_config["read_lines"] = Templator.read_lines
+        config = config or self.__config
         real_path = Path(self.__output, subpath or "", name or template)
         jinja_template = self.__jinja_env.get_template(template)
-        real_path.parent.mkdir(parents=True, exist_ok=True)
-        real_path.write_text(jinja_template.render(real_config))
+
+        # The template reads through the layers instead of a merged copy of the config (Template.render would copy it)
+        context = jinja_template.new_context(LayeredConfig({**jinja_template.globals, **self.__helpers, "all": config}, config), shared=True)
+        try:
+            return real_path, self.__write_file(real_path, jinja_template.root_render_func(context))  # type: ignore
+        except Exception:
+            self.__jinja_env.handle_exception()
+
+    def __index_custom_confs(self) -> Set[str]:
+        """Walk the custom configs tree once and return the directories containing at least one .conf entry."""
+        index = set()
+        for dirpath, dirnames, filenames in walk(self.__custom_confs, followlinks=True):
+            # Same matches as glob, which ignores hidden entries
+            if any(not name.startswith(".") and fnmatch(name, "*.conf") for name in dirnames + filenames):
+                index.add(normpath(dirpath))
+        return index
+
+    def __is_custom_conf(self, path: str) -> bool:
+        """Same as is_custom_conf() but paths inside the custom configs tree are looked up in the index instead of being scanned."""
+        path = normpath(path)
+        if path == self.__custom_confs or path.startswith(join(self.__custom_confs, "")):
+            return path in self.__custom_confs_index
+        return Templator.is_custom_conf(path)
 
     @staticmethod
     def is_custom_conf(path: str) -> bool:
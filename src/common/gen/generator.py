@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+from logging import Logger
+from os import getenv, sep
+from os.path import join
+from pathlib import Path
+from shutil import rmtree
+from subprocess import DEVNULL, STDOUT, run
+from sys import path as sys_path
+from time import sleep
+from typing import Any, Dict, List, Optional, Union
+
+for deps_path in [join(sep, "usr", "share", "bunkerweb", *paths) for paths in (("deps", "python"), ("utils",))]:
+    if deps_path not in sys_path:
+        sys_path.append(deps_path)
+
+from logger import setup_logger  # type: ignore
+from Configurator import Configurator
+from Templator import Templator
+
+SETTINGS_PATH = join(sep, "usr", "share", "bunkerweb", "settings.json")
+TEMPLATES_PATH = join(sep, "usr", "share", "bunkerweb", "confs")
+CORE_PATH = join(sep, "usr", "share", "bunkerweb", "core")
+PLUGINS_PATH = join(sep, "etc", "bunkerweb", "plugins")
+PRO_PLUGINS_PATH = join(sep, "etc", "bunkerweb", "pro", "plugins")
+OUTPUT_PATH = join(sep, "etc", "nginx")
+# Kept out of /var/cache/bunkerweb as that directory is sent to the instances and copied to the failover config
+TEMPLATES_CACHE_PATH = join(sep, "var", "tmp", "bunkerweb", "jinja")
+
+
+def load_registry(
+    logger: Optional[Logger] = None,
+    *,
+    settings: str = SETTINGS_PATH,
+    core: str = CORE_PATH,
+    plugins: str = PLUGINS_PATH,
+    pro_plugins: str = PRO_PLUGINS_PATH,
+) -> Configurator:
+    """Load and validate the settings and the plugins once so that they can be reused by several calls to generate()."""
+    return Configurator(settings, core, plugins, pro_plugins, {}, logger or setup_logger("Generator", getenv("LOG_LEVEL", "INFO")))
+
+
+def generate(
+    config: Union[str, Dict[str, Any]],
+    output: str = OUTPUT_PATH,
+    target: str = OUTPUT_PATH,
+    *,
+    logger: Optional[Logger] = None,
+    registry: Optional[Configurator] = None,
+    compute: bool = True,
+    settings: str = SETTINGS_PATH,
+    templates: str = TEMPLATES_PATH,
+    core: str = CORE_PATH,
+    plugins: str = PLUGINS_PATH,
+    pro_plugins: str = PRO_PLUGINS_PATH,
+    incremental: bool = False,
+    workers: Optional[int] = None,
+    templates_cache: Optional[str] = TEMPLATES_CACHE_PATH,
+) -> List[str]:
+    """Generate the nginx configuration files in the output directory and return the list of changed paths.
+
+    The config is either a path to a variables file or a dict of variables. Unless compute is False, the final config
+    is computed and validated with a Configurator, using the settings and plugins of the registry if one is given.
+    The old files of the output directory are removed first unless the rendering is incremental.
+    """
+    logger = logger or setup_logger("Generator", getenv("LOG_LEVEL", "INFO"))
+
+    if compute:
+        logger.info("Computing config ...")
+        if registry:
+            configurator = Configurator(
+                registry.get_settings(), registry.get_plugins("core"), registry.get_plugins("external"), registry.get_plugins("pro"), config, logger
+            )
+        else:
+            configurator = Configurator(settings, core, plugins, pro_plugins, config, logger)
+        config = configurator.get_config()
+    assert isinstance(config, dict), "The config must be a dict when it's not computed"
+
+    if not incremental:
+        logger.info("Removing old files ...")
+        for file in Path(output).glob("*"):
+            if file.is_symlink() or file.is_file():
+                file.unlink()
+            elif file.is_dir():
+                rmtree(file, ignore_errors=True)
+
+    logger.info("Rendering templates ...")
+    return Templator(
+        templates, core, plugins, pro_plugins, output, target, config, incremental=incremental, workers=workers, cache_dir=templates_cache or None
+    ).render()
+
+
+def wait_for_nginx(logger: Logger) -> bool:
+    """Wait for the local nginx to be started (Linux integration), return False if it didn't start in time."""
+    retries = 0
+    while not Path(sep, "var", "run", "bunkerweb", "nginx.pid").exists():
+        if retries == 5:
+            logger.error("BunkerWeb's nginx didn't start in time.")
+            return False
+
+        logger.warning("Waiting for BunkerWeb's nginx to start, retrying in 5 seconds ...")
+        retries += 1
+        sleep(5)
+    return True
+
+
+def reload_nginx(logger: Logger) -> bool:
+    """Reload the local nginx once it's started (Linux integration)."""
+    if not wait_for_nginx(logger):
+        return False
+
+    proc = run([join(sep, "usr", "sbin", "nginx"), "-s", "reload"], stdin=DEVNULL, stderr=STDOUT, check=False)
+    if proc.returncode != 0:
+        logger.error("Error while reloading nginx")
+        return False
+    logger.info("Successfully reloaded nginx")
+    return True
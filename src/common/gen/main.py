@@ -1,16 +1,11 @@
 #!/usr/bin/env python3
 
 from argparse import ArgumentParser
-from glob import glob
 from os import R_OK, W_OK, X_OK, access, getenv, sep
 from os.path import join
 from pathlib import Path
-from shutil import rmtree
-from subprocess import DEVNULL, STDOUT, run
 from sys import exit as sys_exit, path as sys_path
-from time import sleep
 from traceback import format_exc
-from typing import Any, Dict
 
 for deps_path in [join(sep, "usr", "share", "bunkerweb", *paths) for paths in (("deps", "python"), ("utils",), ("api",))]:
     if deps_path not in sys_path:
@@ -18,8 +13,7 @@ for deps_path in [join(sep, "usr", "share", "bunkerweb", *paths) for paths in ((
 
 from common_utils import get_integration  # type: ignore
 from logger import setup_logger  # type: ignore
-from Configurator import Configurator
-from Templator import Templator
+from generator import generate, reload_nginx
 
 
 if __name__ == "__main__":
@@ -40,6 +34,14 @@ if __name__ == "__main__":
         parser.add_argument("--target", default=join(sep, "etc", "nginx"), type=str, help="where nginx will search for configurations files")
         parser.add_argument("--variables", type=str, help="path to the file containing environment variables")
         parser.add_argument("--no-linux-reload", action="store_true", help="disable linux reload")
+        parser.add_argument("--incremental", action="store_true", help="only render again the servers whose config or templates changed")
+        parser.add_argument("--workers", type=int, help="number of processes used to render the servers (default: number of CPUs)")
+        parser.add_argument(
+            "--templates-cache",
+            default=join(sep, "var", "tmp", "bunkerweb", "jinja"),
+            type=str,
+            help="directory where the compiled templates are cached (empty to disable)",
+        )
         args = parser.parse_args()
 
         settings_path = Path(args.settings)
@@ -101,11 +103,7 @@ if __name__ == "__main__":
                     )
                     sys_exit(1)
 
-            # Compute the config
-            logger.info("Computing config ...")
-            config: Dict[str, Any] = Configurator(
-                str(settings_path), str(core_path), str(plugins_path), str(pro_plugins_path), str(variables_path), logger
-            ).get_config()
+            config = str(variables_path)
         else:
             if join(sep, "usr", "share", "bunkerweb", "db") not in sys_path:
                 sys_path.append(join(sep, "usr", "share", "bunkerweb", "db"))
@@ -116,48 +114,31 @@ if __name__ == "__main__":
                 logger,
                 sqlalchemy_string=getenv("DATABASE_URI", None),
             )
-            config: Dict[str, Any] = db.get_config()
-
-        # Remove old files
-        logger.info("Removing old files ...")
-        files = glob(join(args.output, "*"))
-        for file in files:
-            file = Path(file)
-            if file.is_symlink() or file.is_file():
-                file.unlink()
-            elif file.is_dir():
-                rmtree(str(file), ignore_errors=True)
-
-        # Render the templates
-        logger.info("Rendering templates ...")
-        templator = Templator(str(templates_path), str(core_path), str(plugins_path), str(pro_plugins_path), str(output_path), str(target_path), config)
-        templator.render()
+            config = db.get_config()
+
+        changed_paths = generate(
+            config,
+            str(output_path),
+            str(target_path),
+            logger=logger,
+            compute=bool(args.variables),
+            settings=str(settings_path),
+            templates=str(templates_path),
+            core=str(core_path),
+            plugins=str(plugins_path),
+            pro_plugins=str(pro_plugins_path),
+            incremental=args.incremental,
+            workers=args.workers,
+            templates_cache=args.templates_cache,
+        )
+        if args.incremental:
+            logger.info(f"{len(changed_paths)} rendered path(s) changed")
+            for changed_path in changed_paths:
+                logger.debug(f"Changed path : {changed_path}")
 
         if integration not in ("Autoconf", "Swarm", "Kubernetes", "Docker") and not args.no_linux_reload:
-            retries = 0
-            while not Path(sep, "var", "run", "bunkerweb", "nginx.pid").exists():
-                if retries == 5:
-                    logger.error(
-                        "BunkerWeb's nginx didn't start in time.",
-                    )
-                    sys_exit(1)
-
-                logger.warning(
-                    "Waiting for BunkerWeb's nginx to start, retrying in 5 seconds ...",
-                )
-                retries += 1
-                sleep(5)
-
-            proc = run(
-                [join(sep, "usr", "sbin", "nginx"), "-s", "reload"],
-                stdin=DEVNULL,
-                stderr=STDOUT,
-            )
-            if proc.returncode != 0:
-                status = 1
-                logger.error("Error while reloading nginx")
-            else:
-                logger.info("Successfully reloaded nginx")
+            if not reload_nginx(logger):
+                sys_exit(1)
 
     except SystemExit as e:
         raise e
@@ -1,28 +1,84 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
 from io import BytesIO
-from os import getenv, sep
-from os.path import join
+from os import getenv, sep, stat, walk
+from os.path import join, relpath
+from pathlib import Path
+from stat import S_IMODE
 from sys import path as sys_path
-from tarfile import open as tar_open
-from typing import Any, Dict, List, Literal, Optional, Tuple, Union
+from tarfile import TarInfo, open as tar_open
+from tempfile import TemporaryDirectory
+from time import monotonic, perf_counter, sleep
+from typing import Any, Dict, List, Literal, NamedTuple, Optional, Tuple, Union
 
 for deps_path in [join(sep, "usr", "share", "bunkerweb", *paths) for paths in (("deps", "python"), ("utils",))]:
     if deps_path not in sys_path:
         sys_path.append(deps_path)
 
 from API import API  # type: ignore
+from common_utils import file_hash  # type: ignore
 from logger import setup_logger
 
 from docker import DockerClient
 from kubernetes import client as kube_client, config
 
 
+class ApiResult(NamedTuple):
+    """Result of a request sent to the API of an instance."""
+
+    endpoint: str
+    instance: str
+    sent: bool
+    status: Optional[int]
+    response: Optional[Dict[str, Any]]
+    error: str
+    duration: float
+
+    @property
+    def success(self) -> bool:
+        return self.sent and self.status == 200
+
+
 class ApiCaller:
+    # Render manifest of the config generator (see Templator), it's only used by the scheduler
+    SYNC_EXCLUDED = (".manifest.json",)
+
     def __init__(self, apis: Optional[List[API]] = None):
         self.__apis = apis or []
         self.__logger = setup_logger("Api", getenv("LOG_LEVEL", "INFO"))
 
+        max_workers = getenv("API_MAX_CONCURRENCY", "16")
+        if not max_workers.isdigit() or int(max_workers) < 1:
+            self.__logger.warning(f"Invalid API_MAX_CONCURRENCY {max_workers}, using 16")
+            max_workers = "16"
+        self.__max_workers = int(max_workers)
+
+        self.__reload_strategy = getenv("SCHEDULER_RELOAD_STRATEGY", "all")
+        if self.__reload_strategy not in ("all", "rolling"):
+            self.__logger.warning(f"Invalid SCHEDULER_RELOAD_STRATEGY {self.__reload_strategy}, using all")
+            self.__reload_strategy = "all"
+
+        self.__reload_batch_size = getenv("SCHEDULER_RELOAD_BATCH_SIZE", "25%")
+        if not self.__reload_batch_size.removesuffix("%").isdigit() or int(self.__reload_batch_size.removesuffix("%")) < 1:
+            self.__logger.warning(f"Invalid SCHEDULER_RELOAD_BATCH_SIZE {self.__reload_batch_size}, using 25%")
+            self.__reload_batch_size = "25%"
+
+        reload_timeout = getenv("SCHEDULER_RELOAD_TIMEOUT", "60")
+        if not reload_timeout.isdigit():
+            self.__logger.warning(f"Invalid SCHEDULER_RELOAD_TIMEOUT {reload_timeout}, using 60")
+            reload_timeout = "60"
+        self.__reload_timeout = int(reload_timeout)
+
+        health_timeout = getenv("SCHEDULER_RELOAD_HEALTH_TIMEOUT", "30")
+        if not health_timeout.isdigit():
+            self.__logger.warning(f"Invalid SCHEDULER_RELOAD_HEALTH_TIMEOUT {health_timeout}, using 30")
+            health_timeout = "30"
+        self.__reload_health_timeout = int(health_timeout)
+        # Hashes of the synced files by path, reused as long as their size and mtime don't change
+        self.__hashes: Dict[str, Tuple[int, int, str]] = {}
+
     @property
     def apis(self) -> List[API]:
         return self.__apis
@@ -99,56 +155,237 @@ class ApiCaller:
                     )
                 )
 
+    def __call_api(
+        self, api: API, method: Union[Literal["POST"], Literal["GET"]], url: str, files: Optional[Dict[str, Union[bytes, Path]]], data: Optional[Dict[str, Any]]
+    ) -> ApiResult:
+        start = perf_counter()
+        sent, err, status, resp = api.request(method, url, files=files, data=data)
+        return ApiResult(api.endpoint, api.endpoint.replace("http://", "").split(":")[0], sent, status, resp, err, perf_counter() - start)
+
+    def __fan_out(
+        self, calls: List[Tuple[API, Union[Literal["POST"], Literal["GET"]], str, Optional[Dict[str, bytes]], Optional[Dict[str, Any]]]]
+    ) -> List[ApiResult]:
+        if len(calls) <= 1:
+            return [self.__call_api(*call) for call in calls]
+
+        with ThreadPoolExecutor(max_workers=min(len(calls), self.__max_workers), thread_name_prefix="bw-api") as executor:
+            return list(executor.map(lambda call: self.__call_api(*call), calls))
+
+    def call_apis(
+        self,
+        method: Union[Literal["POST"], Literal["GET"]],
+        url: str,
+        files: Optional[Dict[str, Union[BytesIO, Path]]] = None,
+        data: Optional[Dict[str, Any]] = None,
+    ) -> List[ApiResult]:
+        """Send the request to all the APIs concurrently, at most API_MAX_CONCURRENCY at a time, and return their results in the same order."""
+        url = url if not url.startswith("/") else url[1:]
+        # The buffers are read once and shared by the requests instead of being rewound, the files on disk are streamed by each request
+        files_data = {name: file if isinstance(file, Path) else file.getvalue() for name, file in files.items()} if files is not None else None
+        return self.__fan_out([(api, method, url, files_data, data) for api in self.__apis])
+
+    def __check_result(self, result: ApiResult, url: str) -> bool:
+        if not result.sent:
+            self.__logger.error(
+                f"Can't send API request to {result.endpoint}{url} ({result.duration:.2f}s) : {result.error}",
+            )
+            return False
+        elif result.status != 200:
+            resp = result.response or {}
+            self.__logger.error(
+                f"Error while sending API request to {result.endpoint}{url} ({result.duration:.2f}s) : status = {resp.get('status')}, msg = {resp.get('msg')}",
+            )
+            return False
+        self.__logger.info(
+            f"Successfully sent API request to {result.endpoint}{url} ({result.duration:.2f}s)",
+        )
+        return True
+
     def send_to_apis(
         self,
         method: Union[Literal["POST"], Literal["GET"]],
         url: str,
-        files: Optional[Dict[str, BytesIO]] = None,
+        files: Optional[Dict[str, Union[BytesIO, Path]]] = None,
         data: Optional[Dict[str, Any]] = None,
         response: bool = False,
     ) -> Tuple[bool, Tuple[bool, Optional[Dict[str, Any]]]]:
         ret = True
         url = url if not url.startswith("/") else url[1:]
         responses = {}
-        for api in self.__apis:
-            if files is not None:
-                for buffer in files.values():
-                    buffer.seek(0, 0)
-            sent, err, status, resp = api.request(method, url, files=files, data=data)
-            if not sent:
+        for result in self.call_apis(method, url, files=files, data=data):
+            if not self.__check_result(result, url):
                 ret = False
-                self.__logger.error(
-                    f"Can't send API request to {api.endpoint}{url} : {err}",
-                )
-            else:
-                if status != 200:
-                    ret = False
-                    self.__logger.error(
-                        f"Error while sending API request to {api.endpoint}{url} : status = {resp['status']}, msg = {resp['msg']}",
-                    )
-                else:
-                    self.__logger.info(
-                        f"Successfully sent API request to {api.endpoint}{url}",
-                    )
-
-                    if response:
-                        instance = api.endpoint.replace("http://", "").split(":")[0]
-                        if isinstance(resp, dict):
-                            responses[instance] = resp
-                        else:
-                            responses[instance] = resp.json()
+            elif response:
+                responses[result.instance] = result.response
 
         if response:
             return ret, responses
         return ret
 
+    def __wait_healthy(self, apis: List[API]) -> bool:
+        """Ping the instances until they all answer or SCHEDULER_RELOAD_HEALTH_TIMEOUT is reached."""
+        deadline = monotonic() + self.__reload_health_timeout
+        while True:
+            results = self.__fan_out([(api, "GET", "ping", None, None) for api in apis])
+            apis = [api for api, result in zip(apis, results) if not result.success]
+            if not apis:
+                return True
+            elif monotonic() >= deadline:
+                for result in results:
+                    if not result.success:
+                        self.__check_result(result, "ping")
+                return False
+            sleep(1)
+
+    def __reload(self, apis: List[API]) -> bool:
+        """Start the reload of the instances and wait for the end of their config test, the instances that don't support it reload synchronously."""
+        success = True
+        pending = []
+        for api, result in zip(apis, self.__fan_out([(api, "POST", "reload?async=yes", None, None) for api in apis])):
+            if not self.__check_result(result, "reload"):
+                success = False
+            elif isinstance((result.response or {}).get("data"), dict):
+                pending.append((api, result.response["data"].get("id")))
+
+        deadline = monotonic() + self.__reload_timeout
+        while pending:
+            sleep(0.5)
+            results = self.__fan_out([(api, "GET", "reload/status", None, None) for api, _ in pending])
+            running = []
+            for (api, reload_id), result in zip(pending, results):
+                state = (result.response or {}).get("data") or {}
+                # The API can be briefly unavailable while Nginx reloads
+                if not result.success or state.get("status") == "running":
+                    running.append((api, reload_id))
+                elif state.get("id") != reload_id:
+                    # Another reload started after this one, its result is unknown
+                    success = False
+                    self.__logger.error(f"Error while reloading {api.endpoint} : the status of the reload was replaced by the one of another reload")
+                elif state.get("status") != "success":
+                    success = False
+                    self.__logger.error(f"Error while reloading {api.endpoint} : {state.get('msg')}")
+                else:
+                    self.__logger.info(f"Successfully reloaded {api.endpoint} ({state.get('finished', 0) - state.get('started', 0):.2f}s)")
+            pending = running
+
+            if pending and monotonic() >= deadline:
+                success = False
+                for api, _ in pending:
+                    self.__logger.error(f"The reload of {api.endpoint} didn't finish after {self.__reload_timeout} seconds")
+                break
+        return success
+
+    def reload_apis(self) -> bool:
+        """Reload the instances, all at once or in waves of SCHEDULER_RELOAD_BATCH_SIZE instances when SCHEDULER_RELOAD_STRATEGY is rolling.
+
+        In rolling mode the next wave is only reloaded once the reload status of the instances of the current one is successful and they answer to /ping again,
+        the reload stops at the first wave that fails so that the caller can fail over before the remaining instances get the new configuration.
+        """
+        if self.__reload_strategy == "all" or len(self.__apis) <= 1:
+            return self.__reload(self.__apis)
+
+        if self.__reload_batch_size.endswith("%"):
+            batch_size = ceil(len(self.__apis) * int(self.__reload_batch_size[:-1]) / 100)
+        else:
+            batch_size = int(self.__reload_batch_size)
+        batch_size = max(1, min(batch_size, len(self.__apis)))
+        waves = ceil(len(self.__apis) / batch_size)
+
+        for wave in range(waves):
+            apis = self.__apis[wave * batch_size : (wave + 1) * batch_size]  # noqa: E203
+            self.__logger.info(f"Reloading wave {wave + 1}/{waves} of the rolling reload ({len(apis)} instances) ...")
+            success = self.__reload(apis)
+            if success and not self.__wait_healthy(apis):
+                self.__logger.error(f"Instances of wave {wave + 1}/{waves} are not healthy after {self.__reload_health_timeout} seconds")
+                success = False
+
+            if not success:
+                remaining = len(self.__apis) - (wave + 1) * batch_size
+                if remaining > 0:
+                    self.__logger.error(f"Wave {wave + 1}/{waves} of the rolling reload failed, the remaining {remaining} instances are not reloaded")
+                return False
+        return True
+
+    def __get_manifest(self, path: str) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """Return the manifest of the directory (relative path -> sha256 and mode of the files, relative directories) and the path of a file for each hash."""
+        files = {}
+        dirs = []
+        paths = {}
+        hashes = {}
+        for root, dir_names, file_names in walk(path, followlinks=True):
+            if root == path:
+                dir_names[:] = [dir_name for dir_name in dir_names if dir_name not in self.SYNC_EXCLUDED]
+                file_names = [file_name for file_name in file_names if file_name not in self.SYNC_EXCLUDED]
+            dirs.extend(relpath(join(root, dir_name), path) for dir_name in dir_names)
+            for file_name in file_names:
+                file_path = join(root, file_name)
+                try:
+                    file_stat = stat(file_path)
+                except OSError:
+                    # Broken symlink
+                    continue
+
+                cached = self.__hashes.get(file_path)
+                if cached and cached[:2] == (file_stat.st_size, file_stat.st_mtime_ns):
+                    file_sha256 = cached[2]
+                else:
+                    file_sha256 = file_hash(file_path, algorithm="sha256")
+                hashes[file_path] = (file_stat.st_size, file_stat.st_mtime_ns, file_sha256)
+                files[relpath(file_path, path)] = {"hash": file_sha256, "mode": S_IMODE(file_stat.st_mode)}
+                paths[file_sha256] = file_path
+
+        # Only the files that still exist are kept
+        for file_path in [file_path for file_path in self.__hashes if file_path.startswith(join(path, ""))]:
+            del self.__hashes[file_path]
+        self.__hashes.update(hashes)
+        return {"files": files, "dirs": dirs}, paths
+
+    def __exclude_from_archive(self, tarinfo: TarInfo) -> Optional[TarInfo]:
+        """Filter of the full archive leaving out the files excluded from the sync"""
+        if Path(tarinfo.name).parts[:1] in [(name,) for name in self.SYNC_EXCLUDED]:
+            return None
+        return tarinfo
+
     def send_files(self, path: str, url: str) -> bool:
+        """Sync the directory to the instances : only the files an instance doesn't have yet are sent to it.
+
+        The instances that don't support the sync yet get the whole directory like before.
+        """
         ret = True
-        with BytesIO() as tgz:
-            with tar_open(mode="w:gz", fileobj=tgz, dereference=True, compresslevel=3) as tf:
-                tf.add(path, arcname=".")
-            tgz.seek(0, 0)
-            files = {"archive.tar.gz": tgz}
-            if not self.send_to_apis("POST", url, files=files):
+        url = url if not url.startswith("/") else url[1:]
+        manifest, paths = self.__get_manifest(path)
+
+        calls = []
+        archives: Dict[frozenset, Path] = {}
+        full_archive = None
+        # The archives are compressed on disk and streamed to the instances so that the memory used doesn't grow with the size of the directory
+        with TemporaryDirectory(prefix="bw-api-") as tmp_dir:
+            for api, result in zip(self.__apis, self.call_apis("POST", f"{url}/manifest", data=manifest)):
+                if result.sent and result.status == 404:
+                    if full_archive is None:
+                        full_archive = Path(tmp_dir, "full.tar.gz")
+                        with tar_open(full_archive, mode="w:gz", dereference=True, compresslevel=3) as tf:
+                            tf.add(path, arcname=".", filter=self.__exclude_from_archive)
+                    calls.append((api, "POST", url, {"archive.tar.gz": full_archive}, None))
+                    continue
+                elif not result.success:
+                    ret = False
+                    self.__check_result(result, f"{url}/manifest")
+                    continue
+
+                # The instances missing the same files share the same archive
+                missing = frozenset((result.response or {}).get("data") or [])
+                if missing not in archives:
+                    archives[missing] = Path(tmp_dir, f"{len(archives)}.tar.gz")
+                    with tar_open(archives[missing], mode="w:gz", dereference=True, compresslevel=3) as tf:
+                        for file_sha256 in sorted(missing & paths.keys()):
+                            tf.add(paths[file_sha256], arcname=file_sha256)
+                    self.__logger.debug(f"Sending {len(missing)} of {len(manifest['files'])} files of {path} to the instances missing them")
+                calls.append((api, "POST", f"{url}/apply", {"archive.tar.gz": archives[missing]}, None))
+
+            results = self.__fan_out(calls)
+
+        for result, (_, _, call_url, _, _) in zip(results, calls):
+            if not self.__check_result(result, call_url):
                 ret = False
         return ret
@@ -2,21 +2,23 @@
 # -*- coding: utf-8 -*-
 
 from datetime import datetime, timedelta
-from io import BytesIO
 from logging import Logger
 from os import getenv
 from os.path import sep
 from pathlib import Path
-from shutil import rmtree
+from shutil import copyfile, rmtree
 from sys import argv
 from tarfile import TarFile, open as tar_open
+from tempfile import NamedTemporaryFile, TemporaryFile
 from threading import Lock
 from traceback import format_exc
-from typing import Any, Dict, Literal, Optional, Tuple, Union
+from typing import Any, BinaryIO, Dict, Literal, Optional, Tuple, Union
 
 from common_utils import bytes_hash, file_hash
 
 LOCK = Lock()
+# Set by the scheduler's job workers so that the jobs they run share the same Database instead of creating one each
+DATABASE = None
 EXPIRE_TIME = {
     "hour": timedelta(hours=1).total_seconds(),
     "day": timedelta(days=1).total_seconds(),
@@ -41,7 +43,7 @@ class Job:
         self.job_path = Path(sep, "var", "cache", "bunkerweb", source_path.parent.parent.name)
         self.job_name = job_name or source_path.name.replace(".py", "")
 
-        self.db = db
+        self.db = db or DATABASE
         if not self.db:
             from Database import Database  # type: ignore
 
@@ -57,10 +59,11 @@ class Job:
     def restore_cache(self, *, job_name: str = "", plugin_id: str = "", manual: bool = True) -> bool:
         """Restore job cache files from database."""
         ret = True
+        job_name = job_name or self.job_name
         with LOCK:
-            job_cache_files = self.db.get_jobs_cache_files(plugin_id=plugin_id or self.job_path.name)  # type: ignore
+            # The files of the other jobs of the plugin are only listed, the job's own files are streamed from the database when restored
+            job_cache_files = self.db.get_jobs_cache_files(plugin_id=plugin_id or self.job_path.name, with_data=False)  # type: ignore
 
-        job_name = job_name or self.job_name
         plugin_cache_files = set()
         ignored_dirs = set()
 
@@ -76,10 +79,12 @@ class Job:
                     ignored_dirs.add(extract_path.as_posix())
                     if job_cache_file["job_name"] != job_name:
                         continue
-                    with LOCK:
+                    with LOCK, TemporaryFile() as tgz:
+                        self.__write_cache_file(job_cache_file, tgz)
+                        tgz.seek(0, 0)
                         rmtree(extract_path, ignore_errors=True)
                         extract_path.mkdir(parents=True, exist_ok=True)
-                        with tar_open(fileobj=BytesIO(job_cache_file["data"]), mode="r:gz") as tar:
+                        with tar_open(fileobj=tgz, mode="r:gz") as tar:
                             assert isinstance(tar, TarFile)
                             try:
                                 for member in tar.getmembers():
@@ -93,8 +98,18 @@ class Job:
                     continue
                 elif job_cache_file["job_name"] != job_name:
                     continue
+                elif job_cache_file["checksum"] and cache_path.is_file() and file_hash(cache_path) == job_cache_file["checksum"]:
+                    self.logger.debug(f"Cache file {job_cache_file['file_name']} is already up to date")
+                    continue
                 cache_path.parent.mkdir(parents=True, exist_ok=True)
-                cache_path.write_bytes(job_cache_file["data"])
+                # The file is only moved in place once fully written so that a failed restore doesn't leave a truncated file behind
+                tmp_path = cache_path.with_name(f".{cache_path.name}.tmp")
+                try:
+                    with LOCK, tmp_path.open("wb") as f:
+                        self.__write_cache_file(job_cache_file, f)
+                    tmp_path.replace(cache_path)
+                finally:
+                    tmp_path.unlink(missing_ok=True)
                 self.logger.debug(f"Restored cache file {job_cache_file['file_name']}")
             except BaseException as e:
                 self.logger.error(f"Exception while restoring cache file {job_cache_file['file_name']} :\n{e}")
@@ -121,6 +136,13 @@ class Job:
 
         return ret
 
+    def __write_cache_file(self, job_cache_file: Dict[str, Any], f: BinaryIO):
+        """Write the content of the cache file from the database to f chunk by chunk."""
+        for chunk in self.db.iter_job_cache_file(  # type: ignore
+            job_cache_file["job_name"], job_cache_file["file_name"], service_id=job_cache_file["service_id"] or "", plugin_id=job_cache_file["plugin_id"]
+        ):
+            f.write(chunk)
+
     def get_cache(
         self, name: str, *, job_name: str = "", service_id: str = "", plugin_id: str = "", with_info: bool = False, with_data: bool = True
     ) -> Optional[Union[Dict[str, Any], bytes]]:
@@ -170,20 +192,20 @@ class Job:
         ret, err = True, "success"
         cache_path = self.job_path.joinpath(service_id, name)
 
-        if isinstance(file_cache, bytes):
-            content = file_cache
-        else:
-            if isinstance(file_cache, str):
-                file_cache = Path(file_cache)
-            assert isinstance(file_cache, Path)
-            content = file_cache.read_bytes()
+        # Files are copied and stored in the database chunk by chunk instead of being read in memory
+        content = file_cache
+        if isinstance(content, str):
+            content = Path(content)
 
         if not name.startswith("folder:") and (overwrite_file or not cache_path.is_file()):
             cache_path.parent.mkdir(parents=True, exist_ok=True)
-            cache_path.write_bytes(content)
+            if isinstance(content, bytes):
+                cache_path.write_bytes(content)
+            elif content.resolve() != cache_path.resolve():
+                copyfile(content, cache_path)
 
         if not checksum:
-            checksum = bytes_hash(content)
+            checksum = bytes_hash(content) if isinstance(content, bytes) else file_hash(content)
 
         try:
             with LOCK:
@@ -191,8 +213,8 @@ class Job:
                 if err:
                     ret = False
 
-            if ret and isinstance(file_cache, Path) and delete_file and file_cache != cache_path:
-                file_cache.unlink(missing_ok=True)
+            if ret and isinstance(content, Path) and delete_file and content != cache_path:
+                content.unlink(missing_ok=True)
         except:
             return False, f"exception :\n{format_exc()}"
         return ret, err
@@ -204,12 +226,14 @@ class Job:
         assert isinstance(dir_path, Path)
 
         file_name = f"folder:{dir_path.as_posix()}.tgz"
-        content = BytesIO()
-        with tar_open(file_name, mode="w:gz", fileobj=content, compresslevel=9) as tgz:
-            tgz.add(dir_path, arcname=".")
-        content.seek(0, 0)
+        with NamedTemporaryFile(suffix=".tgz", delete=False) as content:
+            with tar_open(file_name, mode="w:gz", fileobj=content, compresslevel=9) as tgz:
+                tgz.add(dir_path, arcname=".")
 
-        return self.cache_file(file_name, content.getvalue(), job_name=job_name, service_id=service_id)
+        try:
+            return self.cache_file(file_name, Path(content.name), job_name=job_name, service_id=service_id)
+        finally:
+            Path(content.name).unlink(missing_ok=True)
 
     def del_cache(self, name: str, *, job_name: str = "", service_id: str = "") -> Tuple[bool, str]:
         """Delete cache file from database and local cache file."""
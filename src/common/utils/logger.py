@@ -60,7 +60,8 @@ def setup_logger(title: str, level: Optional[Union[str, int]] = None) -> Logger:
     else:
         logger.setLevel(level)
 
-    if getenv("SCHEDULER_LOG_TO_FILE", "no") == "yes":
+    # The scheduler's job workers set up the same loggers for each job they run
+    if getenv("SCHEDULER_LOG_TO_FILE", "no") == "yes" and not any(isinstance(handler, FileHandler) for handler in logger.handlers):
         file_handler = FileHandler("/var/log/bunkerweb/scheduler.log")
         file_handler.setFormatter(Formatter("%(asctime)s [%(name)s] [%(process)d] [%(levelname)s] - %(message)s"))
         logger.addHandler(file_handler)
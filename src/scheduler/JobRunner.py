@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+from contextlib import suppress
+from importlib import import_module
+from logging import Logger
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from os import chdir, close, dup, dup2, environ, getcwd, getpid, getppid, pipe, read, sep, write
+from os.path import join
+from queue import Queue
+from runpy import run_path
+from signal import SIG_DFL, SIG_IGN, SIGHUP, SIGINT, SIGTERM, signal
+from sys import argv, modules as sys_modules, path as sys_path, stderr, stdout
+from sysconfig import get_path
+from threading import Thread
+from traceback import format_exc, print_exc
+from typing import Any, Dict, Optional, Tuple
+
+for deps_path in [join(sep, "usr", "share", "bunkerweb", *paths) for paths in (("deps", "python"), ("utils",), ("db",))]:
+    if deps_path not in sys_path:
+        sys_path.append(deps_path)
+
+# Imported once by the scheduler so that the forked workers don't have to import them for each job
+PRELOADED_MODULES = ("requests", "sqlalchemy", "maxminddb", "logger", "common_utils", "jobs", "Database")
+WORKER_DATABASE_URI: Optional[str] = None
+# Size of the end of the output of the jobs that is kept in their run history
+OUTPUT_TAIL_SIZE = 4096
+# Modules imported from these paths (the standard library and the dependencies) are kept between jobs, the other ones are imported again by each job
+SHARED_MODULES_PATHS = tuple(
+    {get_path(name) for name in ("stdlib", "platstdlib", "purelib", "platlib")} | {join(sep, "usr", "share", "bunkerweb", "deps", "python")}
+)
+
+
+def tee_output(src: int, dst: int, tail: bytearray):
+    """Copy what is read from src to dst until EOF and keep the last OUTPUT_TAIL_SIZE bytes of it in tail."""
+    while True:
+        try:
+            chunk = read(src, 65536)
+        except OSError:
+            break
+        if not chunk:
+            break
+
+        with suppress(OSError):
+            view = memoryview(chunk)
+            while view:
+                view = view[write(dst, view) :]  # noqa: E203
+        tail += chunk
+        del tail[:-OUTPUT_TAIL_SIZE]
+
+
+def worker_main(conn: Connection, parent_pid: int, inherited_db: Optional[Any] = None):
+    """Run the Python jobs received on the connection one at a time until the scheduler stops the worker or exits."""
+    # The scheduler handles the signals and stops the workers itself
+    signal(SIGINT, SIG_IGN)
+    signal(SIGHUP, SIG_IGN)
+    signal(SIGTERM, SIG_DFL)
+
+    # The connections of the scheduler's engine must not be used by both processes
+    if inherited_db is not None and inherited_db.sql_engine is not None:
+        inherited_db.sql_engine.dispose(close=False)
+
+    while True:
+        try:
+            if not conn.poll(1):
+                if getppid() != parent_pid:
+                    break
+                continue
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        if request is None:
+            break
+        conn.send(run_job(*request))
+
+
+def run_job(path: str, env: Dict[str, str]) -> Tuple[int, str]:
+    """Run the job like its interpreter would and return its exit code and the end of its output, the environment and argv are the job's own."""
+    global WORKER_DATABASE_URI
+
+    # The job gets a fresh environment, argv and working directory, they're restored for the next job along with the modules it imported
+    original_environ = environ.copy()
+    original_argv = argv.copy()
+    original_sys_path = sys_path.copy()
+    original_modules = set(sys_modules)
+    original_cwd = getcwd()
+    environ.clear()
+    environ.update(env)
+    argv[:] = [path]
+
+    # The jobs get the same Database, and engine, as long as the database URI doesn't change
+    try:
+        import jobs  # type: ignore
+
+        if jobs.DATABASE is None or WORKER_DATABASE_URI != env.get("DATABASE_URI"):
+            from Database import Database  # type: ignore
+            from logger import setup_logger  # type: ignore
+
+            jobs.DATABASE = None
+            jobs.DATABASE = Database(setup_logger("Scheduler", env.get("LOG_LEVEL", "INFO")), sqlalchemy_string=env.get("DATABASE_URI"))
+            WORKER_DATABASE_URI = env.get("DATABASE_URI")
+    except BaseException:
+        # The job will create its own Database
+        print_exc()
+
+    # The output of the job still goes to the scheduler's output but its end is kept for the run history
+    tail = bytearray()
+    read_fd, write_fd = pipe()
+    stdout_fd, stderr_fd = dup(1), dup(2)
+    tee = Thread(target=tee_output, args=(read_fd, stdout_fd, tail), daemon=True)
+    tee.start()
+    stdout.flush()
+    stderr.flush()
+    dup2(write_fd, 1)
+    dup2(write_fd, 2)
+    close(write_fd)
+
+    try:
+        ret = run_path_as_main(path)
+    finally:
+        sys_path[:] = original_sys_path
+        argv[:] = original_argv
+        environ.clear()
+        environ.update(original_environ)
+        with suppress(OSError):
+            chdir(original_cwd)
+        for module in set(sys_modules) - original_modules:
+            module_file = getattr(sys_modules[module], "__file__", None)
+            if module_file and not module_file.startswith(SHARED_MODULES_PATHS):
+                del sys_modules[module]
+        stdout.flush()
+        stderr.flush()
+        dup2(stdout_fd, 1)
+        dup2(stderr_fd, 2)
+        close(stderr_fd)
+        # A process started by the job can still hold the pipe, the copy is then left running
+        tee.join(5)
+        if not tee.is_alive():
+            close(read_fd)
+            close(stdout_fd)
+    return ret, tail.decode("utf-8", "replace")
+
+
+def run_path_as_main(path: str) -> int:
+    """Run the Python file as the __main__ module and return its exit code."""
+    try:
+        run_path(path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        elif isinstance(e.code, int):
+            return e.code
+        print(e.code, file=stderr)
+        return 1
+    except BaseException:
+        print_exc()
+        return 1
+    return 0
+
+
+class JobRunner:
+    """Pool of pre-forked workers running the Python jobs without paying the interpreter startup, the imports and the database setup each time.
+
+    Each worker runs one job at a time and is replaced when a job times out, when it dies or after max_jobs jobs.
+    """
+
+    def __init__(self, workers: int, logger: Logger, *, timeout: Optional[float] = None, max_jobs: int = 100, db: Optional[Any] = None):
+        self.__logger = logger
+        self.__timeout = timeout or None
+        self.__max_jobs = max_jobs
+        self.__db = db
+        self.__context = get_context("fork")
+        self.__idle: Queue = Queue()
+
+        for module in PRELOADED_MODULES:
+            try:
+                import_module(module)
+            except ImportError:
+                self.__logger.debug(f"Can't preload module {module} for the job workers, ignoring it")
+
+        for _ in range(workers):
+            self.__idle.put(self.__start_worker())
+
+    def __start_worker(self) -> Tuple[BaseProcess, Connection, int]:
+        conn, worker_conn = self.__context.Pipe()
+        process = self.__context.Process(target=worker_main, args=(worker_conn, getpid(), self.__db), name="bw-job-worker", daemon=True)
+        process.start()
+        worker_conn.close()
+        return process, conn, 0
+
+    def __stop_worker(self, process: BaseProcess, conn: Connection, *, kill: bool = False):
+        if not kill:
+            with suppress(OSError):
+                conn.send(None)
+            process.join(5)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        conn.close()
+
+    def run(self, path: str, env: Dict[str, Any]) -> Tuple[int, str]:
+        """Run the job in an idle worker and return its exit code, or -1 if it timed out or its worker died, and the end of its output."""
+        process, conn, jobs_count = self.__idle.get()
+        ret = (-1, "")
+        try:
+            conn.send((path, {key: str(value) for key, value in env.items()}))
+            if conn.poll(self.__timeout):
+                ret = conn.recv()
+                jobs_count += 1
+            else:
+                self.__logger.error(f"Job {path} timed out after {self.__timeout} seconds, stopping it")
+                self.__stop_worker(process, conn, kill=True)
+        except (EOFError, OSError):
+            error = format_exc()
+            self.__stop_worker(process, conn, kill=True)
+            self.__logger.error(f"The worker running the job {path} died (exit code {process.exitcode}) :\n{error}")
+        finally:
+            if conn.closed or not process.is_alive() or jobs_count >= self.__max_jobs:
+                if not conn.closed:
+                    self.__stop_worker(process, conn)
+                self.__idle.put(self.__start_worker())
+            else:
+                self.__idle.put((process, conn, jobs_count))
+        return ret
+
+    def close(self):
+        """Stop the idle workers, the busy ones stop on their own once the scheduler exits."""
+        while not self.__idle.empty():
+            process, conn, _ = self.__idle.get_nowait()
+            self.__stop_worker(process, conn)
@@ -11,16 +11,16 @@ from os import cpu_count, environ, getenv, sep
 from os.path import basename, dirname, join
 from pathlib import Path
 from re import match
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Set
 from schedule import (
     Job,
     clear as schedule_clear,
     every as schedule_every,
     jobs as schedule_jobs,
 )
-from subprocess import DEVNULL, PIPE, STDOUT, run
-from sys import path as sys_path
-from threading import Lock, Semaphore, Thread
+from subprocess import DEVNULL, PIPE, STDOUT, Popen, run
+from sys import path as sys_path, stdout
+from threading import Condition, Lock, Semaphore, Thread
 from traceback import format_exc
 
 for deps_path in [join(sep, "usr", "share", "bunkerweb", *paths) for paths in (("utils",), ("db",))]:
@@ -31,6 +31,7 @@ from Database import Database  # type: ignore
 from logger import setup_logger  # type: ignore
 from ApiCaller import ApiCaller  # type: ignore
 from API import API  # type: ignore
+from JobRunner import JobRunner, tee_output
 
 
 class JobScheduler(ApiCaller):
@@ -56,6 +57,10 @@ class JobScheduler(ApiCaller):
         self.__job_success = True
         self.__job_reload = False
         self.__semaphore = Semaphore(cpu_count() or 1)
+        self.__max_parallel_jobs = self.__get_max_parallel_jobs()
+        self.__job_history = self.__get_job_history()
+        self.__job_runner = None
+        self.__setup_job_runner()
 
     @property
     def env(self) -> Dict[str, Any]:
@@ -135,6 +140,16 @@ class JobScheduler(ApiCaller):
                         self.__logger.warning(f"Invalid reload for job {job['name']} in plugin {plugin_name} (Must be true or false), ignoring job")
                         plugin_jobs.pop(x)
                         continue
+                    elif not isinstance(job.get("depends_on", []), list) or not all(
+                        isinstance(dependency, str) and match(r"^[\w.-]{1,128}$", dependency) for dependency in job.get("depends_on", [])
+                    ):
+                        self.__logger.warning(f"Invalid depends_on for job {job['name']} in plugin {plugin_name} (Must be a list of job names), ignoring job")
+                        plugin_jobs.pop(x)
+                        continue
+                    elif type(job.get("weight", 1)) is not int or job.get("weight", 1) < 1:
+                        self.__logger.warning(f"Invalid weight for job {job['name']} in plugin {plugin_name} (Must be an integer greater than 0), ignoring job")
+                        plugin_jobs.pop(x)
+                        continue
 
                     plugin_jobs[x]["path"] = dirname(plugin_file)
 
@@ -145,6 +160,41 @@ class JobScheduler(ApiCaller):
                 self.__logger.warning(f"Exception while getting jobs for plugin {plugin_name} : {format_exc()}")
         return jobs
 
+    def __get_max_parallel_jobs(self) -> int:
+        max_parallel_jobs = getenv("SCHEDULER_MAX_PARALLEL_JOBS", "4")
+        if not max_parallel_jobs.isdigit() or int(max_parallel_jobs) < 1:
+            self.__logger.warning(f"Invalid SCHEDULER_MAX_PARALLEL_JOBS {max_parallel_jobs}, using 4")
+            return 4
+        return int(max_parallel_jobs)
+
+    def __get_job_history(self) -> int:
+        job_history = getenv("SCHEDULER_JOB_HISTORY", "100")
+        if not job_history.isdigit() or int(job_history) < 1:
+            self.__logger.warning(f"Invalid SCHEDULER_JOB_HISTORY {job_history}, using 100")
+            return 100
+        return int(job_history)
+
+    def __setup_job_runner(self):
+        job_workers = getenv("SCHEDULER_JOB_WORKERS", "0")
+        job_timeout = getenv("SCHEDULER_JOB_TIMEOUT", "3600")
+        if not job_workers.isdigit() or not job_timeout.isdigit():
+            self.__logger.warning("Invalid SCHEDULER_JOB_WORKERS or SCHEDULER_JOB_TIMEOUT, running the jobs in subprocesses")
+            return
+        elif int(job_workers) == 0:
+            return
+
+        try:
+            self.__job_runner = JobRunner(int(job_workers), self.__logger, timeout=int(job_timeout), db=self.db)
+            self.__logger.info(f"Running the Python jobs in {job_workers} worker(s)")
+        except BaseException:
+            self.__logger.error(f"Exception while starting the job workers, running the jobs in subprocesses : {format_exc()}")
+
+    def close(self):
+        if self.__job_runner:
+            self.__job_runner.close()
+            self.__job_runner = None
+        self.db.close_changes_feed()
+
     def __str_to_schedule(self, every: str) -> Job:
         if every == "minute":
             return schedule_every().minute
@@ -170,7 +220,7 @@ class JobScheduler(ApiCaller):
                 )
         else:
             self.__logger.info("Reloading nginx ...")
-            reload = self.send_to_apis("POST", "/reload")
+            reload = self.reload_apis()
             if reload:
                 self.__logger.info("Successfully reloaded nginx")
             else:
@@ -181,32 +231,48 @@ class JobScheduler(ApiCaller):
         self.__logger.info(f"Executing job {name} from plugin {plugin} ...")
         success = True
         ret = -1
+        output = ""
+        start_date = datetime.now()
         try:
-            proc = run(join(path, "jobs", file), stdin=DEVNULL, stderr=STDOUT, env=self.__env, check=False)
-            ret = proc.returncode
+            job_runner = self.__job_runner
+            if job_runner and file.endswith(".py"):
+                ret, output = job_runner.run(join(path, "jobs", file), self.__env)
+            else:
+                tail = bytearray()
+                with Popen(join(path, "jobs", file), stdin=DEVNULL, stdout=PIPE, stderr=STDOUT, env=self.__env) as proc:
+                    assert proc.stdout is not None
+                    tee_output(proc.stdout.fileno(), stdout.fileno(), tail)
+                ret = proc.returncode
+                output = tail.decode("utf-8", "replace")
         except BaseException:
             success = False
             self.__logger.error(f"Exception while executing job {name} from plugin {plugin} :\n{format_exc()}")
             with self.__thread_lock:
                 self.__job_success = False
+        end_date = datetime.now()
 
         if ret == 1:
             with self.__thread_lock:
                 self.__job_reload = True
 
-        if self.__job_success and (ret < 0 or ret >= 2):
+        if success and (ret < 0 or ret >= 2):
             success = False
             self.__logger.error(f"Error while executing job {name} from plugin {plugin}")
             with self.__thread_lock:
                 self.__job_success = False
 
-        Thread(target=self.__update_job, args=(plugin, name, success)).start()
+        self.__logger.info(f"Job {name} from plugin {plugin} took {(end_date - start_date).total_seconds():.2f}s")
+        Thread(
+            target=self.__update_job,
+            args=(plugin, name, success),
+            kwargs={"start_date": start_date, "end_date": end_date, "exit_code": ret, "output": output},
+        ).start()
 
         return ret
 
-    def __update_job(self, plugin: str, name: str, success: bool):
+    def __update_job(self, plugin: str, name: str, success: bool, **run: Any):
         with self.__thread_lock:
-            err = self.db.update_job(plugin, name, success)
+            err = self.db.update_job(plugin, name, success, max_runs=self.__job_history, **run)
 
         if not err:
             self.__logger.info(f"Successfully updated database for the job {name} from plugin {plugin}")
@@ -282,27 +348,10 @@ class JobScheduler(ApiCaller):
             self.__logger.error("Database is in read-only mode, jobs will not be executed")
             return True
 
-        threads = []
         self.__job_success = True
         self.__job_reload = False
 
-        plugins = plugins or []
-
-        for plugin, jobs in self.__jobs.items():
-            if plugins and plugin not in plugins:
-                continue
-
-            # Add job to the list of jobs to run in the order they are defined
-            jobs_jobs = [partial(self.__job_wrapper, job["path"], plugin, job["name"], job["file"]) for job in jobs]
-
-            # Create a thread for each plugin
-            threads.append(Thread(target=self.__run_in_thread, args=(jobs_jobs,)))
-
-        for thread in threads:
-            thread.start()
-
-        for thread in threads:
-            thread.join()
+        self.__run_jobs_graph(self.__get_jobs_graph(plugins or []))
 
         ret = self.__job_success
         self.__job_success = True
@@ -337,6 +386,131 @@ class JobScheduler(ApiCaller):
             self.__lock.release()
         return self.__job_success
 
+    def __get_jobs_graph(self, plugins: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Build the graph of the jobs to run : jobs of plugins that don't declare any dependency keep running in the order they are defined."""
+        all_jobs = {job["name"] for jobs in self.__jobs.values() for job in jobs}
+        graph = {}
+
+        for plugin, jobs in self.__jobs.items():
+            if plugins and plugin not in plugins:
+                continue
+
+            ordered = not any("depends_on" in job for job in jobs)
+            for x, job in enumerate(jobs):
+                depends_on = set(job.get("depends_on", []))
+                if ordered and x > 0:
+                    depends_on.add(jobs[x - 1]["name"])
+
+                for dependency in depends_on - all_jobs:
+                    self.__logger.warning(f"Job {job['name']} from plugin {plugin} depends on the unknown job {dependency}, ignoring the dependency")
+
+                graph[job["name"]] = {
+                    "plugin": plugin,
+                    "job": partial(self.__job_wrapper, job["path"], plugin, job["name"], job["file"]),
+                    "weight": min(job.get("weight", 1), self.__max_parallel_jobs),
+                    "depends_on": depends_on,
+                    # Only the declared dependencies need to succeed, the jobs ordered by their definition run like before
+                    "requires": set(job.get("depends_on", [])),
+                }
+
+        # Dependencies that are not part of this run (filtered plugins) are already satisfied
+        for node in graph.values():
+            node["depends_on"] &= graph.keys()
+            node["requires"] &= graph.keys()
+        return graph
+
+    def __get_critical_paths(self, graph: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+        """Return the length of the longest chain of jobs waiting on each job so that the jobs on the critical path are started first.
+
+        Jobs that are part of a dependency cycle, or that depend on one, are left out.
+        """
+        dependents = {name: [] for name in graph}
+        for name, node in graph.items():
+            for dependency in node["depends_on"]:
+                dependents[dependency].append(name)
+
+        order = []
+        remaining = {name: len(node["depends_on"]) for name, node in graph.items()}
+        to_visit = [name for name, count in remaining.items() if count == 0]
+        while to_visit:
+            name = to_visit.pop()
+            order.append(name)
+            for dependent in dependents[name]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    to_visit.append(dependent)
+
+        critical_paths = {}
+        for name in reversed(order):
+            critical_paths[name] = 1 + max((critical_paths.get(dependent, 0) for dependent in dependents[name]), default=0)
+        return critical_paths
+
+    def __run_jobs_graph(self, graph: Dict[str, Dict[str, Any]]):
+        """Run the jobs as soon as their dependencies are done while the sum of the weights of the running jobs stays under the max parallelism.
+
+        Jobs depending on a job that failed, or that was skipped, are skipped.
+        """
+        critical_paths = self.__get_critical_paths(graph)
+        cycle = graph.keys() - critical_paths.keys()
+        if cycle:
+            self.__logger.error(f"Jobs {', '.join(sorted(cycle))} have circular dependencies or depend on such jobs, they will not be executed")
+            with self.__thread_lock:
+                self.__job_success = False
+
+        condition = Condition()
+        remaining: Dict[str, Set[str]] = {name: set(graph[name]["depends_on"]) for name in critical_paths}
+        ready = [name for name, depends_on in remaining.items() if not depends_on]
+        failed: Set[str] = set()
+        threads = []
+        running_weight = 0
+
+        def release(name: str):
+            # Called with the condition held once the job is done or skipped
+            for other, depends_on in remaining.items():
+                if name not in depends_on:
+                    continue
+
+                depends_on.discard(name)
+                if name in failed and name in graph[other]["requires"]:
+                    failed.add(other)
+
+                if not depends_on:
+                    if other in failed:
+                        self.__logger.error(f"Job {other} from plugin {graph[other]['plugin']} will not be executed because a job it depends on failed")
+                        with self.__thread_lock:
+                            self.__job_success = False
+                        release(other)
+                    else:
+                        ready.append(other)
+
+        def run_job(name: str):
+            nonlocal running_weight
+            ret = -1
+            try:
+                ret = graph[name]["job"]()
+            finally:
+                with condition:
+                    running_weight -= graph[name]["weight"]
+                    if ret < 0 or ret >= 2:
+                        failed.add(name)
+                    release(name)
+                    condition.notify()
+
+        with condition:
+            while ready or running_weight:
+                ready.sort(key=lambda name: (critical_paths[name], graph[name]["weight"]), reverse=True)
+                # The jobs are started in priority order so that heavy jobs are not starved by lighter ones
+                while ready and running_weight + graph[ready[0]]["weight"] <= self.__max_parallel_jobs:
+                    name = ready.pop(0)
+                    running_weight += graph[name]["weight"]
+                    thread = Thread(target=run_job, args=(name,), name=f"job-{name}")
+                    threads.append(thread)
+                    thread.start()
+                condition.wait()
+
+        for thread in threads:
+            thread.join()
+
     def __run_in_thread(self, jobs: list):
         self.__semaphore.acquire(timeout=60)
         for job in jobs:
@@ -16,27 +16,31 @@ from stat import S_IEXEC
 from subprocess import run as subprocess_run, DEVNULL, STDOUT, PIPE
 from sys import path as sys_path
 from tarfile import TarFile, open as tar_open
+from tempfile import TemporaryFile
 from threading import Event, Thread
-from time import sleep
+from time import monotonic, sleep
 from traceback import format_exc
-from typing import Any, Dict, List, Literal, Optional, Union
+from typing import Any, BinaryIO, Dict, List, Literal, Optional, Union
 
-for deps_path in [join(sep, "usr", "share", "bunkerweb", *paths) for paths in (("deps", "python"), ("utils",), ("api",), ("db",))]:
+for deps_path in [join(sep, "usr", "share", "bunkerweb", *paths) for paths in (("deps", "python"), ("utils",), ("api",), ("db",), ("gen",))]:
     if deps_path not in sys_path:
         sys_path.append(deps_path)
 
 from dotenv import dotenv_values
 
-from common_utils import bytes_hash, dict_to_frozenset, get_integration  # type: ignore
+from common_utils import bytes_hash, dict_to_frozenset, file_hash, get_integration  # type: ignore
 from logger import setup_logger  # type: ignore
 from Database import Database  # type: ignore
 from JobScheduler import JobScheduler
 from jobs import Job  # type: ignore
 from API import API  # type: ignore
+from Configurator import Configurator  # type: ignore
+from generator import generate, load_registry, reload_nginx, wait_for_nginx  # type: ignore
 
 APPLYING_CHANGES = Event()
 RUN = True
 SCHEDULER: Optional[JobScheduler] = None
+GENERATOR_REGISTRY: Optional[Configurator] = None
 
 CACHE_PATH = Path(sep, "var", "cache", "bunkerweb")
 CACHE_PATH.mkdir(parents=True, exist_ok=True)
@@ -73,15 +77,29 @@ FAILOVER_PATH.mkdir(parents=True, exist_ok=True)
 
 HEALTHY_PATH = TMP_PATH.joinpath("scheduler.healthy")
 
-SCHEDULER_TMP_ENV_PATH = TMP_PATH.joinpath("scheduler.env")
-SCHEDULER_TMP_ENV_PATH.touch()
-
 DB_LOCK_FILE = Path(sep, "var", "lib", "bunkerweb", "db.lock")
 logger = setup_logger("Scheduler", getenv("LOG_LEVEL", "INFO"))
+generator_logger = setup_logger("Generator", getenv("LOG_LEVEL", "INFO"))
 
 SLAVE_MODE = environ.get("SLAVE_MODE", "no") == "yes"
 MASTER_MODE = environ.get("MASTER_MODE", "no") == "yes"
 
+# Changes are applied once the database has been quiet for RELOAD_DEBOUNCE seconds, or RELOAD_MAX_WAIT seconds after the first one
+RELOAD_DEBOUNCE = environ.get("SCHEDULER_RELOAD_DEBOUNCE", "1")
+RELOAD_MAX_WAIT = environ.get("SCHEDULER_RELOAD_MAX_WAIT", "10")
+if not RELOAD_DEBOUNCE.replace(".", "", 1).isdigit() or not RELOAD_MAX_WAIT.replace(".", "", 1).isdigit():
+    logger.warning(f"Invalid SCHEDULER_RELOAD_DEBOUNCE ({RELOAD_DEBOUNCE}) or SCHEDULER_RELOAD_MAX_WAIT ({RELOAD_MAX_WAIT}), using 1 and 10")
+    RELOAD_DEBOUNCE, RELOAD_MAX_WAIT = "1", "10"
+RELOAD_DEBOUNCE = float(RELOAD_DEBOUNCE)
+RELOAD_MAX_WAIT = float(RELOAD_MAX_WAIT)
+
+# The scheduler is multithreaded, its render workers are forked so they're only used when asked for
+GENERATOR_WORKERS = environ.get("SCHEDULER_GENERATOR_WORKERS", "1")
+if not GENERATOR_WORKERS.isdigit() or int(GENERATOR_WORKERS) < 1:
+    logger.warning(f"Invalid SCHEDULER_GENERATOR_WORKERS ({GENERATOR_WORKERS}), using 1")
+    GENERATOR_WORKERS = "1"
+GENERATOR_WORKERS = int(GENERATOR_WORKERS)
+
 
 def handle_stop(signum, frame):
     current_time = datetime.now()
@@ -94,6 +112,7 @@ def handle_stop(signum, frame):
 
     if SCHEDULER is not None:
         SCHEDULER.clear()
+        SCHEDULER.close()
     stop(0)
 
 
@@ -311,10 +330,21 @@ def generate_external_plugins(original_path: Union[Path, str] = EXTERNAL_PLUGINS
         send_nginx_external_plugins(original_path)
 
 
+def write_job_cache_file(job_cache_file: Dict[str, Any], f: BinaryIO):
+    """Write the content of the job cache file from the database to f chunk by chunk."""
+    assert SCHEDULER is not None
+
+    for chunk in SCHEDULER.db.iter_job_cache_file(
+        job_cache_file["job_name"], job_cache_file["file_name"], service_id=job_cache_file["service_id"] or "", plugin_id=job_cache_file["plugin_id"]
+    ):
+        f.write(chunk)
+
+
 def generate_caches():
     assert SCHEDULER is not None
 
-    job_cache_files = SCHEDULER.db.get_jobs_cache_files()
+    # Only the metadata is loaded at once, the content of each file is then streamed from the database
+    job_cache_files = SCHEDULER.db.get_jobs_cache_files(with_data=False)
     plugin_cache_files = set()
     ignored_dirs = set()
 
@@ -329,22 +359,35 @@ def generate_caches():
                 if job_cache_file["file_name"].startswith("folder:"):
                     extract_path = Path(job_cache_file["file_name"].split("folder:", 1)[1].rsplit(".tgz", 1)[0])
                 ignored_dirs.add(extract_path.as_posix())
-                rmtree(extract_path, ignore_errors=True)
-                extract_path.mkdir(parents=True, exist_ok=True)
-                with tar_open(fileobj=BytesIO(job_cache_file["data"]), mode="r:gz") as tar:
-                    assert isinstance(tar, TarFile)
-                    try:
-                        for member in tar.getmembers():
-                            try:
-                                tar.extract(member, path=extract_path)
-                            except Exception as e:
-                                logger.error(f"Error extracting {member.name}: {e}")
-                    except Exception as e:
-                        logger.error(f"Error extracting tar file: {e}")
+                with TemporaryFile() as tgz:
+                    write_job_cache_file(job_cache_file, tgz)
+                    tgz.seek(0, 0)
+                    rmtree(extract_path, ignore_errors=True)
+                    extract_path.mkdir(parents=True, exist_ok=True)
+                    with tar_open(fileobj=tgz, mode="r:gz") as tar:
+                        assert isinstance(tar, TarFile)
+                        try:
+                            for member in tar.getmembers():
+                                try:
+                                    tar.extract(member, path=extract_path)
+                                except Exception as e:
+                                    logger.error(f"Error extracting {member.name}: {e}")
+                        except Exception as e:
+                            logger.error(f"Error extracting tar file: {e}")
                 logger.debug(f"Restored cache directory {extract_path}")
                 continue
+            elif job_cache_file["checksum"] and cache_path.is_file() and file_hash(cache_path) == job_cache_file["checksum"]:
+                logger.debug(f"Cache file {job_cache_file['file_name']} is already up to date")
+                continue
             cache_path.parent.mkdir(parents=True, exist_ok=True)
-            cache_path.write_bytes(job_cache_file["data"])
+            # The file is only moved in place once fully written so that a failed restore doesn't leave a truncated file behind
+            tmp_path = cache_path.with_name(f".{cache_path.name}.tmp")
+            try:
+                with tmp_path.open("wb") as f:
+                    write_job_cache_file(job_cache_file, f)
+                tmp_path.replace(cache_path)
+            finally:
+                tmp_path.unlink(missing_ok=True)
             logger.debug(f"Restored cache file {job_cache_file['file_name']}")
         except BaseException as e:
             logger.error(f"Exception while restoring cache file {job_cache_file['file_name']} :\n{e}")
@@ -368,6 +411,20 @@ def generate_caches():
                 rmtree(file, ignore_errors=True)
 
 
+def generate_configs(env: Dict[str, Any], *, reload_registry: bool = False) -> bool:
+    """Run the config generator in-process, reusing the settings and plugins already loaded unless reload_registry is set."""
+    global GENERATOR_REGISTRY
+
+    try:
+        if GENERATOR_REGISTRY is None or reload_registry:
+            GENERATOR_REGISTRY = load_registry(generator_logger)
+        generate(env, CONFIG_PATH.as_posix(), logger=generator_logger, registry=GENERATOR_REGISTRY, workers=GENERATOR_WORKERS)
+    except BaseException:
+        logger.error(f"Exception while generating the config : {format_exc()}")
+        return False
+    return True
+
+
 def api_to_instance(api):
     hostname_port = api.endpoint.replace("http://", "").replace("https://", "").replace("/", "").split(":")
     return {
@@ -405,29 +462,10 @@ def run_in_slave_mode():
         thread.join()
 
     # Gen config
-    content = ""
-    for k, v in env.items():
-        content += f"{k}={v}\n"
-    SCHEDULER_TMP_ENV_PATH.write_text(content)
-    proc = subprocess_run(
-        [
-            "python3",
-            join(sep, "usr", "share", "bunkerweb", "gen", "main.py"),
-            "--settings",
-            join(sep, "usr", "share", "bunkerweb", "settings.json"),
-            "--templates",
-            join(sep, "usr", "share", "bunkerweb", "confs"),
-            "--output",
-            CONFIG_PATH.as_posix(),
-            "--variables",
-            str(SCHEDULER_TMP_ENV_PATH),
-        ],
-        stdin=DEVNULL,
-        stderr=STDOUT,
-        check=False,
-    )
-    if proc.returncode != 0:
+    if not generate_configs(env):
         logger.error("Config generator failed, configuration will not work as expected...")
+    elif INTEGRATION not in ("Autoconf", "Swarm", "Kubernetes", "Docker"):
+        reload_nginx(generator_logger)
 
     # TODO : check nginx status + check DB status
     while True:
@@ -697,6 +735,7 @@ if __name__ == "__main__":
         del dotenv_env
 
         CONFIG_NEED_GENERATION = True
+        REGISTRY_NEED_RELOAD = False
         RUN_JOBS_ONCE = True
         CHANGES = []
 
@@ -719,31 +758,8 @@ if __name__ == "__main__":
                         generate_caches()
 
             if CONFIG_NEED_GENERATION:
-                content = ""
-                for k, v in env.items():
-                    content += f"{k}={v}\n"
-                SCHEDULER_TMP_ENV_PATH.write_text(content)
-                # run the generator
-                proc = subprocess_run(
-                    [
-                        "python3",
-                        join(sep, "usr", "share", "bunkerweb", "gen", "main.py"),
-                        "--settings",
-                        join(sep, "usr", "share", "bunkerweb", "settings.json"),
-                        "--templates",
-                        join(sep, "usr", "share", "bunkerweb", "confs"),
-                        "--output",
-                        CONFIG_PATH.as_posix(),
-                        "--variables",
-                        str(SCHEDULER_TMP_ENV_PATH),
-                    ]
-                    + (["--no-linux-reload"] if MASTER_MODE else []),
-                    stdin=DEVNULL,
-                    stderr=STDOUT,
-                    check=False,
-                )
-
-                if proc.returncode != 0:
+                # run the generator, nginx is reloaded below
+                if not generate_configs(env, reload_registry=REGISTRY_NEED_RELOAD):
                     logger.error("Config generator failed, configuration will not work as expected...")
                 else:
                     copy(str(nginx_variables_path), join(sep, "var", "tmp", "bunkerweb", "variables.env"))
@@ -767,19 +783,21 @@ if __name__ == "__main__":
                     for thread in threads:
                         thread.join()
 
-                    failed = not SCHEDULER.send_to_apis("POST", "/reload")
+                    failed = not SCHEDULER.reload_apis()
                 elif INTEGRATION == "Linux":
-                    # Reload nginx
-                    logger.info("Reloading nginx ...")
-                    proc = subprocess_run(
-                        [join(sep, "usr", "sbin", "nginx"), "-s", "reload"],
-                        stdin=DEVNULL,
-                        stderr=STDOUT,
-                        env=env.copy(),
-                        check=False,
-                        stdout=PIPE,
-                    )
-                    failed = proc.returncode != 0
+                    # Reload nginx, once it's started as it can still be starting on the first start
+                    failed = True
+                    if wait_for_nginx(logger):
+                        logger.info("Reloading nginx ...")
+                        proc = subprocess_run(
+                            [join(sep, "usr", "sbin", "nginx"), "-s", "reload"],
+                            stdin=DEVNULL,
+                            stderr=STDOUT,
+                            env=env.copy(),
+                            check=False,
+                            stdout=PIPE,
+                        )
+                        failed = proc.returncode != 0
                 else:
                     logger.warning("No BunkerWeb instance found, skipping bunkerweb reload ...")
 
@@ -810,6 +828,7 @@ if __name__ == "__main__":
                             for thread in tmp_threads:
                                 thread.join()
 
+                        # All the instances are reloaded at once to go back to the last working configuration as fast as possible
                         SCHEDULER.send_to_apis("POST", "/reload")
                 else:
                     logger.info("Successfully reloaded bunkerweb")
@@ -833,6 +852,7 @@ if __name__ == "__main__":
             NEED_RELOAD = False
             RUN_JOBS_ONCE = False
             CONFIG_NEED_GENERATION = False
+            REGISTRY_NEED_RELOAD = False
             CONFIGS_NEED_GENERATION = False
             PLUGINS_NEED_GENERATION = False
             PRO_PLUGINS_NEED_GENERATION = False
@@ -860,10 +880,22 @@ if __name__ == "__main__":
             # infinite schedule for the jobs
             logger.info("Executing job scheduler ...")
             errors = 0
-            while RUN and not NEED_RELOAD:
+            first_change_time = last_change_time = 0.0
+            while RUN:
                 try:
+                    # Wait for more changes until the database is quiet so that a burst of changes is applied in a single reload
+                    wait_time = 3 if SCHEDULER.db.readonly else 1
+                    if NEED_RELOAD:
+                        remaining_time = min(last_change_time + RELOAD_DEBOUNCE, first_change_time + RELOAD_MAX_WAIT) - monotonic()
+                        if remaining_time <= 0:
+                            break
+                        wait_time = min(wait_time, remaining_time)
+
                     SCHEDULER.run_pending()
-                    sleep(3 if SCHEDULER.db.readonly else 1)
+
+                    # Wait for the database to notify a change instead of checking it each time, the pending jobs are run in the meantime
+                    if not SCHEDULER.db.wait_for_changes(wait_time, poll_interval=wait_time):
+                        continue
                     current_time = datetime.now()
 
                     while DB_LOCK_FILE.is_file() and DB_LOCK_FILE.stat().st_ctime + 30 > current_time.timestamp():
@@ -928,7 +960,7 @@ if __name__ == "__main__":
                         CONFIG_NEED_GENERATION = True
                         RUN_JOBS_ONCE = True
                         NEED_RELOAD = True
-                        changed_plugins = list(changes["plugins_config_changed"])
+                        changed_plugins = sorted(set(changed_plugins) | set(changes["plugins_config_changed"]))
 
                     # check if the instances have changed since last time
                     if changes["instances_changed"] and (
@@ -943,6 +975,13 @@ if __name__ == "__main__":
                         CONFIG_NEED_GENERATION = True
                         NEED_RELOAD = True
 
+                    if NEED_RELOAD and changes != old_changes:
+                        last_change_time = monotonic()
+                        if not first_change_time:
+                            first_change_time = last_change_time
+                        elif RELOAD_DEBOUNCE:
+                            logger.info("Coalescing the new changes with the pending ones ...")
+
                     old_changes = changes.copy()
                 except BaseException:
                     logger.debug(format_exc())
@@ -970,11 +1009,13 @@ if __name__ == "__main__":
                     CHANGES.append("external_plugins")
                     generate_external_plugins()
                     SCHEDULER.update_jobs()
+                    REGISTRY_NEED_RELOAD = True
 
                 if PRO_PLUGINS_NEED_GENERATION:
                     CHANGES.append("pro_plugins")
                     generate_external_plugins(PRO_PLUGINS_PATH)
                     SCHEDULER.update_jobs()
+                    REGISTRY_NEED_RELOAD = True
 
                 if CONFIG_NEED_GENERATION:
                     CHANGES.append("config")
@@ -2364,7 +2364,13 @@ def bans():
 @app.route("/jobs", methods=["GET"])
 @login_required
 def jobs():
-    return render_template("jobs.html", jobs=app.config["DB"].get_jobs(), jobs_errors=app.config["DB"].get_plugins_errors(), username=current_user.get_id())
+    return render_template(
+        "jobs.html",
+        jobs=app.config["DB"].get_jobs(),
+        jobs_errors=app.config["DB"].get_plugins_errors(),
+        jobs_stats=app.config["DB"].get_jobs_runs_stats(),
+        username=current_user.get_id(),
+    )
 
 
 @app.route("/jobs/download", methods=["GET"])
@@ -8,11 +8,12 @@ echo "ℹ️ Extracting ClamAV plugin ..."
 
 cp -r bunkerweb-plugins/clamav /plugins/
 
-echo "ℹ️ Extracting settings.json file, db and core directory ..."
+echo "ℹ️ Extracting settings.json file, db, utils and core directory ..."
 
 cp bunkerweb/settings.json /bunkerweb/
 cp -r bunkerweb/core /bunkerweb/
 cp -r bunkerweb/db /bunkerweb/
+cp -r bunkerweb/utils /bunkerweb/
 
 chown -R root:101 /plugins /bunkerweb
 chmod -R 777 /plugins /bunkerweb
@@ -1,12 +1,14 @@
 from contextlib import contextmanager
+from datetime import datetime, timedelta
 from glob import iglob
 from hashlib import sha256
 from json import dumps, load
+from logging import getLogger
 from os import environ, getenv
 from os.path import dirname, join
 from pathlib import Path
 from re import compile as re_compile
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.exc import (
     ArgumentError,
     DatabaseError,
@@ -14,10 +16,16 @@ from sqlalchemy.exc import (
     SQLAlchemyError,
 )
 from sqlalchemy.orm import scoped_session, sessionmaker
+from sys import path as sys_path
 from traceback import format_exc
 from time import sleep
 
+for deps_path in [join(dirname(__file__), "bunkerweb", *paths) for paths in (("db",), ("utils",))]:
+    if deps_path not in sys_path:
+        sys_path.append(deps_path)
+
 from bunkerweb.db.model import (
+    Blob_chunks,
     Custom_configs,
     Global_values,
     Jobs,
@@ -28,6 +36,7 @@ from bunkerweb.db.model import (
     Services_settings,
     Settings,
 )
+from Database import Database  # type: ignore # noqa: E402
 
 try:
     database_uri = getenv("DATABASE_URI", "sqlite:////var/lib/bunkerweb/db.sqlite3")
@@ -445,6 +454,101 @@ try:
 
     print("✅ All jobs are in the database and have successfully ran", flush=True)
     print(" ", flush=True)
+    print("ℹ️ Checking the number of queries used to get the jobs and their cache files ...", flush=True)
+
+    db = Database(getLogger("DATABASE"), database_uri)
+    statements = []
+    event.listen(db.sql_engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+
+    db.get_jobs()
+    if len(statements) != 1:
+        print(f"❌ Getting the jobs took {len(statements)} queries instead of 1, exiting ...\n{dumps(statements, indent=2)}", flush=True)
+        exit(1)
+
+    statements.clear()
+    db.get_jobs_cache_files(with_data=False)
+    if len(statements) != 1:
+        print(f"❌ Getting the jobs cache files took {len(statements)} queries instead of 1, exiting ...\n{dumps(statements, indent=2)}", flush=True)
+        exit(1)
+    elif "bw_jobs_cache.data" in statements[0]:
+        print(f"❌ Getting the jobs cache files metadata loaded their data, exiting ...\n{statements[0]}", flush=True)
+        exit(1)
+
+    print("✅ The jobs and their cache files are fetched with a single query", flush=True)
+    print(" ", flush=True)
+    print("ℹ️ Checking the retention and the statistics of the runs of the jobs ...", flush=True)
+
+    start_date = datetime.now()
+    for duration, success in ((4, True), (7, False), (1, True), (2, False), (10, True)):
+        err = db.update_job(
+            jobs[0].plugin_id,
+            jobs[0].name,
+            success,
+            start_date=start_date,
+            end_date=start_date + timedelta(seconds=duration),
+            exit_code=0 if success else 2,
+            max_runs=3,
+        )
+        if err:
+            print(f"❌ Can't record the run of the job {jobs[0].name}, exiting ...\n{err}", flush=True)
+            exit(1)
+
+    runs = db.get_job_runs(jobs[0].name)
+    if [run["duration"] for run in runs] != [10, 2, 1]:
+        print(f"❌ The job {jobs[0].name} didn't keep its last 3 runs, exiting ...\n{dumps(runs, indent=2)}", flush=True)
+        exit(1)
+
+    stats = db.get_jobs_runs_stats(jobs[0].name).get(jobs[0].name, {})
+    expected_stats = {"runs": 3, "failures": 1, "last_duration": 10, "p50": 2, "p90": 8.4, "p99": 9.84, "max": 10}
+    if any(abs(stats.get(key, -1) - value) > 1e-6 for key, value in expected_stats.items()):
+        print(f"❌ The statistics of the runs of the job {jobs[0].name} are wrong, exiting ...\n{stats} != {expected_stats}", flush=True)
+        exit(1)
+
+    print("✅ The runs of the jobs are trimmed to their history and their percentiles are interpolated", flush=True)
+    print(" ", flush=True)
+    print("ℹ️ Checking that the job cache files share their blobs, which are deleted when unused and stored again when reused ...", flush=True)
+
+    # Spans 2 chunks of the blob store
+    payload = b"bunkerweb" * 200_000
+    blob_id = sha256(payload).hexdigest()
+
+    def get_blob_chunks() -> int:
+        with db_session() as session:
+            return session.query(Blob_chunks).filter_by(blob_id=blob_id).count()
+
+    for file_name in ("bw-test-1.bin", "bw-test-2.bin"):
+        err = db.upsert_job_cache(None, file_name, payload, job_name=jobs[0].name)
+        if err:
+            print(f"❌ Can't save the cache file {file_name} of the job {jobs[0].name}, exiting ...\n{err}", flush=True)
+            exit(1)
+
+    if get_blob_chunks() != 2:
+        print(f"❌ The cache files don't share the same 2 chunks, exiting ...\nchunks: {get_blob_chunks()}", flush=True)
+        exit(1)
+
+    db.delete_job_cache("bw-test-1.bin", job_name=jobs[0].name)
+    if get_blob_chunks() != 2:
+        print("❌ The blob still used by a cache file was deleted, exiting ...", flush=True)
+        exit(1)
+
+    db.delete_job_cache("bw-test-2.bin", job_name=jobs[0].name)
+    if get_blob_chunks() != 0:
+        print("❌ The unused blob wasn't deleted, exiting ...", flush=True)
+        exit(1)
+
+    err = db.upsert_job_cache(None, "bw-test-1.bin", payload, job_name=jobs[0].name)
+    if err:
+        print(f"❌ Can't save the cache file bw-test-1.bin of the job {jobs[0].name} again, exiting ...\n{err}", flush=True)
+        exit(1)
+    elif get_blob_chunks() != 2 or db.get_job_cache_file(jobs[0].name, "bw-test-1.bin") != payload:
+        print("❌ The deleted blob wasn't stored again when reused, exiting ...", flush=True)
+        exit(1)
+
+    db.delete_job_cache("bw-test-1.bin", job_name=jobs[0].name)
+    db.sql_engine.dispose()
+
+    print("✅ The blobs of the job cache files are shared, deleted when unused and stored again when reused", flush=True)
+    print(" ", flush=True)
     print("ℹ️ Checking if all plugin pages are in the database ...", flush=True)
 
     def file_hash(file: str) -> str:
@@ -320,6 +320,9 @@ if [ "$integration" == "docker" ] ; then
     elif ! [[ -d "init/bunkerweb/db" ]]; then
         echo "💾 BunkerWeb's database directory not found ❌"
         exit 1
+    elif ! [[ -d "init/bunkerweb/utils" ]]; then
+        echo "💾 BunkerWeb's utils directory not found ❌"
+        exit 1
     elif ! [[ -f "init/bunkerweb/settings.json" ]]; then
         echo "💾 BunkerWeb's settings file not found ❌"
         exit 1
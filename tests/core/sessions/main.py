@@ -72,6 +72,54 @@ try:
             exit(1)
 
         sleep(5)
+
+        print("ℹ️ Reloading BunkerWeb asynchronously ...", flush=True)
+
+        response = post("http://192.168.0.2:5000/reload", params={"async": "yes"}, headers={"Host": "bwapi"})
+
+        if response.status_code != 200:
+            print("❌ An error occurred when reloading BunkerWeb asynchronously, exiting ...", flush=True)
+            exit(1)
+
+        data = response.json()
+
+        if data["status"] != "success":
+            print("❌ An error occurred when reloading BunkerWeb asynchronously, exiting ...", flush=True)
+            exit(1)
+        elif not isinstance(data.get("data"), dict) or "id" not in data["data"]:
+            print(f"❌ The asynchronous reload didn't return its state, exiting ...\n{data}", flush=True)
+            exit(1)
+
+        reload_id = data["data"]["id"]
+        state = data["data"]
+        retries = 0
+
+        print("ℹ️ Waiting for the end of the reload ...", flush=True)
+
+        while state.get("status") == "running":
+            if retries > 60:
+                print("❌ The reload took too long to finish, exiting ...", flush=True)
+                exit(1)
+
+            retries += 1
+            sleep(1)
+
+            # The API can be briefly unavailable while Nginx reloads
+            with suppress(RequestException):
+                response = get("http://192.168.0.2:5000/reload/status", headers={"Host": "bwapi"})
+                if response.status_code == 200:
+                    state = response.json().get("data")
+                    if not isinstance(state, dict) or state.get("id") != reload_id:
+                        print(f"❌ The status of the reload is not the one that was started, exiting ...\n{response.json()}", flush=True)
+                        exit(1)
+
+        if state.get("status") != "success":
+            print(f"❌ An error occurred when reloading BunkerWeb, exiting ...\n{state}", flush=True)
+            exit(1)
+
+        print("✅ BunkerWeb was reloaded asynchronously", flush=True)
+
+        sleep(5)
     else:
         proc = run(["sudo", "systemctl", "restart", "bunkerweb"], check=False)
         if proc.returncode != 0:
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+from logging import getLogger
+from os import urandom
+from pathlib import Path
+from sys import path as sys_path
+from tempfile import TemporaryDirectory
+from traceback import format_exc
+
+ROOT_PATH = Path(__file__).resolve().parents[2]
+
+for deps_path in (ROOT_PATH.joinpath("src", "common", "utils"), ROOT_PATH.joinpath("src", "common", "db")):
+    if deps_path.as_posix() not in sys_path:
+        sys_path.append(deps_path.as_posix())
+
+from Database import Database  # type: ignore # noqa: E402
+from model import Blob_chunks, Jobs, Jobs_cache, Plugins, Services  # type: ignore # noqa: E402
+
+try:
+    with TemporaryDirectory() as tmp_dir:
+        db = Database(getLogger("DATABASE"), f"sqlite:///{Path(tmp_dir).joinpath('db.sqlite3').as_posix()}")
+        db.BLOB_CHUNK_SIZE = 1000
+        _, err = db.init_tables([], "1.5.12")
+        if err:
+            print(f"❌ Can't initialize the database, exiting ...\n{err}", flush=True)
+            exit(1)
+
+        with db.sql_engine.begin() as conn:
+            conn.execute(Plugins.__table__.insert().values(id="test", name="Test", description="Test", version="1.0"))
+            conn.execute(Jobs.__table__.insert().values(name="test-job", plugin_id="test", file_name="test.py", every="day", reload=False))
+            conn.execute(Services.__table__.insert().values(id="www.example.com", method="scheduler"))
+
+        print("ℹ️ Checking that a global cache file doesn't match the one of a service ...", flush=True)
+
+        err = db.upsert_job_cache("www.example.com", "service.txt", b"service", job_name="test-job")
+        if err:
+            print(f"❌ Can't save the cache file of the service, exiting ...\n{err}", flush=True)
+            exit(1)
+        elif db.get_job_cache_file("test-job", "service.txt") is not None or list(db.iter_job_cache_file("test-job", "service.txt")):
+            print("❌ The cache file of the service was returned as the global one, exiting ...", flush=True)
+            exit(1)
+        elif db.get_job_cache_file("test-job", "service.txt", service_id="www.example.com") != b"service":
+            print("❌ The cache file of the service can't be read, exiting ...", flush=True)
+            exit(1)
+
+        print("✅ The global cache file doesn't match the one of a service", flush=True)
+        print("ℹ️ Checking that a corrupted cache file is not streamed as a valid one ...", flush=True)
+
+        content = urandom(3500)
+        db.upsert_job_cache(None, "file.bin", content, job_name="test-job")
+        if b"".join(db.iter_job_cache_file("test-job", "file.bin")) != content:
+            print("❌ The cache file wasn't streamed entirely, exiting ...", flush=True)
+            exit(1)
+
+        with db.sql_engine.begin() as conn:
+            blob_id = conn.execute(Jobs_cache.__table__.select().where(Jobs_cache.file_name == "file.bin")).first().blob_id
+            conn.execute(Blob_chunks.__table__.delete().where(Blob_chunks.blob_id == blob_id, Blob_chunks.position == 2))
+
+        def is_streamed() -> bool:
+            try:
+                list(db.iter_job_cache_file("test-job", "file.bin"))
+            except ValueError:
+                return False
+            return True
+
+        if is_streamed():
+            print("❌ The truncated cache file was streamed as a valid one, exiting ...", flush=True)
+            exit(1)
+
+        with db.sql_engine.begin() as conn:
+            conn.execute(Blob_chunks.__table__.insert().values(blob_id=blob_id, position=2, data=bytes(500)))
+
+        if is_streamed():
+            print("❌ The modified cache file was streamed as a valid one, exiting ...", flush=True)
+            exit(1)
+
+        print("✅ The corrupted cache file is not streamed as a valid one", flush=True)
+except SystemExit:
+    exit(1)
+except:
+    print(f"❌ Something went wrong, exiting ...\n{format_exc()}", flush=True)
+    exit(1)
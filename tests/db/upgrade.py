@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+from logging import getLogger
+from pathlib import Path
+from sys import path as sys_path
+from tempfile import TemporaryDirectory
+from traceback import format_exc
+
+ROOT_PATH = Path(__file__).resolve().parents[2]
+
+for deps_path in (ROOT_PATH.joinpath("src", "common", "utils"), ROOT_PATH.joinpath("src", "common", "db")):
+    if deps_path.as_posix() not in sys_path:
+        sys_path.append(deps_path.as_posix())
+
+from sqlalchemy import Column, ForeignKey, MetaData, Table, create_engine, inspect  # noqa: E402
+
+from Database import Database  # type: ignore # noqa: E402
+from model import Base  # type: ignore # noqa: E402
+
+# Tables and columns added to the 1.5.12 schema without a version change
+NEW_TABLES = ("bw_blobs", "bw_blob_chunks", "bw_jobs_runs", "bw_config_version")
+NEW_COLUMNS = ("blob_id",)
+
+try:
+    with TemporaryDirectory() as tmp_dir:
+        database_uri = f"sqlite:///{Path(tmp_dir).joinpath('db.sqlite3').as_posix()}"
+
+        print("ℹ️ Creating a 1.5.12 database without the blob store ...", flush=True)
+
+        old_metadata = MetaData()
+        for table in Base.metadata.sorted_tables:
+            if table.name not in NEW_TABLES:
+                columns = [
+                    Column(
+                        column.name,
+                        column.type,
+                        *[ForeignKey(foreign_key.target_fullname) for foreign_key in column.foreign_keys],
+                        primary_key=column.primary_key,
+                        nullable=column.nullable,
+                        default=column.default.arg if column.default is not None else None,
+                    )
+                    for column in table.columns
+                    if column.name not in NEW_COLUMNS
+                ]
+                Table(table.name, old_metadata, *columns)
+
+        engine = create_engine(database_uri)
+        old_metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(old_metadata.tables["bw_metadata"].insert().values(id=1, is_initialized=True, first_config_saved=True, version="1.5.12"))
+            conn.execute(old_metadata.tables["bw_plugins"].insert().values(id="test", name="Test", description="Test", version="1.0", data=b"archive"))
+            conn.execute(old_metadata.tables["bw_jobs"].insert().values(name="test-job", plugin_id="test", file_name="test.py", every="day", reload=False))
+            conn.execute(old_metadata.tables["bw_jobs_cache"].insert().values(job_name="test-job", file_name="legacy.txt", data=b"legacy"))
+        engine.dispose()
+
+        db = Database(getLogger("DATABASE"), database_uri)
+        _, err = db.init_tables([], "1.5.12")
+        if err:
+            print(f"❌ Can't upgrade the database, exiting ...\n{err}", flush=True)
+            exit(1)
+
+        inspector = inspect(db.sql_engine)
+        for table_name in ("bw_plugins", "bw_jobs_cache"):
+            if "blob_id" not in {column["name"] for column in inspector.get_columns(table_name)}:
+                print(f"❌ The column blob_id wasn't added to the table {table_name}, exiting ...", flush=True)
+                exit(1)
+        missing_tables = set(NEW_TABLES) - set(inspector.get_table_names())
+        if missing_tables:
+            print(f"❌ The tables {', '.join(sorted(missing_tables))} weren't created, exiting ...", flush=True)
+            exit(1)
+
+        print("✅ The missing tables and columns were added", flush=True)
+        print("ℹ️ Checking that the data saved before the upgrade is still available ...", flush=True)
+
+        if db.get_job_cache_file("test-job", "legacy.txt") != b"legacy":
+            print("❌ The cache file saved before the upgrade can't be read, exiting ...", flush=True)
+            exit(1)
+        elif [plugin["data"] for plugin in db.get_plugins(with_data=True) if plugin["id"] == "test"] != [b"archive"]:
+            print("❌ The plugin saved before the upgrade can't be read, exiting ...", flush=True)
+            exit(1)
+
+        err = db.upsert_job_cache(None, "legacy.txt", b"new", job_name="test-job")
+        if err:
+            print(f"❌ Can't update the cache file saved before the upgrade, exiting ...\n{err}", flush=True)
+            exit(1)
+        elif db.get_job_cache_file("test-job", "legacy.txt") != b"new":
+            print("❌ The cache file saved before the upgrade wasn't updated, exiting ...", flush=True)
+            exit(1)
+
+        print("✅ The data saved before the upgrade is still available and can be updated", flush=True)
+except SystemExit:
+    exit(1)
+except:
+    print(f"❌ Something went wrong, exiting ...\n{format_exc()}", flush=True)
+    exit(1)
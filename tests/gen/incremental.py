@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+from filecmp import cmpfiles
+from os import walk
+from pathlib import Path
+from sys import path as sys_path
+from tempfile import TemporaryDirectory
+from traceback import format_exc
+from typing import Any, Dict, List, Set
+
+ROOT_PATH = Path(__file__).resolve().parents[2]
+
+for deps_path in (ROOT_PATH.joinpath("misc", "benchmarks"), ROOT_PATH.joinpath("src", "common", "gen"), ROOT_PATH.joinpath("src", "common", "utils")):
+    if deps_path.as_posix() not in sys_path:
+        sys_path.append(deps_path.as_posix())
+
+from Templator import Templator  # type: ignore # noqa: E402
+from utils import generate_variables, get_configurator, get_templator_args  # type: ignore # noqa: E402
+
+
+def list_files(path: Path) -> Set[str]:
+    return {
+        Path(dirpath, filename).relative_to(path).as_posix()
+        for dirpath, _, filenames in walk(path)
+        for filename in filenames
+        if filename != Templator.MANIFEST_NAME
+    }
+
+
+def render(output: Path, plugins: Path, custom_confs: Path, config: Dict[str, Any], incremental: bool) -> List[str]:
+    args = get_templator_args(output)
+    args[2] = plugins.as_posix()
+    return Templator(*args, config, incremental=incremental, workers=1, custom_confs=custom_confs.as_posix()).render()
+
+
+def check_same_output(step: str, tmp_path: Path, config: Dict[str, Any]):
+    """Render the config incrementally over the previous output and fully in a new directory, then compare both outputs."""
+    incremental_output = tmp_path.joinpath("incremental")
+    full_output = tmp_path.joinpath(f"full-{step}")
+    render(incremental_output, tmp_path.joinpath("plugins"), tmp_path.joinpath("configs"), config, True)
+    render(full_output, tmp_path.joinpath("plugins"), tmp_path.joinpath("configs"), config, False)
+
+    files = list_files(full_output)
+    if list_files(incremental_output) != files:
+        print(f"❌ The incremental render doesn't have the same files as the full one after {step}, exiting ...", flush=True)
+        exit(1)
+
+    _, mismatch, errors = cmpfiles(incremental_output, full_output, sorted(files), shallow=False)
+    if mismatch or errors:
+        print(f"❌ The incremental render differs from the full one after {step}, exiting ...\nfiles: {mismatch + errors}", flush=True)
+        exit(1)
+
+
+try:
+    with TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        lines_path = tmp_path.joinpath("lines.list")
+        lines_path.write_text("first\n")
+
+        # A plugin with a per-server template reading a file
+        plugin_confs = tmp_path.joinpath("plugins", "test", "confs", "server-http")
+        plugin_confs.mkdir(parents=True)
+        plugin_confs.joinpath("lines.conf").write_text(f'{{% for line in read_lines("{lines_path.as_posix()}") %}}{{{{ line }}}}\n{{% endfor %}}')
+        tmp_path.joinpath("configs").mkdir()
+
+        variables = generate_variables(4)
+        config = get_configurator(variables).get_config()
+
+        print("ℹ️ Rendering the config incrementally ...", flush=True)
+
+        check_same_output("the first render", tmp_path, config)
+        check_same_output("a render without changes", tmp_path, config)
+
+        print("✅ The incremental render is the same as the full one", flush=True)
+        print("ℹ️ Checking the incremental render after a change of the settings of another service ...", flush=True)
+
+        config = get_configurator(variables | {"app1.example.com_COOKIE_FLAGS": "* SameSite=Strict"}).get_config()
+        check_same_output("a change of the settings of another service", tmp_path, config)
+
+        print("✅ The incremental render is the same as the full one", flush=True)
+        print("ℹ️ Checking the incremental render after a change of a file read by a template ...", flush=True)
+
+        lines_path.write_text("first\nsecond\n")
+        check_same_output("a change of a file read by a template", tmp_path, config)
+
+        print("✅ The incremental render is the same as the full one", flush=True)
+        print("ℹ️ Checking the incremental render after the addition of a custom config ...", flush=True)
+
+        custom_conf_path = tmp_path.joinpath("configs", "modsec", "app0.example.com", "test.conf")
+        custom_conf_path.parent.mkdir(parents=True)
+        custom_conf_path.write_text("SecRuleEngine DetectionOnly\n")
+        check_same_output("the addition of a custom config", tmp_path, config)
+
+        print("✅ The incremental render is the same as the full one", flush=True)
+except SystemExit:
+    exit(1)
+except:
+    print(f"❌ Something went wrong, exiting ...\n{format_exc()}", flush=True)
+    exit(1)
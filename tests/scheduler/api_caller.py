@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from os import environ
+from pathlib import Path
+from sys import path as sys_path
+from threading import Thread
+from time import time
+from traceback import format_exc
+from typing import List
+
+ROOT_PATH = Path(__file__).resolve().parents[2]
+
+for deps_path in (ROOT_PATH.joinpath("src", "common", "utils"), ROOT_PATH.joinpath("src", "common", "api")):
+    if deps_path.as_posix() not in sys_path:
+        sys_path.append(deps_path.as_posix())
+
+environ["SCHEDULER_RELOAD_BATCH_SIZE"] = "2"
+environ["SCHEDULER_RELOAD_TIMEOUT"] = "10"
+environ["SCHEDULER_RELOAD_HEALTH_TIMEOUT"] = "5"
+
+from API import API  # type: ignore # noqa: E402
+from ApiCaller import ApiCaller  # type: ignore # noqa: E402
+
+
+class FakeInstance(ThreadingHTTPServer):
+    """API of an instance reloading asynchronously : the reload stays running for a while then succeeds, fails its config test or is replaced by another one."""
+
+    def __init__(self, fail: bool = False):
+        super().__init__(("127.0.0.1", 0), FakeInstanceHandler)
+        self.fail = fail
+        self.replaced = False
+        self.reloads = 0
+        self.state = None
+        Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def api(self) -> API:
+        return API(f"http://127.0.0.1:{self.server_address[1]}")
+
+
+class FakeInstanceHandler(BaseHTTPRequestHandler):
+    server: FakeInstance
+
+    def log_message(self, format: str, *args):
+        pass
+
+    def __respond(self, status: int, msg):
+        body = {"status": "success" if status == 200 else "error", "msg": msg}
+        if isinstance(msg, dict):
+            body = {"status": "success", "msg": "success", "data": msg}
+        data = dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path != "/reload?async=yes":
+            return self.__respond(404, "not found")
+        self.server.reloads += 1
+        self.server.state = {"id": f"{time()}-{self.server.reloads}", "status": "running", "started": time()}
+        self.__respond(200, self.server.state)
+
+    def do_GET(self):
+        if self.path == "/ping":
+            return self.__respond(200, "pong")
+        elif self.path != "/reload/status":
+            return self.__respond(404, "not found")
+        elif self.server.state is None:
+            return self.__respond(404, "no reload")
+
+        if self.server.state["status"] == "running" and time() - self.server.state["started"] >= 1:
+            self.server.state |= {"status": "error" if self.server.fail else "success", "finished": time()}
+            self.server.state["msg"] = "config check failed" if self.server.fail else "reload successful"
+            if self.server.replaced:
+                self.server.state["id"] += "-other"
+        self.__respond(200, self.server.state)
+
+
+def reload_instances(strategy: str, instances: List[FakeInstance]) -> bool:
+    environ["SCHEDULER_RELOAD_STRATEGY"] = strategy
+    return ApiCaller([instance.api for instance in instances]).reload_apis()
+
+
+instances = []
+
+try:
+    print("ℹ️ Checking that a rolling reload reloads all the instances ...", flush=True)
+
+    instances = [FakeInstance() for _ in range(4)]
+    if not reload_instances("rolling", instances):
+        print("❌ The rolling reload failed, exiting ...", flush=True)
+        exit(1)
+    elif [instance.reloads for instance in instances] != [1, 1, 1, 1]:
+        print(f"❌ Not all the instances were reloaded once, exiting ...\nreloads: {[instance.reloads for instance in instances]}", flush=True)
+        exit(1)
+
+    print("✅ The rolling reload reloaded all the instances", flush=True)
+    print("ℹ️ Checking that a rolling reload stops at the first batch with a failed reload ...", flush=True)
+
+    for instance in instances:
+        instance.reloads = 0
+    instances[1].fail = True
+    if reload_instances("rolling", instances):
+        print("❌ The failure of the reload wasn't reported, exiting ...", flush=True)
+        exit(1)
+    elif [instance.reloads for instance in instances] != [1, 1, 0, 0]:
+        print(f"❌ The instances after the failed batch were reloaded, exiting ...\nreloads: {[instance.reloads for instance in instances]}", flush=True)
+        exit(1)
+
+    print("✅ The rolling reload stopped at the failed batch", flush=True)
+    print("ℹ️ Checking that a failed reload is reported when all the instances are reloaded at once ...", flush=True)
+
+    if reload_instances("all", instances):
+        print("❌ The failure of the reload wasn't reported, exiting ...", flush=True)
+        exit(1)
+
+    print("✅ The failed reload is reported", flush=True)
+    print("ℹ️ Checking that a reload which status was replaced by another reload is not taken as successful ...", flush=True)
+
+    instances[1].fail = False
+    instances[0].replaced = True
+    if reload_instances("all", instances):
+        print("❌ The reload with an unknown result was taken as successful, exiting ...", flush=True)
+        exit(1)
+
+    print("✅ The reload with an unknown result is reported", flush=True)
+except SystemExit:
+    exit(1)
+except:
+    print(f"❌ Something went wrong, exiting ...\n{format_exc()}", flush=True)
+    exit(1)
+finally:
+    for instance in instances:
+        instance.shutdown()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+from logging import getLogger
+from os import getcwd
+from pathlib import Path
+from sys import path as sys_path
+from tempfile import TemporaryDirectory
+from traceback import format_exc
+
+ROOT_PATH = Path(__file__).resolve().parents[2]
+
+for deps_path in (ROOT_PATH.joinpath("src", "scheduler"), ROOT_PATH.joinpath("src", "common", "utils"), ROOT_PATH.joinpath("src", "common", "db")):
+    if deps_path.as_posix() not in sys_path:
+        sys_path.append(deps_path.as_posix())
+
+from JobRunner import JobRunner  # type: ignore # noqa: E402
+
+runner = None
+
+try:
+    with TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        env = {"DATABASE_URI": f"sqlite:///{tmp_path.joinpath('db.sqlite3').as_posix()}", "LOG_LEVEL": "WARNING"}
+        jobs_path = tmp_path.joinpath("jobs")
+        jobs_path.mkdir()
+
+        def write_job(name: str, content: str) -> str:
+            job_path = jobs_path.joinpath(name)
+            job_path.write_text(content)
+            return job_path.as_posix()
+
+        write_job("job_helper.py", "CALLS = 0\n")
+        ok_job = write_job("ok.py", "from os import getpid\nprint(f'pid={getpid()}', flush=True)\nexit(3)\n")
+        sleep_job = write_job("sleep.py", "from time import sleep\nsleep(30)\n")
+        crash_job = write_job("crash.py", "from os import _exit\n_exit(1)\n")
+        leak_job = write_job(
+            "leak.py",
+            """from os import chdir, environ, getpid
+from os.path import dirname
+from sys import path
+
+path.insert(0, dirname(__file__))
+environ["BW_TEST_LEAK"] = "yes"
+chdir("/")
+
+import job_helper
+
+job_helper.CALLS += 1
+print(f"pid={getpid()}", flush=True)
+""",
+        )
+        check_job = write_job(
+            "check.py",
+            f"""from os import environ, getcwd, getpid
+from os.path import dirname
+from sys import argv, path
+
+print(f"pid={{getpid()}}", flush=True)
+if "BW_TEST_LEAK" in environ:
+    exit("the environment of the previous job leaked")
+if environ.get("CHECK_VAR") != "yes":
+    exit("the environment of the job is missing")
+if getcwd() != {getcwd()!r}:
+    exit(f"the working directory of the previous job leaked : {{getcwd()}}")
+if dirname(__file__) in path:
+    exit("the sys.path of the previous job leaked")
+if argv != [__file__]:
+    exit(f"argv is not the job's own : {{argv}}")
+
+path.insert(0, dirname(__file__))
+import job_helper
+
+if job_helper.CALLS != 0:
+    exit("the modules imported by the previous job leaked")
+""",
+        )
+
+        runner = JobRunner(1, getLogger("JobRunner"), timeout=5)
+
+        print("ℹ️ Running a job ...", flush=True)
+
+        ret, output = runner.run(ok_job, env)
+        if ret != 3 or "pid=" not in output:
+            print(f"❌ The job didn't return its exit code and output, exiting ...\nret: {ret}, output: {output}", flush=True)
+            exit(1)
+        worker_pid = output.strip().split("pid=")[-1]
+
+        print("✅ The job returned its exit code and output", flush=True)
+        print("ℹ️ Checking that the jobs run by the same worker are isolated ...", flush=True)
+
+        ret, output = runner.run(leak_job, env)
+        if ret != 0 or output.strip().split("pid=")[-1] != worker_pid:
+            print(f"❌ The job didn't run in the same worker, exiting ...\nret: {ret}, output: {output}", flush=True)
+            exit(1)
+
+        ret, output = runner.run(check_job, env | {"CHECK_VAR": "yes"})
+        if ret != 0 or not output.strip().startswith(f"pid={worker_pid}"):
+            print(f"❌ The job isn't isolated from the previous one, exiting ...\nret: {ret}, output: {output}", flush=True)
+            exit(1)
+
+        print("✅ The jobs run by the same worker are isolated", flush=True)
+        print("ℹ️ Checking that a job timing out is stopped ...", flush=True)
+
+        ret, _ = runner.run(sleep_job, env)
+        if ret != -1:
+            print(f"❌ The job didn't time out, exiting ...\nret: {ret}", flush=True)
+            exit(1)
+
+        ret, output = runner.run(ok_job, env)
+        if ret != 3 or output.strip().split("pid=")[-1] == worker_pid:
+            print(f"❌ The worker of the job that timed out wasn't replaced, exiting ...\nret: {ret}, output: {output}", flush=True)
+            exit(1)
+        worker_pid = output.strip().split("pid=")[-1]
+
+        print("✅ The job timing out was stopped and its worker replaced", flush=True)
+        print("ℹ️ Checking that a job crashing its worker is reported ...", flush=True)
+
+        ret, _ = runner.run(crash_job, env)
+        if ret != -1:
+            print(f"❌ The crash of the worker wasn't reported, exiting ...\nret: {ret}", flush=True)
+            exit(1)
+
+        ret, output = runner.run(ok_job, env)
+        if ret != 3 or output.strip().split("pid=")[-1] == worker_pid:
+            print(f"❌ The worker that crashed wasn't replaced, exiting ...\nret: {ret}, output: {output}", flush=True)
+            exit(1)
+
+        print("✅ The crash of the worker was reported and the worker replaced", flush=True)
+except SystemExit:
+    exit(1)
+except:
+    print(f"❌ Something went wrong, exiting ...\n{format_exc()}", flush=True)
+    exit(1)
+finally:
+    if runner is not None:
+        runner.close()
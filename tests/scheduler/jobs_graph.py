@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+from logging import getLogger
+from os import environ
+from pathlib import Path
+from sys import path as sys_path
+from threading import Lock
+from time import sleep
+from traceback import format_exc
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+ROOT_PATH = Path(__file__).resolve().parents[2]
+
+for deps_path in (
+    ROOT_PATH.joinpath("src", "scheduler"),
+    ROOT_PATH.joinpath("src", "common", "utils"),
+    ROOT_PATH.joinpath("src", "common", "db"),
+    ROOT_PATH.joinpath("src", "common", "api"),
+):
+    if deps_path.as_posix() not in sys_path:
+        sys_path.append(deps_path.as_posix())
+
+environ["SCHEDULER_MAX_PARALLEL_JOBS"] = "2"
+environ["SCHEDULER_JOB_WORKERS"] = "0"
+
+from JobScheduler import JobScheduler  # type: ignore # noqa: E402
+
+
+class FakeJobs:
+    """Replace the execution of the jobs and record what ran, and how many ran at the same time."""
+
+    def __init__(self, scheduler: JobScheduler, jobs: Dict[str, List[Dict[str, Any]]], exit_codes: Dict[str, int]):
+        self.__lock = Lock()
+        self.__weights = {job["name"]: min(job.get("weight", 1), 2) for plugin_jobs in jobs.values() for job in plugin_jobs}
+        self.__exit_codes = exit_codes
+        self.running_weight = 0
+        self.max_running_weight = 0
+        self.executed: List[str] = []
+
+        scheduler._JobScheduler__jobs = jobs
+        scheduler._JobScheduler__job_wrapper = self.run
+
+    def run(self, path: str, plugin: str, name: str, file: str) -> int:
+        with self.__lock:
+            self.running_weight += self.__weights[name]
+            self.max_running_weight = max(self.max_running_weight, self.running_weight)
+            self.executed.append(name)
+        sleep(0.1)
+        with self.__lock:
+            self.running_weight -= self.__weights[name]
+        return self.__exit_codes.get(name, 0)
+
+
+def job(name: str, **kwargs: Any) -> Dict[str, Any]:
+    return {"name": name, "file": f"{name}.py", "path": "", "every": "once", "reload": False} | kwargs
+
+
+def run_graph(jobs: Dict[str, List[Dict[str, Any]]], exit_codes: Dict[str, int] = {}):
+    scheduler = JobScheduler({}, getLogger("Scheduler"), db=SimpleNamespace())
+    fake_jobs = FakeJobs(scheduler, jobs, exit_codes)
+    scheduler._JobScheduler__job_success = True
+    scheduler._JobScheduler__run_jobs_graph(scheduler._JobScheduler__get_jobs_graph([]))
+    return fake_jobs, scheduler._JobScheduler__job_success
+
+
+try:
+    print("ℹ️ Checking that the jobs with circular dependencies are not executed ...", flush=True)
+
+    fake_jobs, success = run_graph(
+        {"plugin1": [job("job1", depends_on=["job2"]), job("job2", depends_on=["job1"]), job("job3", depends_on=["job1"])], "plugin2": [job("job4")]}
+    )
+    if success or fake_jobs.executed != ["job4"]:
+        print(f"❌ The jobs with circular dependencies were executed or not reported, exiting ...\nexecuted: {fake_jobs.executed}, success: {success}", flush=True)
+        exit(1)
+
+    print("✅ The jobs with circular dependencies are not executed", flush=True)
+    print("ℹ️ Checking that the unknown dependencies are ignored ...", flush=True)
+
+    fake_jobs, success = run_graph({"plugin1": [job("job1", depends_on=["unknown"]), job("job2", depends_on=["job1"])]})
+    if not success or fake_jobs.executed != ["job1", "job2"]:
+        print(f"❌ The unknown dependency wasn't ignored, exiting ...\nexecuted: {fake_jobs.executed}, success: {success}", flush=True)
+        exit(1)
+
+    print("✅ The unknown dependencies are ignored", flush=True)
+    print("ℹ️ Checking that the weight of the running jobs stays under SCHEDULER_MAX_PARALLEL_JOBS ...", flush=True)
+
+    fake_jobs, success = run_graph(
+        {
+            "plugin1": [job(f"job{x}", depends_on=[]) for x in range(1, 6)],
+            "plugin2": [job("heavy", depends_on=[], weight=10)],
+        }
+    )
+    if not success or sorted(fake_jobs.executed) != ["heavy", "job1", "job2", "job3", "job4", "job5"]:
+        print(f"❌ Not all the jobs were executed, exiting ...\nexecuted: {fake_jobs.executed}, success: {success}", flush=True)
+        exit(1)
+    elif fake_jobs.max_running_weight != 2:
+        print(f"❌ The jobs didn't run with a weight of 2 at most, exiting ...\nmax running weight: {fake_jobs.max_running_weight}", flush=True)
+        exit(1)
+
+    print("✅ The weight of the running jobs stays under SCHEDULER_MAX_PARALLEL_JOBS", flush=True)
+    print("ℹ️ Checking that the jobs depending on a failed job are skipped ...", flush=True)
+
+    fake_jobs, success = run_graph(
+        {
+            "plugin1": [job("job1"), job("job2", depends_on=["job1"]), job("job3", depends_on=["job2"]), job("job4", depends_on=[])],
+            "plugin2": [job("job5"), job("job6")],
+        },
+        {"job1": 2, "job5": 2},
+    )
+    if success:
+        print("❌ The failure of the jobs wasn't reported, exiting ...", flush=True)
+        exit(1)
+    elif sorted(fake_jobs.executed) != ["job1", "job4", "job5", "job6"]:
+        print(f"❌ The jobs depending on a failed job weren't skipped, exiting ...\nexecuted: {fake_jobs.executed}", flush=True)
+        exit(1)
+
+    print("✅ The jobs depending on a failed job are skipped, the jobs only ordered after it are not", flush=True)
+except SystemExit:
+    exit(1)
+except:
+    print(f"❌ Something went wrong, exiting ...\n{format_exc()}", flush=True)
+    exit(1)